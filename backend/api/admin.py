@@ -1,16 +1,34 @@
 from django.contrib import admin
-from .models import Conversation, KnowledgeGraph
+from .models import Conversation, ConversationGraph, KnowledgeGraph, GraphJob, Message
+
+class MessageInline(admin.TabularInline):
+    model = Message
+    fields = ('sequence', 'role', 'content', 'created_at')
+    readonly_fields = ('created_at',)
+    extra = 0
 
 @admin.register(Conversation)
 class ConversationAdmin(admin.ModelAdmin):
     list_display = ('id', 'user_id', 'created_at')
     list_filter = ('user_id', 'created_at')
-    search_fields = ('transcript',)
+    search_fields = ('messages__content',)
     readonly_fields = ('created_at',)
+    inlines = [MessageInline]
 
 @admin.register(KnowledgeGraph)
 class KnowledgeGraphAdmin(admin.ModelAdmin):
-    list_display = ('id', 'conversation_id', 'created_at')
+    list_display = ('id', 'conversation_id', 'version', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('graph_data',)
-    readonly_fields = ('created_at',)
\ No newline at end of file
+    readonly_fields = ('created_at',)
+
+@admin.register(ConversationGraph)
+class ConversationGraphAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation_id', 'version', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+@admin.register(GraphJob)
+class GraphJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation_id', 'status', 'attempts', 'updated_at')
+    list_filter = ('status', 'created_at')
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,227 @@
+"""Local stand-ins for the upstream clients, used by tests and benchmarks."""
+
+import asyncio
+import io
+import math
+import random
+import threading
+import time
+import wave
+from types import SimpleNamespace
+
+import numpy as np
+
+
+def lognormal_latency(median, p99=None, seed=None):
+    """Sampler of delays in seconds, lognormal with the given median and 99th percentile.
+
+    Upstream latencies are long-tailed, so a fixed sleep understates the
+    tail; `p99` defaults to three times the median.
+    """
+    if median <= 0:
+        return lambda: 0.0
+    sigma = math.log((p99 or median * 3) / median) / 2.326
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def sample():
+        with lock:
+            return rng.lognormvariate(math.log(median), sigma)
+    return sample
+
+
+def _wait(latency):
+    if latency is not None:
+        time.sleep(latency())
+
+
+def make_wav(segments, rate=48000, channels=2):
+    """16-bit WAV of (seconds, amplitude) segments of a 440 Hz tone over faint noise"""
+    rng = np.random.default_rng(0)
+    parts = []
+    for seconds, amplitude in segments:
+        t = np.arange(int(seconds * rate)) / rate
+        parts.append(amplitude * np.sin(2 * np.pi * 440 * t) + rng.normal(0, 0.0005, len(t)))
+    samples = np.repeat(np.concatenate(parts)[:, None], channels, axis=1)
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((samples * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+class FakeNeo4jResult:
+    def consume(self):
+        return None
+
+    def __iter__(self):
+        return iter([])
+
+
+class FakeNeo4jTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwargs):
+        self.driver.queries.append((query, dict(parameters or {}, **kwargs)))
+        return FakeNeo4jResult()
+
+
+class FakeNeo4jSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        pass
+
+    def run(self, query, parameters=None, **kwargs):
+        # An auto-commit query is a full round trip of its own
+        self.driver.round_trips += 1
+        return FakeNeo4jTransaction(self.driver).run(query, parameters, **kwargs)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        # A managed transaction is sent and committed in a single round trip
+        _wait(self.driver.latency)
+        self.driver.round_trips += 1
+        self.driver.transactions += 1
+        return transaction_function(FakeNeo4jTransaction(self.driver), *args, **kwargs)
+
+    execute_read = execute_write
+
+
+class FakeNeo4jDriver:
+    """Records every query and counts round trips instead of talking to Neo4j"""
+
+    def __init__(self, latency=None):
+        self.latency = latency
+        self.queries = []
+        self.sessions = 0
+        self.transactions = 0
+        self.round_trips = 0
+        self.closed = False
+
+    def session(self, **kwargs):
+        self.sessions += 1
+        return FakeNeo4jSession(self)
+
+    def verify_connectivity(self):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+def _recognition_result(transcript, is_final=True):
+    return SimpleNamespace(
+        alternatives=[SimpleNamespace(transcript=transcript, confidence=0.9)],
+        is_final=is_final
+    )
+
+
+class FakeSpeechClient:
+    """Speech client that "recognises" audio bytes as UTF-8 text.
+
+    Each streamed chunk produces an interim result with everything heard so
+    far, and the end of the stream produces the final result. With
+    `transcript` set, every recognised clip returns it instead.
+    """
+
+    def __init__(self, transcript=None, latency=None):
+        self.transcript = transcript
+        self.latency = latency
+        self.requests = []
+
+    def recognize(self, config, audio, **kwargs):
+        _wait(self.latency)
+        self.requests.append((config, audio))
+        transcript = self.transcript or audio.content.decode('utf-8', errors='ignore').strip()
+        results = [_recognition_result(transcript)] if transcript else []
+        return SimpleNamespace(results=results)
+
+    def streaming_recognize(self, config, requests, **kwargs):
+        heard = ''
+        for request in requests:
+            heard += request.audio_content.decode('utf-8', errors='ignore')
+            yield SimpleNamespace(results=[_recognition_result(heard.strip(), is_final=False)])
+        if heard.strip():
+            yield SimpleNamespace(results=[_recognition_result(heard.strip())])
+
+
+class FakeOpenAIClient:
+    """Chat completions client that answers with queued message contents.
+
+    `contents` may instead be a function from the request to the content.
+    """
+
+    def __init__(self, contents, latency=None, keep_requests=True):
+        self.contents = contents if callable(contents) else list(contents)
+        self.latency = latency
+        self.keep_requests = keep_requests
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **request):
+        _wait(self.latency)
+        if self.keep_requests:
+            self.requests.append(request)
+        content = self.contents(request) if callable(self.contents) else self.contents.pop(0)
+        message = SimpleNamespace(content=content, refusal=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakeTTSClient:
+    """Text-to-speech client returning silent "audio" sized like real MP3 output"""
+
+    # About 4 KB of 32 kbps MP3 per second of speech, at ~15 characters a second
+    BYTES_PER_CHARACTER = 270
+
+    def __init__(self, latency=None):
+        self.latency = latency
+
+    def synthesize_speech(self, input, voice, audio_config, **kwargs):
+        _wait(self.latency)
+        return SimpleNamespace(audio_content=bytes(len(input.text) * self.BYTES_PER_CHARACTER))
+
+
+class FlakyCall:
+    """Upstream call with scripted behaviour per attempt.
+
+    Each outcome is a number of seconds to wait before answering, or an
+    exception instance to raise. Used as `fn(timeout)` with Upstream.call;
+    `acall` is the coroutine version for Upstream.acall.
+    """
+
+    def __init__(self, outcomes, result='ok'):
+        self.outcomes = list(outcomes)
+        self.result = result
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self):
+        with self._lock:
+            outcome = self.outcomes[min(self.calls, len(self.outcomes) - 1)]
+            self.calls += 1
+            return outcome
+
+    def __call__(self, timeout):
+        outcome = self._next()
+        if isinstance(outcome, Exception):
+            raise outcome
+        time.sleep(outcome)
+        return self.result
+
+    async def acall(self, timeout):
+        outcome = self._next()
+        if isinstance(outcome, Exception):
+            raise outcome
+        await asyncio.sleep(outcome)
+        return self.result
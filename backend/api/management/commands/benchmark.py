@@ -0,0 +1,396 @@
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, redirect_stdout
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from ...fakes import (
+    FakeNeo4jDriver,
+    FakeOpenAIClient,
+    FakeSpeechClient,
+    FakeTTSClient,
+    lognormal_latency,
+    make_wav,
+)
+from ...models import Message
+from ...services.client_registry import registry
+from ...services.conversation_service import ConversationService
+from ...services.graph_jobs import graph_job_queue
+from ...services.graph_service import KnowledgeGraphService
+from ...services.openai_service import OpenAIService
+from ...services.stt_service import STTService
+from ...services.tts_service import TTSService
+from ...utils.metrics import STAGE_SECONDS
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+SCENARIOS = ('voice', 'chat', 'history')
+BENCHMARK_USER_ID = 1
+
+REPLY = (
+    "Kyoto is best in late autumn, when the maples turn. Stay near Gion so the "
+    "temples are walkable, and book a ryokan early for the busy weeks."
+)
+TOPICS = [
+    {'topic': 'Kyoto', 'related_topics': ['Autumn Foliage', 'Gion'], 'relationship_type': 'relates to'},
+    {'topic': 'Ryokan', 'related_topics': ['Kyoto'], 'relationship_type': 'located in'},
+]
+
+
+def _fake_completion(request):
+    """Plausible content for each kind of request the OpenAI service makes"""
+    if 'response_format' in request:
+        return json.dumps({'reply': REPLY, 'topics': TOPICS})
+    if 'topic extraction' in request['messages'][0]['content']:
+        return json.dumps(TOPICS)
+    return REPLY
+
+
+def percentile(values, q):
+    """The q-th percentile (0-100) of `values`, by linear interpolation"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values):
+    """p50/p95/p99 and max of durations in seconds, reported in milliseconds"""
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        **{f'p{q}': round(percentile(values, q) * 1000, 2) for q in (50, 95, 99)},
+        'max': round(max(values) * 1000, 2)
+    }
+
+
+def parse_server_timing(header):
+    """{stage: seconds} from a Server-Timing header"""
+    stages = {}
+    for entry in filter(None, (part.strip() for part in header.split(','))):
+        name, _, params = entry.partition(';')
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'dur':
+                stages[name.strip()] = float(value) / 1000
+    return stages
+
+
+def _latency_option(value):
+    """'median[,p99]' in seconds"""
+    try:
+        parts = [float(part) for part in value.split(',')]
+    except ValueError:
+        raise CommandError(f"Latency must be 'median[,p99]' in seconds, got '{value}'")
+    if len(parts) not in (1, 2) or any(part < 0 for part in parts):
+        raise CommandError(f"Latency must be 'median[,p99]' in seconds, got '{value}'")
+    return parts
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive voice_input, chat_response and get_conversation_history at a given "
+        "concurrency against fake upstreams with realistic latency, and report "
+        "throughput, per-stage latency percentiles and memory as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+        parser.add_argument('--requests', type=int, default=100, help="Requests per scenario")
+        parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once")
+        parser.add_argument('--warmup', type=int, default=5, help="Untimed requests per scenario")
+        parser.add_argument('--seed-conversations', type=int, default=50,
+                            help="Conversations created before the run for chat and history")
+        parser.add_argument('--audio-seconds', type=float, default=4.0, help="Length of the voice clip")
+        parser.add_argument('--openai-latency', default='0.8,3', help="median[,p99] seconds")
+        parser.add_argument('--stt-latency', default='0.5,1.5', help="median[,p99] seconds")
+        parser.add_argument('--tts-latency', default='0.3,1', help="median[,p99] seconds")
+        parser.add_argument('--neo4j-latency', default='0.01,0.05', help="median[,p99] seconds")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the latency samplers")
+        parser.add_argument('--existing-db', action='store_true',
+                            help="Run against the configured database instead of a throwaway test database")
+        parser.add_argument('--trace-memory', action='store_true',
+                            help="Also record peak Python allocations per scenario (slows the run)")
+        parser.add_argument('--output', help="Results file (default benchmark-<timestamp>.json)")
+        parser.add_argument('--baseline', help="Earlier results file to compare against")
+        parser.add_argument('--tolerance', type=float, default=10.0,
+                            help="Percent change against the baseline reported as a regression")
+        parser.add_argument('--fail-on-regression', action='store_true')
+        parser.add_argument('--caches', action='store_true',
+                            help="Keep the TTS and LLM response caches on (off by default)")
+        parser.add_argument('--show-logs', action='store_true', help="Keep the services' own output")
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+
+        latencies = {
+            name: _latency_option(options[f'{name}_latency'])
+            for name in ('openai', 'stt', 'tts', 'neo4j')
+        }
+        setup_test_environment()
+        old_name = None
+        if not options['existing_db']:
+            old_name = self._create_test_db()
+        log = None if options['show_logs'] else open(os.devnull, 'w')
+        previous = {}
+
+        try:
+            with redirect_stdout(log) if log else nullcontext():
+                previous = self._install_fakes(latencies, options['seed'], options['caches'])
+                conversation_ids = self._seed(options['seed_conversations'])
+                results = {}
+                for name in scenarios:
+                    self.stderr.write(f"Running {name}: {options['requests']} requests "
+                                      f"at concurrency {options['concurrency']}...")
+                    results[name] = self._run_scenario(name, conversation_ids, options)
+        finally:
+            if log:
+                log.close()
+            for name, instance in previous.items():
+                registry.override(name, instance)
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+            },
+            'config': {
+                key: options[key] for key in (
+                    'requests', 'concurrency', 'warmup', 'seed_conversations', 'audio_seconds', 'seed', 'caches'
+                )
+            } | {'latency': latencies},
+            'scenarios': results,
+        }
+        output = options['output'] or f"benchmark-{datetime.now():%Y%m%d-%H%M%S}.json"
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+        self._print_report(report)
+        self.stdout.write(f"Results written to {output}")
+
+        if baseline is not None:
+            regressions = self._compare(report, baseline, options['tolerance'])
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+
+    def _create_test_db(self):
+        old_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite' and not connection.settings_dict['TEST'].get('NAME'):
+            # An in-memory database serialises every thread; use a file like production would
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                settings.BASE_DIR, 'benchmark.sqlite3'
+            )
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        return old_name
+
+    @staticmethod
+    def _install_fakes(latencies, seed, caches):
+        def sampler(name, offset):
+            return lognormal_latency(*latencies[name], seed=seed + offset)
+
+        # Without caches every request pays the (fake) upstream latency
+        with override_settings(TTS_CACHE_ENABLED=caches, OPENAI_CACHE_ENABLED=caches):
+            services = {
+                'stt': STTService(
+                    client=FakeSpeechClient(transcript="What is the best time of year to visit Kyoto?",
+                                            latency=sampler('stt', 1)),
+                    async_client=object()
+                ),
+                'tts': TTSService(client=FakeTTSClient(latency=sampler('tts', 2)), async_client=object()),
+                'openai': OpenAIService(
+                    client=FakeOpenAIClient(_fake_completion, latency=sampler('openai', 3), keep_requests=False),
+                    async_client=object()
+                ),
+                'graph': KnowledgeGraphService(driver=FakeNeo4jDriver(latency=sampler('neo4j', 4))),
+            }
+        return {name: registry.override(name, service) for name, service in services.items()}
+
+    @staticmethod
+    def _seed(count):
+        return [
+            ConversationService.save_conversation(BENCHMARK_USER_ID, [
+                (Message.USER, f"Seed question {i} about travelling in Japan"),
+                (Message.ASSISTANT, REPLY),
+            ]).id
+            for i in range(max(count, 1))
+        ]
+
+    def _request_factory(self, name, conversation_ids, options):
+        if name == 'voice':
+            clip = make_wav([(0.3, 0), (options['audio_seconds'], 0.3), (0.3, 0)], rate=16000, channels=1)
+            return lambda client, i: client.post('/api/voice-input/', {
+                'audio': SimpleUploadedFile('clip.wav', clip, content_type='audio/wav')
+            })
+        if name == 'chat':
+            return lambda client, i: client.post('/api/chat-response/', {
+                'conversation_id': conversation_ids[i % len(conversation_ids)],
+                'message': f"Question {i}: when should I visit Kyoto?",
+                'use_cache': False,
+            }, content_type='application/json')
+        return lambda client, i: client.get(f'/api/conversations/{BENCHMARK_USER_ID}/history/?limit=20')
+
+    def _run_scenario(self, name, conversation_ids, options):
+        send = self._request_factory(name, conversation_ids, options)
+        clients = threading.local()
+        durations, stage_durations, errors = [], {}, []
+        lock = threading.Lock()
+
+        def request(i, timed=True):
+            if not hasattr(clients, 'client'):
+                clients.client = Client()
+            start = time.perf_counter()
+            try:
+                response = send(clients.client, i)
+                failure = None if response.status_code < 400 else f"HTTP {response.status_code}"
+            except Exception as e:
+                response, failure = None, f"{type(e).__name__}: {e}"
+            finally:
+                # The test client keeps connections open; production closes them per request
+                close_old_connections()
+            elapsed = time.perf_counter() - start
+            if not timed:
+                return
+            with lock:
+                if failure:
+                    errors.append(failure)
+                    return
+                durations.append(elapsed)
+                for stage, seconds in parse_server_timing(response.get('Server-Timing', '')).items():
+                    stage_durations.setdefault(stage, []).append(seconds)
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            list(executor.map(lambda i: request(i, timed=False), range(options['warmup'])))
+            self._drain_graph_jobs()
+
+            stages_before = STAGE_SECONDS.snapshot()
+            if options['trace_memory']:
+                tracemalloc.start()
+            started = time.perf_counter()
+            list(executor.map(request, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+
+        traced_peak = None
+        if options['trace_memory']:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        drain_started = time.perf_counter()
+        self._drain_graph_jobs()
+
+        return {
+            'requests': options['requests'],
+            'errors': len(errors),
+            'error_samples': sorted(set(errors))[:5],
+            'elapsed_seconds': round(elapsed, 3),
+            'requests_per_second': round(len(durations) / elapsed, 2),
+            'latency_ms': summarize(durations),
+            'stages_ms': {stage: summarize(values) for stage, values in sorted(stage_durations.items())},
+            'background_stages_ms': self._background_stages(stages_before, STAGE_SECONDS.snapshot()),
+            'graph_jobs_drain_seconds': round(time.perf_counter() - drain_started, 3),
+            'memory': {'peak_rss_bytes': _peak_rss_bytes(), 'traced_peak_bytes': traced_peak},
+        }
+
+    @staticmethod
+    def _drain_graph_jobs():
+        graph_job_queue.shutdown(timeout=settings.GRAPH_JOB_SHUTDOWN_TIMEOUT)
+
+    @staticmethod
+    def _background_stages(before, after):
+        """Mean time of stages that ran outside the request (graph jobs), from the histograms"""
+        stages = {}
+        for (stage, outcome), series in after.items():
+            if stage not in ('topic_extraction', 'llm_topics', 'graph_write') or outcome != 'ok':
+                continue
+            previous = before.get((stage, outcome), {'counts': [0], 'sum': 0.0})
+            count = sum(series['counts']) - sum(previous['counts'])
+            if count:
+                stages[stage] = {
+                    'count': count,
+                    'mean': round((series['sum'] - previous['sum']) / count * 1000, 2)
+                }
+        return stages
+
+    def _print_report(self, report):
+        for name, result in report['scenarios'].items():
+            latency = result['latency_ms'] or {}
+            self.stdout.write(
+                f"\n{name}: {result['requests_per_second']} req/s, "
+                f"p50 {latency.get('p50')} ms, p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+                f"{result['errors']} error(s)"
+            )
+            for stage, stats in result['stages_ms'].items():
+                self.stdout.write(
+                    f"  {stage:<18} p50 {stats['p50']:>9} ms  p95 {stats['p95']:>9} ms  p99 {stats['p99']:>9} ms"
+                )
+            for sample in result['error_samples']:
+                self.stdout.write(self.style.WARNING(f"  error: {sample}"))
+
+    def _compare(self, report, baseline, tolerance):
+        """Print changes against a baseline run and return the regressions"""
+        regressions = []
+        self.stdout.write("\nAgainst baseline:")
+        if baseline.get('config') != report['config']:
+            self.stdout.write(self.style.WARNING("  The baseline ran with a different configuration"))
+        for name, result in report['scenarios'].items():
+            before = baseline.get('scenarios', {}).get(name)
+            if not before:
+                continue
+            checks = [('requests_per_second', result['requests_per_second'], before['requests_per_second'], True)]
+            for q in ('p50', 'p95', 'p99'):
+                if result['latency_ms'] and before.get('latency_ms'):
+                    checks.append((f'latency {q}', result['latency_ms'][q], before['latency_ms'][q], False))
+
+            for metric, now, then, higher_is_better in checks:
+                if not then:
+                    continue
+                change = (now - then) / then * 100
+                worse = -change if higher_is_better else change
+                line = f"  {name} {metric}: {then} -> {now} ({change:+.1f}%)"
+                if worse > tolerance:
+                    regressions.append(line)
+                    self.stdout.write(self.style.ERROR(f"{line}  regression"))
+                else:
+                    self.stdout.write(line)
+        return regressions
+
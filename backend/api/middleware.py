@@ -0,0 +1,166 @@
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from .services.admission import get_admission
+from .services.resilience import OverloadedError
+from .utils.metrics import REQUEST_SECONDS, finish_request, server_timing, start_request
+
+
+class ServerTimingMiddleware:
+    """Times each request and reports its stages in a Server-Timing header.
+
+    Stages are the metrics spans finished while the view ran (STT, LLM
+    reply, TTS, ...). Work done after the response is returned, such as
+    streamed bodies and background graph jobs, only reaches the histograms.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            spans = finish_request(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        token = start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            spans = finish_request(token)
+        return self._finish(request, response, spans, time.perf_counter() - start)
+
+    @staticmethod
+    def _finish(request, response, spans, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        REQUEST_SECONDS.observe(
+            elapsed,
+            view=match.url_name if match and match.url_name else 'unmatched',
+            status=response.status_code
+        )
+        if settings.SERVER_TIMING_HEADER:
+            response['Server-Timing'] = server_timing(spans, total=elapsed)
+        return response
+
+
+def overloaded_response(error):
+    """503 telling the client when to try again"""
+    response = JsonResponse({'error': str(error)}, status=503)
+    response['Retry-After'] = str(max(1, round(error.retry_after)))
+    return response
+
+
+class AdmissionControlMiddleware:
+    """Bounds how many turn requests (ADMISSION_CONTROLLED_VIEWS) run at once.
+
+    Up to ADMISSION_MAX_CONCURRENT are handled together; beyond that up to
+    ADMISSION_MAX_WAITING wait, each for at most ADMISSION_WAIT_TIMEOUT
+    seconds, and the rest are refused straight away with a 503 and a
+    Retry-After header. Cheap reads such as history and health are never
+    queued. A streamed response keeps its slot until its body has been sent.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._controlled(request):
+            return self.get_response(request)
+        admission = get_admission()
+        try:
+            admission.acquire()
+        except OverloadedError as e:
+            return overloaded_response(e)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            admission.release()
+            raise
+        return self._release_when_sent(response, admission)
+
+    async def __acall__(self, request):
+        if not self._controlled(request):
+            return await self.get_response(request)
+        admission = get_admission()
+        try:
+            await admission.aacquire()
+        except OverloadedError as e:
+            return overloaded_response(e)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            admission.release()
+            raise
+        return self._release_when_sent(response, admission)
+
+    @staticmethod
+    def _release_when_sent(response, admission):
+        """Give the slot back now, or for a streamed body once it is sent or abandoned.
+
+        Streaming views do their upstream work while the body is sent, so the
+        slot is held until the body is exhausted, fails or is closed.
+        """
+        if not response.streaming:
+            admission.release()
+            return response
+
+        once = threading.Lock()
+
+        def release():
+            if once.acquire(blocking=False):
+                admission.release()
+
+        if response.is_async:
+            async def content(parts):
+                try:
+                    async for part in parts:
+                        yield part
+                finally:
+                    release()
+        else:
+            def content(parts):
+                try:
+                    yield from parts
+                finally:
+                    release()
+
+        response.streaming_content = content(response.streaming_content)
+        # Covers a body that is closed before it is ever iterated
+        response._resource_closers.append(release)
+        return response
+
+    @staticmethod
+    def _controlled(request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        if match.url_name in settings.ADMISSION_CONTROLLED_VIEWS:
+            # Lets the request metrics label refusals by view
+            request.resolver_match = match
+            return True
+        return False
@@ -0,0 +1,107 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+ROLE_PREFIXES = (('User:', 'user'), ('AI:', 'assistant'))
+LABELS = {'user': 'User', 'assistant': 'AI'}
+BATCH_SIZE = 500
+
+
+def parse_transcript(transcript):
+    """Split a "User: ..." / "AI: ..." transcript into (role, content) pairs.
+
+    Lines without a prefix continue the previous message; text before the
+    first prefix is attributed to the user.
+    """
+    messages = []
+    for line in transcript.splitlines():
+        for prefix, role in ROLE_PREFIXES:
+            if line.startswith(prefix):
+                messages.append([role, line[len(prefix):].strip()])
+                break
+        else:
+            if not line.strip():
+                continue
+            if not messages:
+                messages.append(['user', line.strip()])
+            else:
+                messages[-1][1] = f"{messages[-1][1]}\n{line}".strip()
+    return messages
+
+
+def backfill_messages(apps, schema_editor):
+    Conversation = apps.get_model('api', 'Conversation')
+    Message = apps.get_model('api', 'Message')
+
+    batch = []
+    timestamps = {}
+    for conversation in Conversation.objects.order_by('id').iterator(chunk_size=BATCH_SIZE):
+        timestamps[conversation.id] = conversation.created_at
+        for sequence, (role, content) in enumerate(parse_transcript(conversation.transcript), start=1):
+            batch.append(Message(
+                conversation_id=conversation.id,
+                role=role,
+                content=content,
+                sequence=sequence
+            ))
+        if len(batch) >= BATCH_SIZE:
+            _flush(Message, batch, timestamps)
+            batch, timestamps = [], {}
+    _flush(Message, batch, timestamps)
+
+
+def _flush(Message, batch, timestamps):
+    Message.objects.bulk_create(batch)
+    # auto_now_add stamps the migration time; keep the original conversation time
+    for conversation_id, created_at in timestamps.items():
+        Message.objects.filter(conversation_id=conversation_id).update(created_at=created_at)
+
+
+def rebuild_transcripts(apps, schema_editor):
+    Conversation = apps.get_model('api', 'Conversation')
+    Message = apps.get_model('api', 'Message')
+
+    for conversation in Conversation.objects.iterator(chunk_size=BATCH_SIZE):
+        conversation.transcript = "\n".join(
+            f"{LABELS[message.role]}: {message.content}"
+            for message in Message.objects.filter(conversation_id=conversation.id).order_by('sequence')
+        )
+        conversation.save(update_fields=['transcript'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_graphjob'),
+    ]
+
+    operations = [
+        # A default lets the column be re-added if this migration is reversed
+        migrations.AlterField(
+            model_name='conversation',
+            name='transcript',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('user', 'User'), ('assistant', 'AI')], max_length=16)),
+                ('content', models.TextField()),
+                ('sequence', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='messages', to='api.conversation')),
+            ],
+            options={
+                'db_table': 'messages',
+                'ordering': ['sequence'],
+                'constraints': [models.UniqueConstraint(fields=('conversation', 'sequence'), name='unique_message_sequence')],
+            },
+        ),
+        migrations.RunPython(backfill_messages, rebuild_transcripts),
+        migrations.RemoveField(
+            model_name='conversation',
+            name='transcript',
+        ),
+    ]
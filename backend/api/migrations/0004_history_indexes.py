@@ -0,0 +1,21 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_message'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='conversation',
+            index=models.Index(fields=['user_id', 'created_at'], name='conversation_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='knowledgegraph',
+            index=models.Index(fields=['conversation', 'created_at'], name='graph_conversation_created_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _edge_key(relationship):
+    return (relationship['source'], relationship['target'], relationship.get('type'))
+
+
+def convert_snapshots_to_deltas(apps, schema_editor):
+    """Rewrite existing per-turn snapshots as deltas and materialise each conversation's graph"""
+    KnowledgeGraph = apps.get_model('api', 'KnowledgeGraph')
+    ConversationGraph = apps.get_model('api', 'ConversationGraph')
+
+    conversation_ids = KnowledgeGraph.objects.values_list('conversation_id', flat=True).distinct()
+    for conversation_id in conversation_ids.iterator():
+        nodes, relationships = {}, {}
+        version = 0
+        for snapshot in KnowledgeGraph.objects.filter(conversation_id=conversation_id).order_by('created_at', 'id'):
+            data = snapshot.graph_data or {}
+            added_nodes = [n for n in dict.fromkeys(data.get('nodes', [])) if n not in nodes]
+            added_relationships = []
+            for relationship in data.get('relationships', []):
+                key = _edge_key(relationship)
+                if key not in relationships:
+                    relationships[key] = relationship
+                    added_relationships.append(relationship)
+            nodes.update(dict.fromkeys(added_nodes))
+
+            version += 1
+            snapshot.graph_data = {'nodes': added_nodes, 'relationships': added_relationships}
+            snapshot.version = version
+            snapshot.save(update_fields=['graph_data', 'version'])
+
+        ConversationGraph.objects.create(
+            conversation_id=conversation_id,
+            nodes=list(nodes),
+            relationships=list(relationships.values()),
+            version=version
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='knowledgegraph',
+            name='version',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.CreateModel(
+            name='ConversationGraph',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nodes', models.JSONField(default=list)),
+                ('relationships', models.JSONField(default=list)),
+                ('version', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='graph', to='api.conversation')),
+            ],
+            options={
+                'db_table': 'conversation_graphs',
+            },
+        ),
+        migrations.RunPython(convert_snapshots_to_deltas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_graph_deltas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summary_upto_sequence',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
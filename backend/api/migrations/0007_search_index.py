@@ -0,0 +1,109 @@
+# Full-text search indexes over message content and conversation topics.
+#
+# PostgreSQL gets generated tsvector columns with GIN indexes; SQLite gets
+# FTS5 tables kept in step by triggers. Either way the database updates the
+# index in the same transaction as each message or graph write. The columns
+# and tables are not part of the Django models; api/services/search_service.py
+# queries them directly.
+
+from django.db import migrations
+
+POSTGRESQL_FORWARD = [
+    """
+    ALTER TABLE messages ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+    """,
+    "CREATE INDEX messages_search_vector_idx ON messages USING GIN (search_vector)",
+    """
+    ALTER TABLE conversation_graphs ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('english'::regconfig, nodes)) STORED
+    """,
+    "CREATE INDEX conversation_graphs_search_vector_idx ON conversation_graphs USING GIN (search_vector)",
+]
+
+POSTGRESQL_BACKWARD = [
+    "ALTER TABLE conversation_graphs DROP COLUMN search_vector",
+    "ALTER TABLE messages DROP COLUMN search_vector",
+]
+
+SQLITE_TOPICS = "(SELECT group_concat(value, ', ') FROM json_each({}.nodes))"
+
+SQLITE_FORWARD = [
+    # External-content table: the text stays in messages, FTS5 holds only the index
+    """
+    CREATE VIRTUAL TABLE message_search USING fts5(
+        content, content='messages', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER message_search_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO message_search(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_search_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO message_search(message_search, rowid, content) VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER message_search_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO message_search(message_search, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO message_search(rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO message_search(message_search) VALUES ('rebuild')",
+    "CREATE VIRTUAL TABLE topic_search USING fts5(topics, tokenize='porter unicode61')",
+    f"""
+    CREATE TRIGGER topic_search_insert AFTER INSERT ON conversation_graphs BEGIN
+        INSERT INTO topic_search(rowid, topics) VALUES (new.id, {SQLITE_TOPICS.format('new')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER topic_search_update AFTER UPDATE OF nodes ON conversation_graphs BEGIN
+        DELETE FROM topic_search WHERE rowid = old.id;
+        INSERT INTO topic_search(rowid, topics) VALUES (new.id, {SQLITE_TOPICS.format('new')});
+    END
+    """,
+    """
+    CREATE TRIGGER topic_search_delete AFTER DELETE ON conversation_graphs BEGIN
+        DELETE FROM topic_search WHERE rowid = old.id;
+    END
+    """,
+    f"INSERT INTO topic_search(rowid, topics) SELECT g.id, {SQLITE_TOPICS.format('g')} FROM conversation_graphs g",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TRIGGER IF EXISTS topic_search_delete",
+    "DROP TRIGGER IF EXISTS topic_search_update",
+    "DROP TRIGGER IF EXISTS topic_search_insert",
+    "DROP TABLE IF EXISTS topic_search",
+    "DROP TRIGGER IF EXISTS message_search_update",
+    "DROP TRIGGER IF EXISTS message_search_delete",
+    "DROP TRIGGER IF EXISTS message_search_insert",
+    "DROP TABLE IF EXISTS message_search",
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor)
+        if statements is None:
+            print(f"⚠️ No full-text search index for {schema_editor.connection.vendor}; search is unavailable")
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_conversation_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRESQL_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRESQL_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
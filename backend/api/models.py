@@ -2,23 +2,105 @@ from django.db import models
 
 class Conversation(models.Model):
     user_id = models.IntegerField()
-    transcript = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Rolling summary of the messages up to and including summary_upto_sequence
+    summary = models.TextField(blank=True, default='')
+    summary_upto_sequence = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'conversations'
+        indexes = [
+            models.Index(fields=['user_id', 'created_at'], name='conversation_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Conversation {self.id} - User {self.user_id}"
 
+    @property
+    def transcript(self):
+        """Render the conversation as "User: ..." / "AI: ..." lines from its messages"""
+        return "\n".join(
+            f"{message.get_role_display()}: {message.content}"
+            for message in self.messages.all()
+        )
+
+
+class Message(models.Model):
+    USER = 'user'
+    ASSISTANT = 'assistant'
+    ROLE_CHOICES = [
+        (USER, 'User'),
+        (ASSISTANT, 'AI'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=16, choices=ROLE_CHOICES)
+    content = models.TextField()
+    sequence = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'messages'
+        ordering = ['sequence']
+        constraints = [
+            models.UniqueConstraint(fields=['conversation', 'sequence'], name='unique_message_sequence'),
+        ]
+
+    def __str__(self):
+        return f"Message {self.sequence} ({self.role}) in Conversation {self.conversation_id}"
+
 
 class KnowledgeGraph(models.Model):
+    """The nodes and relationships one turn added to its conversation's graph"""
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     graph_data = models.JSONField()
+    # Version of the ConversationGraph after this delta was applied
+    version = models.PositiveIntegerField(null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'knowledge_graphs'
+        indexes = [
+            models.Index(fields=['conversation', 'created_at'], name='graph_conversation_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Knowledge Graph {self.id} for Conversation {self.conversation_id}"
+
+class ConversationGraph(models.Model):
+    """Deduplicated union of every KnowledgeGraph delta for a conversation"""
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, related_name='graph')
+    nodes = models.JSONField(default=list)
+    relationships = models.JSONField(default=list)
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'conversation_graphs'
+
+    def __str__(self):
+        return f"Graph v{self.version} for Conversation {self.conversation_id}"
+
+
+class GraphJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='queued')
+    payload = models.JSONField()
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'graph_jobs'
 
     def __str__(self):
-        return f"Knowledge Graph {self.id} for Conversation {self.conversation_id}"
\ No newline at end of file
+        return f"Graph Job {self.id} ({self.status}) for Conversation {self.conversation_id}"
@@ -0,0 +1,77 @@
+import threading
+
+from django.conf import settings
+
+from .resilience import Bulkhead, TokenBucket
+
+NORMAL = 'normal'
+REDUCED = 'reduced'
+CRITICAL = 'critical'
+
+_lock = threading.Lock()
+_admission = None
+_token_budget = None
+_token_budget_built = False
+
+
+def get_admission():
+    """The process-wide limit on turn requests being handled at once"""
+    global _admission
+    with _lock:
+        if _admission is None:
+            _admission = Bulkhead(
+                'requests',
+                limit=settings.ADMISSION_MAX_CONCURRENT,
+                max_waiting=settings.ADMISSION_MAX_WAITING,
+                wait_timeout=settings.ADMISSION_WAIT_TIMEOUT
+            )
+        return _admission
+
+
+def get_openai_token_budget():
+    """Bucket of OpenAI tokens per OPENAI_TOKENS_PER_MINUTE, or None when unlimited"""
+    global _token_budget, _token_budget_built
+    with _lock:
+        if not _token_budget_built:
+            per_minute = settings.OPENAI_TOKENS_PER_MINUTE
+            if per_minute:
+                _token_budget = TokenBucket(rate=per_minute / 60, capacity=per_minute)
+            _token_budget_built = True
+        return _token_budget
+
+
+def token_reserve(budget):
+    """Tokens kept back for replies when optional calls spend from `budget`"""
+    return budget.capacity * settings.OPENAI_TOKEN_RESERVE
+
+
+def degradation_level():
+    """How much optional work to shed, from the current load.
+
+    REDUCED once turn requests reach DEGRADE_REDUCED_AT of the admission
+    limit or the OpenAI budget is down to its reserve: topics are no longer
+    requested alongside replies, LLM topic extraction gives way to the local
+    extractor and conversation summaries are not extended. CRITICAL once
+    load goes beyond DEGRADE_CRITICAL_AT, which by default means every slot
+    is busy and requests are queueing: knowledge-graph jobs are deferred
+    until it passes. Replies themselves are never shed here; only admission
+    control refuses them.
+    """
+    load = get_admission().load()
+    if load > settings.DEGRADE_CRITICAL_AT:
+        return CRITICAL
+    budget = get_openai_token_budget()
+    if load >= settings.DEGRADE_REDUCED_AT or (
+        budget is not None and budget.available() < token_reserve(budget)
+    ):
+        return REDUCED
+    return NORMAL
+
+
+def admission_stats():
+    budget = get_openai_token_budget()
+    return {
+        'requests': get_admission().stats(),
+        'openai_tokens': budget.stats() if budget is not None else None,
+        'degradation': degradation_level()
+    }
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from ..models import Conversation, Message
+from .context_builder import ContextBuilder
+from .conversation_service import ConversationService
+from .graph_jobs import enqueue_graph_job
+
+
+def _conversation_id(value):
+    """`value` as a conversation ID, or None when it cannot be one"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return None
+
+
+class BatchChatRunner:
+    """Replies to many (conversation_id, message) items with bounded concurrency.
+
+    Items for the same conversation run in order on one worker, each seeing
+    the earlier replies as context; different conversations run in
+    parallel, at most `concurrency` at a time. Results are yielded as they
+    finish. New messages are written in one bulk transaction at the end, and
+    each conversation gets one graph job covering all its turns. A failed
+    or malformed item is reported in its result and skipped.
+    """
+
+    def __init__(self, openai_service, concurrency, conv_service=None):
+        self.openai_service = openai_service
+        self.concurrency = concurrency
+        self.conv_service = conv_service or ConversationService()
+
+    def run(self, items, use_cache=True, topic_extractor=None):
+        """Check the items and their conversations now, and return an async
+        generator of results that does the work as it is consumed"""
+        ids = [_conversation_id(item.get('conversation_id')) for item in items]
+        existing = set(
+            Conversation.objects.filter(
+                id__in={conversation_id for conversation_id in ids if conversation_id is not None}
+            ).values_list('id', flat=True)
+        )
+
+        groups, failures = {}, []
+        for index, (item, conversation_id) in enumerate(zip(items, ids)):
+            message = item.get('message')
+            if not message:
+                failures.append(self._failure(index, item.get('conversation_id'), 'No message provided'))
+            elif conversation_id is None:
+                failures.append(self._failure(index, item.get('conversation_id'), 'Invalid conversation_id'))
+            elif conversation_id not in existing:
+                failures.append(self._failure(index, conversation_id, 'Conversation not found'))
+            else:
+                groups.setdefault(conversation_id, []).append((index, message))
+        return self._results(groups, failures, use_cache, topic_extractor)
+
+    async def _results(self, groups, failures, use_cache, topic_extractor):
+        for failure in failures:
+            yield failure
+
+        loop = asyncio.get_running_loop()
+        results = asyncio.Queue()
+        turns = {}
+        stop = threading.Event()
+
+        def emit(result):
+            # Once the client has gone nobody reads results, and the loop may be closed
+            if not stop.is_set():
+                try:
+                    loop.call_soon_threadsafe(results.put_nowait, result)
+                except RuntimeError:
+                    pass
+
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(groups))))
+        succeeded, failed = 0, len(failures)
+        finished = False
+        try:
+            for conversation_id, group in groups.items():
+                executor.submit(
+                    self._run_group, conversation_id, group, use_cache, topic_extractor is None, emit, turns, stop
+                )
+
+            for _ in range(sum(len(group) for group in groups.values())):
+                result = await results.get()
+                if result['error'] is None:
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield result
+            finished = True
+        finally:
+            if not finished:
+                # Client went away: start no more items, and keep the replies
+                # already paid for once those in flight finish
+                stop.set()
+                threading.Thread(
+                    target=self._persist_abandoned,
+                    args=(executor, turns, topic_extractor),
+                    daemon=True
+                ).start()
+
+        executor.shutdown()
+        summary = {'done': True, 'succeeded': succeeded, 'failed': failed, 'error': None}
+        try:
+            await sync_to_async(self._persist)(turns, topic_extractor)
+        except Exception as e:
+            print(f"❌ Batch persistence error: {str(e)}")
+            summary['error'] = f"Replies were not saved: {str(e)}"
+        yield summary
+
+    def _run_group(self, conversation_id, group, use_cache, with_topics, emit, turns, stop):
+        """Answer one conversation's items in order.
+
+        Every item is reported exactly once: an error outside a single item's
+        call fails the items not yet reported, so the response never waits
+        on them.
+        """
+        reported = set()
+        done = []
+        try:
+            builder = ContextBuilder(self.openai_service)
+            context = builder.build(conversation_id)
+
+            for index, message in group:
+                if stop.is_set():
+                    break
+                try:
+                    reply, topics = self.openai_service.generate_turn(
+                        message,
+                        use_cache=use_cache,
+                        context=context + builder.recent(
+                            [{"role": role, "content": content} for role, content, _ in done]
+                        ),
+                        with_topics=with_topics
+                    )
+                except Exception as e:
+                    emit(self._failure(index, conversation_id, str(e)))
+                    reported.add(index)
+                    continue
+
+                done.append((Message.USER, message, None))
+                done.append((Message.ASSISTANT, reply, topics))
+                emit({
+                    'index': index,
+                    'conversation_id': conversation_id,
+                    'response': reply,
+                    'error': None
+                })
+                reported.add(index)
+        except Exception as e:
+            print(f"❌ Batch group for conversation {conversation_id} failed: {str(e)}")
+            for index, _ in group:
+                if index not in reported:
+                    emit(self._failure(index, conversation_id, str(e)))
+        finally:
+            # Replies already sent are kept even if the rest of the group failed
+            turns[conversation_id] = done
+            close_old_connections()
+
+    def _persist_abandoned(self, executor, turns, topic_extractor):
+        executor.shutdown(wait=True, cancel_futures=True)
+        try:
+            self._persist(turns, topic_extractor)
+        except Exception as e:
+            print(f"❌ Batch persistence error: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def _persist(self, turns, topic_extractor):
+        if not any(turns.values()):
+            return
+        self.conv_service.append_turns({
+            conversation_id: [(role, content) for role, content, _ in done]
+            for conversation_id, done in turns.items() if done
+        })
+        print(f"✓ Batch persisted {sum(len(done) for done in turns.values())} messages")
+
+        for conversation_id, done in turns.items():
+            if not done:
+                continue
+            replies = [topics for role, _, topics in done if role == Message.ASSISTANT]
+            # Topics from the replies are merged unless any reply came without them
+            topics = None
+            if all(t is not None for t in replies):
+                topics = [topic for t in replies for topic in t]
+            enqueue_graph_job(
+                conversation_id,
+                ' '.join(content for role, content, _ in done if role == Message.USER),
+                ' '.join(content for role, content, _ in done if role == Message.ASSISTANT),
+                topics,
+                topic_extractor
+            )
+
+    @staticmethod
+    def _failure(index, conversation_id, error):
+        return {
+            'index': index,
+            'conversation_id': conversation_id,
+            'response': None,
+            'error': error
+        }
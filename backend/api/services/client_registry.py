@@ -0,0 +1,122 @@
+import asyncio
+import atexit
+import threading
+
+from .graph_service import KnowledgeGraphService
+from .openai_service import OpenAIService
+from .stt_service import STTService
+from .tts_service import TTSService
+
+
+class ClientRegistry:
+    """Process-wide, lazily initialised registry of shared service clients.
+
+    Each service is built on first use and then reused by every request, so
+    gRPC channels, HTTP connection pools and the Neo4j driver are created once
+    per process instead of once per request.
+    """
+
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+
+    def override(self, name, instance):
+        """Install a ready-made instance (used by tests and benchmarks)"""
+        with self._lock:
+            previous = self._instances.get(name)
+            self._instances[name] = instance
+        return previous
+
+    def get(self, name):
+        instance = self._instances.get(name)
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            instance = self._instances.get(name)
+            if instance is None:
+                if name not in self._factories:
+                    raise KeyError(f"No client registered under '{name}'")
+                print(f"Initializing shared client '{name}'...")
+                instance = self._factories[name]()
+                self._instances[name] = instance
+            return instance
+
+    def names(self):
+        return list(self._factories)
+
+    def warm_up(self, names=None):
+        """Build the clients and open their connections ahead of traffic"""
+        results = {}
+        for name in names or self.names():
+            try:
+                service = self.get(name)
+                if hasattr(service, 'warm_up'):
+                    service.warm_up()
+                results[name] = 'ok'
+            except Exception as e:
+                print(f"⚠️ Warm-up failed for '{name}': {str(e)}")
+                results[name] = f"error: {str(e)}"
+        return results
+
+    def health(self, names=None):
+        results = {}
+        for name in names or self.names():
+            try:
+                service = self.get(name)
+                if hasattr(service, 'health_check'):
+                    service.health_check()
+                results[name] = 'ok'
+            except Exception as e:
+                results[name] = f"error: {str(e)}"
+        return results
+
+    def close_all(self):
+        with self._lock:
+            instances = list(self._instances.items())
+            self._instances.clear()
+
+        for name, service in instances:
+            try:
+                if hasattr(service, 'close'):
+                    service.close()
+            except Exception as e:
+                print(f"⚠️ Failed to close client '{name}': {str(e)}")
+
+    async def aclose_all(self):
+        """close_all for use on the event loop, e.g. at ASGI lifespan shutdown.
+
+        Async clients are closed on the loop that owns them, so the closing
+        runs on a worker thread while this loop stays free to do it.
+        """
+        await asyncio.to_thread(self.close_all)
+
+
+registry = ClientRegistry()
+registry.register('stt', STTService)
+registry.register('tts', TTSService)
+registry.register('openai', OpenAIService)
+registry.register('graph', KnowledgeGraphService)
+
+atexit.register(registry.close_all)
+
+
+def get_stt_service() -> STTService:
+    return registry.get('stt')
+
+
+def get_tts_service() -> TTSService:
+    return registry.get('tts')
+
+
+def get_openai_service() -> OpenAIService:
+    return registry.get('openai')
+
+
+def get_graph_service() -> KnowledgeGraphService:
+    return registry.get('graph')
@@ -0,0 +1,120 @@
+from operator import attrgetter, itemgetter
+
+from django.conf import settings
+
+from ..models import Conversation, Message
+from ..utils.tokens import estimate_tokens
+from .admission import NORMAL, degradation_level
+from .openai_service import SUMMARY_FAILED
+
+
+def _render(messages):
+    return "\n".join(f"{message.get_role_display()}: {message.content}" for message in messages)
+
+
+def _newest(messages, token_limit, content=attrgetter('content')):
+    """The newest of `messages` whose content fits in `token_limit` tokens.
+
+    `content` reads a message's text; the default suits Message rows.
+    """
+    used = 0
+    start = len(messages)
+    while start > 0:
+        used += estimate_tokens(content(messages[start - 1]))
+        if used > token_limit:
+            break
+        start -= 1
+    return messages[start:]
+
+
+class ContextBuilder:
+    """Prior turns to send with a new message, within a token budget.
+
+    The newest messages are kept verbatim up to `token_budget` tokens.
+    Older messages are folded into a rolling summary stored on the
+    Conversation. The summary is only extended once the messages that fell
+    out of the budget reach `summary_batch_tokens`; until then they are sent
+    verbatim. This keeps summarisation to one call every few turns. When the
+    summary cannot be extended (under load, or because summarisation
+    failed) only the newest `summary_batch_tokens` of those messages are
+    sent, so the prompt stays below budget + batch + summary regardless of
+    length.
+    """
+
+    def __init__(self, openai_service, token_budget=None, summary_batch_tokens=None):
+        self.openai_service = openai_service
+        self.token_budget = token_budget if token_budget is not None else settings.CONTEXT_TOKEN_BUDGET
+        self.summary_batch_tokens = (
+            summary_batch_tokens if summary_batch_tokens is not None
+            else settings.CONTEXT_SUMMARY_BATCH_TOKENS
+        )
+
+    def build(self, conversation_id):
+        """Chat messages for the conversation so far, oldest first"""
+        if conversation_id is None:
+            return []
+        conversation = Conversation.objects.filter(id=conversation_id).first()
+        if conversation is None:
+            return []
+
+        # Only messages the summary does not already cover are loaded
+        unsummarised = list(
+            Message.objects.filter(
+                conversation_id=conversation_id,
+                sequence__gt=conversation.summary_upto_sequence
+            ).order_by('sequence')
+        )
+
+        verbatim_start = len(unsummarised)
+        used = 0
+        while verbatim_start > 0:
+            cost = estimate_tokens(unsummarised[verbatim_start - 1].content)
+            if used + cost > self.token_budget:
+                break
+            used += cost
+            verbatim_start -= 1
+
+        overflow = unsummarised[:verbatim_start]
+        overflow_tokens = sum(estimate_tokens(message.content) for message in overflow)
+        summary = conversation.summary
+        # Under load the summary waits, and it is extended on a later turn
+        if overflow and overflow_tokens >= self.summary_batch_tokens and degradation_level() == NORMAL:
+            extended = self._extend_summary(conversation, overflow)
+            if extended is not None:
+                summary, overflow = extended, []
+        overflow = _newest(overflow, self.summary_batch_tokens)
+
+        context = []
+        if summary:
+            context.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation: {summary}"
+            })
+        context.extend(
+            {"role": message.role, "content": message.content}
+            for message in overflow + unsummarised[verbatim_start:]
+        )
+        return context
+
+    def recent(self, messages):
+        """The newest of `messages` (chat message dicts) that fit the token budget"""
+        return _newest(messages, self.token_budget, content=itemgetter('content'))
+
+    def _extend_summary(self, conversation, messages):
+        transcript = _render(messages)
+        if conversation.summary:
+            transcript = f"Summary so far: {conversation.summary}\n{transcript}"
+
+        summary = self.openai_service.summarize_conversation(transcript)
+        if summary == SUMMARY_FAILED:
+            print("⚠️ Could not extend conversation summary, sending only the newest older turns")
+            return None
+
+        upto = messages[-1].sequence
+        # A concurrent turn may already have summarised further
+        Conversation.objects.filter(
+            id=conversation.id,
+            summary_upto_sequence__lt=upto
+        ).update(summary=summary, summary_upto_sequence=upto)
+        print(f"✓ Conversation {conversation.id} summarised up to message {upto}")
+        return summary
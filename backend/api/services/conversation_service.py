@@ -1,33 +1,199 @@
-from ..models import Conversation, KnowledgeGraph
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Max, Prefetch, Q, prefetch_related_objects
+
+from ..models import Conversation, ConversationGraph, KnowledgeGraph, Message
+from ..utils.metrics import span
+from ..utils.pagination import encode_cursor, decode_cursor
+from .graph_index import index_graph_delta
+
+def _edge_key(relationship):
+    return (relationship['source'], relationship['target'], relationship.get('type'))
+
+def _text_size(messages):
+    return sum(len(content.encode()) for _, content in messages)
 
 class ConversationService:
+    """Conversations are stored as append-only Message rows.
+
+    `messages` arguments are lists of (role, content) pairs, where role is
+    Message.USER or Message.ASSISTANT.
+    """
+
+    @staticmethod
+    def save_conversation(user_id, messages):
+        with span('db_save', size=_text_size(messages)), transaction.atomic():
+            conversation = Conversation.objects.create(user_id=user_id)
+            ConversationService._append(conversation, messages, start=1)
+        return conversation
+
+    @staticmethod
+    def update_conversation(conversation_id, messages):
+        with span('db_save', size=_text_size(messages)), transaction.atomic():
+            try:
+                # Row lock serialises concurrent turns on the same conversation
+                conversation = Conversation.objects.select_for_update().get(id=conversation_id)
+            except Conversation.DoesNotExist:
+                raise Exception(f"Conversation {conversation_id} not found")
+
+            last = conversation.messages.aggregate(last=Max('sequence'))['last'] or 0
+            ConversationService._append(conversation, messages, start=last + 1)
+        return conversation
+
     @staticmethod
-    def save_conversation(user_id, transcript):
-        return Conversation.objects.create(
-            user_id=user_id,
-            transcript=transcript
-        )
-    
+    def append_turns(messages_by_conversation):
+        """Append messages to many conversations in one transaction.
+
+        `messages_by_conversation` maps conversation IDs to (role, content)
+        lists. Conversations that no longer exist are skipped. Returns the
+        IDs that were updated.
+        """
+        size = sum(_text_size(messages) for messages in messages_by_conversation.values())
+        with span('db_save', size=size), transaction.atomic():
+            ids = sorted(messages_by_conversation)
+            conversations = {
+                c.id: c for c in Conversation.objects.select_for_update().filter(id__in=ids).order_by('id')
+            }
+            last_sequences = dict(
+                Message.objects.filter(conversation_id__in=conversations)
+                .values('conversation_id')
+                .annotate(last=Max('sequence'))
+                .values_list('conversation_id', 'last')
+            )
+            Message.objects.bulk_create([
+                Message(conversation_id=conversation_id, role=role, content=content, sequence=sequence)
+                for conversation_id in conversations
+                for sequence, (role, content) in enumerate(
+                    messages_by_conversation[conversation_id],
+                    start=last_sequences.get(conversation_id, 0) + 1
+                )
+            ], batch_size=500)
+        return list(conversations)
+
     @staticmethod
-    def update_conversation(conversation_id, new_content):
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            conversation.transcript += f"\n{new_content}"
-            conversation.save()
-            return conversation
-        except Conversation.DoesNotExist:
-            raise Exception(f"Conversation {conversation_id} not found")
+    def _append(conversation, messages, start):
+        return Message.objects.bulk_create([
+            Message(
+                conversation=conversation,
+                role=role,
+                content=content,
+                sequence=sequence
+            )
+            for sequence, (role, content) in enumerate(messages, start=start)
+        ])
 
-    
     @staticmethod
     def save_knowledge_graph(conversation_id, graph_data):
-        return KnowledgeGraph.objects.create(
+        """Store what this turn adds to the conversation graph.
+
+        Only nodes and relationships the conversation has not seen before are
+        written, as a KnowledgeGraph delta row, and the materialised
+        ConversationGraph is updated in the same transaction. Returns None
+        when the turn adds nothing new.
+        """
+        with transaction.atomic():
+            graph, _ = ConversationGraph.objects.select_for_update().get_or_create(
+                conversation_id=conversation_id
+            )
+            delta = ConversationService._graph_delta(graph, graph_data)
+            if not delta['nodes'] and not delta['relationships']:
+                return None
+
+            graph.version += 1
+            graph.nodes = graph.nodes + delta['nodes']
+            graph.relationships = graph.relationships + delta['relationships']
+            graph.save()
+            transaction.on_commit(lambda: index_graph_delta(delta))
+
+            return KnowledgeGraph.objects.create(
+                conversation_id=conversation_id,
+                graph_data=delta,
+                version=graph.version
+            )
+
+    @staticmethod
+    def _graph_delta(graph, graph_data):
+        known_nodes = set(graph.nodes)
+        known_edges = {_edge_key(r) for r in graph.relationships}
+
+        nodes = [n for n in dict.fromkeys(graph_data.get('nodes', [])) if n not in known_nodes]
+        relationships = []
+        for relationship in graph_data.get('relationships', []):
+            key = _edge_key(relationship)
+            if key not in known_edges:
+                known_edges.add(key)
+                relationships.append(relationship)
+        return {'nodes': nodes, 'relationships': relationships}
+
+    @staticmethod
+    def get_graph(conversation_id, since=None):
+        """The merged conversation graph, or only what was added after version `since`"""
+        graph = ConversationGraph.objects.filter(conversation_id=conversation_id).first()
+        version = graph.version if graph else 0
+
+        if since is None:
+            return {
+                'version': version,
+                'nodes': graph.nodes if graph else [],
+                'relationships': graph.relationships if graph else []
+            }
+
+        nodes, relationships = [], []
+        deltas = KnowledgeGraph.objects.filter(
             conversation_id=conversation_id,
-            graph_data=graph_data
-        )
+            version__gt=since
+        ).order_by('version')
+        for delta in deltas:
+            nodes.extend(delta.graph_data.get('nodes', []))
+            relationships.extend(delta.graph_data.get('relationships', []))
+        return {
+            'version': version,
+            'since': since,
+            'nodes': nodes,
+            'relationships': relationships
+        }
 
     @staticmethod
-    def get_conversation_history(user_id):
-        return Conversation.objects.filter(
+    def get_conversation_history(user_id, cursor=None, limit=20,
+                                 include_graphs=True, include_transcripts=True):
+        """One page of a user's conversations, newest first.
+
+        Pages are keyset-paginated on (created_at, id), so every page costs
+        the same regardless of how far back it is. Returns the conversations
+        and the cursor for the next page (None on the last page).
+        """
+        conversations = Conversation.objects.filter(
             user_id=user_id
-        ).order_by('-created_at')
\ No newline at end of file
+        ).order_by('-created_at', '-id')
+
+        if cursor:
+            created_at, pk = decode_cursor(cursor)
+            conversations = conversations.filter(
+                Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+            )
+
+        graphs = KnowledgeGraph.objects.order_by('created_at')
+        if not include_graphs:
+            graphs = graphs.defer('graph_data')
+        prefetches = [Prefetch('knowledgegraph_set', queryset=graphs)]
+        if include_transcripts:
+            prefetches.append('messages')
+
+        limit = max(1, limit)
+        page = list(conversations[:limit + 1])
+        next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            next_cursor = encode_cursor(page[-1].created_at, page[-1].id)
+
+        prefetch_related_objects(page, *prefetches)
+        return page, next_cursor
+
+    @staticmethod
+    async def asave_conversation(user_id, messages):
+        return await sync_to_async(ConversationService.save_conversation)(user_id, messages)
+
+    @staticmethod
+    async def aupdate_conversation(conversation_id, messages):
+        return await sync_to_async(ConversationService.update_conversation)(conversation_id, messages)
+
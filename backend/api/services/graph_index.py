@@ -0,0 +1,264 @@
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from ..models import ConversationGraph
+
+
+class TopicGraphIndex:
+    """In-memory adjacency index over all topics.
+
+    Topic names are interned to compact integer IDs, and adjacency is kept
+    as per-node sets of IDs in both directions. Traversals treat the graph
+    as undirected unless a direction is given.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+        self._out = []
+        self._in = []
+        self._edge_types = {}
+        self._lock = threading.RLock()
+        self.built_at = None
+
+    def __contains__(self, name):
+        return name in self._ids
+
+    def __len__(self):
+        return len(self._names)
+
+    def _intern(self, name):
+        node_id = self._ids.get(name)
+        if node_id is None:
+            node_id = len(self._names)
+            self._ids[name] = node_id
+            self._names.append(name)
+            self._out.append(set())
+            self._in.append(set())
+        return node_id
+
+    def add_graph(self, graph_data):
+        with self._lock:
+            for name in graph_data.get('nodes', []):
+                self._intern(name)
+            for relationship in graph_data.get('relationships', []):
+                self.add_edge(relationship['source'], relationship['target'], relationship.get('type'))
+
+    def add_edge(self, source, target, relationship_type=None):
+        with self._lock:
+            source_id, target_id = self._intern(source), self._intern(target)
+            self._out[source_id].add(target_id)
+            self._in[target_id].add(source_id)
+            if relationship_type:
+                self._edge_types.setdefault((source_id, target_id), set()).add(relationship_type)
+
+    def topics(self):
+        return list(self._names)
+
+    def _require(self, name):
+        node_id = self._ids.get(name)
+        if node_id is None:
+            raise KeyError(name)
+        return node_id
+
+    def _adjacent(self, node_id, direction='both'):
+        if direction == 'out':
+            return self._out[node_id]
+        if direction == 'in':
+            return self._in[node_id]
+        return self._out[node_id] | self._in[node_id]
+
+    def neighbours(self, name, direction='both'):
+        with self._lock:
+            node_id = self._require(name)
+            result = []
+            for other in sorted(self._adjacent(node_id, direction)):
+                types = self._edge_types.get((node_id, other), set()) | self._edge_types.get((other, node_id), set())
+                result.append({'topic': self._names[other], 'types': sorted(types)})
+            return result
+
+    def expand(self, name, hops=1, direction='both'):
+        """Every topic within `hops` edges of `name`, with its distance"""
+        with self._lock:
+            start = self._require(name)
+            depths = {start: 0}
+            frontier = deque([start])
+            while frontier:
+                node_id = frontier.popleft()
+                if depths[node_id] == hops:
+                    continue
+                for other in self._adjacent(node_id, direction):
+                    if other not in depths:
+                        depths[other] = depths[node_id] + 1
+                        frontier.append(other)
+
+            return {
+                'nodes': [
+                    {'topic': self._names[node_id], 'depth': depth}
+                    for node_id, depth in sorted(depths.items(), key=lambda item: (item[1], item[0]))
+                ],
+                'relationships': [
+                    {'source': self._names[a], 'target': self._names[b]}
+                    for a in depths for b in self._out[a] if b in depths
+                ]
+            }
+
+    def shortest_path(self, source, target):
+        """Fewest-hop path between two topics (ignoring direction), or None"""
+        with self._lock:
+            start, goal = self._require(source), self._require(target)
+            previous = {start: None}
+            frontier = deque([start])
+            while frontier:
+                node_id = frontier.popleft()
+                if node_id == goal:
+                    path = []
+                    while node_id is not None:
+                        path.append(self._names[node_id])
+                        node_id = previous[node_id]
+                    return path[::-1]
+                for other in self._adjacent(node_id):
+                    if other not in previous:
+                        previous[other] = node_id
+                        frontier.append(other)
+            return None
+
+    def components(self, min_size=1):
+        """Connected components (ignoring direction), largest first"""
+        with self._lock:
+            seen = set()
+            components = []
+            for start in range(len(self._names)):
+                if start in seen:
+                    continue
+                seen.add(start)
+                component = [start]
+                frontier = deque([start])
+                while frontier:
+                    for other in self._adjacent(frontier.popleft()):
+                        if other not in seen:
+                            seen.add(other)
+                            component.append(other)
+                            frontier.append(other)
+                if len(component) >= min_size:
+                    components.append(sorted(self._names[node_id] for node_id in component))
+            components.sort(key=len, reverse=True)
+            return components
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._names),
+                'relationships': sum(len(targets) for targets in self._out),
+                'built_at': self.built_at
+            }
+
+
+def _load_from_database(index):
+    graphs = ConversationGraph.objects.values_list('nodes', 'relationships')
+    for nodes, relationships in graphs.iterator(chunk_size=500):
+        index.add_graph({'nodes': nodes, 'relationships': relationships})
+
+
+def _load_from_neo4j(index):
+    from .client_registry import get_graph_service
+
+    with get_graph_service().driver.session() as session:
+        result = session.run(
+            """
+            MATCH (t:Topic)
+            OPTIONAL MATCH (t)-[r:RELATES_TO]->(u:Topic)
+            RETURN t.name AS source, u.name AS target, r.type AS type
+            """
+        )
+        for record in result:
+            if record['target'] is None:
+                index.add_graph({'nodes': [record['source']]})
+            else:
+                index.add_edge(record['source'], record['target'], record['type'])
+
+
+def build_graph_index():
+    index = TopicGraphIndex()
+    if settings.GRAPH_INDEX_SOURCE == 'neo4j':
+        try:
+            _load_from_neo4j(index)
+        except Exception as e:
+            print(f"⚠️ Could not load topic index from Neo4j, using the database: {str(e)}")
+            index = TopicGraphIndex()
+            _load_from_database(index)
+    else:
+        _load_from_database(index)
+
+    index.built_at = time.time()
+    print(f"✓ Topic index built: {index.stats()}")
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = False
+# Deltas indexed while a rebuild runs; its snapshot may have been read before they were written
+_pending_deltas = None
+
+
+def _refresh(stale):
+    global _index, _refreshing, _pending_deltas
+    try:
+        index = build_graph_index()
+        with _index_lock:
+            for graph_data in _pending_deltas:
+                index.add_graph(graph_data)
+            _index = index
+    except Exception as e:
+        print(f"❌ Topic index refresh failed, serving the previous index: {str(e)}")
+        # Try again after another refresh interval rather than on every query
+        stale.built_at = time.time()
+    finally:
+        close_old_connections()
+        with _index_lock:
+            _refreshing = False
+            _pending_deltas = None
+
+
+def get_graph_index():
+    """The process-wide topic index, rebuilt when older than GRAPH_INDEX_REFRESH_SECONDS.
+
+    Topics written by this process are added as they arrive; the periodic
+    rebuild picks up topics written by other worker processes. Only the
+    first build blocks: a stale index keeps being served while its
+    replacement is built in a background thread.
+    """
+    global _index, _refreshing, _pending_deltas
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_graph_index()
+            return _index
+
+    if time.time() - index.built_at >= settings.GRAPH_INDEX_REFRESH_SECONDS:
+        with _index_lock:
+            if not _refreshing:
+                _refreshing = True
+                _pending_deltas = []
+                threading.Thread(target=_refresh, args=(index,), name='graph-index-refresh', daemon=True).start()
+    return index
+
+
+def index_graph_delta(graph_data):
+    """Add freshly written topics to the index if it has been built.
+
+    During a background rebuild the delta is also recorded and replayed onto
+    the new index before it replaces the current one.
+    """
+    with _index_lock:
+        if _index is None:
+            return
+        _index.add_graph(graph_data)
+        if _pending_deltas is not None:
+            _pending_deltas.append(graph_data)
@@ -0,0 +1,84 @@
+import atexit
+
+from django.conf import settings
+
+from ..utils.metrics import span
+from .admission import CRITICAL, REDUCED, degradation_level
+from .client_registry import get_graph_service, get_openai_service
+from .conversation_service import ConversationService
+from .job_queue import DeferJob, JobQueue, MemoryJobStore, DatabaseJobStore
+from .topic_extractor import local_topic_extractor
+
+TOPIC_EXTRACTORS = ('llm', 'local', 'auto')
+
+
+def extract_topics(text, extractor=None):
+    """Topics for a turn from the chosen extractor (default TOPIC_EXTRACTOR).
+
+    'llm' asks OpenAI, 'local' uses the network-free keyphrase extractor, and
+    'auto' asks OpenAI and falls back to the local extractor when that
+    produces nothing. OpenAI errors are raised so that the job is retried.
+    """
+    extractor = extractor or settings.TOPIC_EXTRACTOR
+    with span('topic_extraction', size=len(text.encode())):
+        if extractor == 'local':
+            return local_topic_extractor.extract_topics(text)
+
+        topics = get_openai_service().extract_topics(text)
+        if not topics and extractor == 'auto':
+            print("⚠️ LLM topic extraction returned nothing, using the local extractor")
+            topics = local_topic_extractor.extract_topics(text)
+        return topics
+
+
+def process_graph_job(conversation_id, payload):
+    """Extract topics from one turn and persist them to Neo4j and the database.
+
+    Topics already produced alongside the reply are used as they are. Under
+    load the job sheds work before replies are affected: extraction falls
+    back to the local extractor, and at critical load the job is deferred
+    until requests stop queueing.
+    """
+    level = degradation_level()
+    if level == CRITICAL:
+        raise DeferJob("System overloaded", delay=settings.GRAPH_JOB_DEFER_SECONDS)
+
+    topics = payload.get('topics')
+    if topics is None:
+        extractor = 'local' if level == REDUCED else payload.get('extractor')
+        topics = extract_topics(payload['text'], extractor)
+    graph_data = get_graph_service().process_topics(topics, conversation_id)
+    if 'error' in graph_data:
+        raise Exception(graph_data['error'])
+
+    knowledge_graph = ConversationService.save_knowledge_graph(conversation_id, graph_data)
+    return {
+        'graph_id': knowledge_graph.id if knowledge_graph else None,
+        'version': knowledge_graph.version if knowledge_graph else None
+    }
+
+
+def _build_store():
+    if settings.GRAPH_JOB_STORE == 'database':
+        return DatabaseJobStore()
+    return MemoryJobStore()
+
+
+graph_job_queue = JobQueue(
+    handler=process_graph_job,
+    store=_build_store(),
+    workers=settings.GRAPH_JOB_WORKERS,
+    max_retries=settings.GRAPH_JOB_MAX_RETRIES,
+    retry_backoff=settings.GRAPH_JOB_RETRY_BACKOFF
+)
+
+atexit.register(graph_job_queue.shutdown, settings.GRAPH_JOB_SHUTDOWN_TIMEOUT)
+
+
+def enqueue_graph_job(conversation_id, user_message, ai_response, topics=None, extractor=None):
+    payload = {'text': f"{user_message} {ai_response}"}
+    if topics is not None:
+        payload['topics'] = topics
+    if extractor is not None:
+        payload['extractor'] = extractor
+    return graph_job_queue.submit(conversation_id, payload)
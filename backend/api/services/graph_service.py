@@ -1,11 +1,45 @@
-from neo4j import GraphDatabase
+from django.conf import settings
+from neo4j import GraphDatabase, unit_of_work
+from ..utils.metrics import span
+from .resilience import get_upstream
+from .topic_canonicalizer import build_canonicalizer
+
+# Relationship endpoints are MERGEd as well so that every chunk is
+# self-contained regardless of which chunk carries the node itself.
+WRITE_BATCH_QUERY = """
+UNWIND $nodes AS name
+MERGE (:Topic {name: name})
+WITH count(*) AS merged
+UNWIND $relationships AS rel
+MERGE (t1:Topic {name: rel.source})
+MERGE (t2:Topic {name: rel.target})
+MERGE (t1)-[r:RELATES_TO {type: rel.type}]->(t2)
+"""
+
+def _build_driver(factory):
+    return factory.driver(
+        settings.NEO4J_URI,
+        auth=(settings.NEO4J_USER, settings.NEO4J_PASSWORD),
+        max_connection_pool_size=settings.NEO4J_MAX_CONNECTION_POOL_SIZE,
+        connection_timeout=settings.NEO4J_TIMEOUT,
+        # Retries are left to the shared upstream policy
+        max_transaction_retry_time=0
+    )
 
 class KnowledgeGraphService:
-    def __init__(self):
-        self.driver = GraphDatabase.driver(
-            "neo4j://localhost:7687",
-            auth=("neo4j", "password")
-        )
+    def __init__(self, driver=None, canonicalizer=None, upstream=None):
+        self.driver = driver or _build_driver(GraphDatabase)
+        self.upstream = upstream or get_upstream('neo4j')
+        self.canonicalizer = canonicalizer if canonicalizer is not None else build_canonicalizer()
+
+    def warm_up(self):
+        self.driver.verify_connectivity()
+
+    def health_check(self):
+        self.warm_up()
+
+    def close(self):
+        self.driver.close()
 
     def process_topics(self, topics: list, conversation_id: int) -> dict:
         if not topics:
@@ -16,42 +50,9 @@ class KnowledgeGraphService:
         print(f"Received topics: {topics}")
         
         try:
-            graph_data = {
-                'nodes': set(),
-                'relationships': []
-            }
-
-            for topic_obj in topics:
-                main_topic = topic_obj.get('topic')
-                if not main_topic:
-                    print(f"⚠️ Skipping invalid topic object: {topic_obj}")
-                    continue
-
-                print(f"\nProcessing main topic: {main_topic}")
-                graph_data['nodes'].add(main_topic)
-                self.create_topic_node(main_topic)
-
-                for related_topic in topic_obj.get('related_topics', []):
-                    if not related_topic:
-                        continue
-
-                    print(f"Creating relationship: {main_topic} -> {related_topic}")
-                    graph_data['nodes'].add(related_topic)
-                    self.create_topic_node(related_topic)
-                    
-                    relationship_type = topic_obj.get('relationship_type', 'RELATES_TO')
-                    self.create_relationship(main_topic, related_topic, relationship_type)
-                    
-                    graph_data['relationships'].append({
-                        'source': main_topic,
-                        'target': related_topic,
-                        'type': relationship_type
-                    })
-
-            return {
-                'nodes': list(graph_data['nodes']),
-                'relationships': graph_data['relationships']
-            }
+            graph_data = self.build_graph_data(self.canonicalize_topics(topics))
+            self.write_graph(graph_data['nodes'], graph_data['relationships'])
+            return graph_data
 
         except Exception as e:
             print(f"❌ Error in process_topics: {str(e)}")
@@ -59,6 +60,81 @@ class KnowledgeGraphService:
             traceback.print_exc()
             return {'nodes': [], 'relationships': [], 'error': str(e)}
 
+    def canonicalize_topics(self, topics: list) -> list:
+        """Map topic names onto existing ones so variants share one node"""
+        if self.canonicalizer is None:
+            return topics
+        return self.canonicalizer.canonicalize_topics(topics)
+
+    @staticmethod
+    def build_graph_data(topics: list) -> dict:
+        """Flatten extracted topics into the nodes/relationships payload"""
+        nodes = {}
+        relationships = {}
+
+        for topic_obj in topics:
+            main_topic = topic_obj.get('topic')
+            if not main_topic:
+                print(f"⚠️ Skipping invalid topic object: {topic_obj}")
+                continue
+
+            nodes[main_topic] = None
+            relationship_type = topic_obj.get('relationship_type', 'RELATES_TO')
+
+            for related_topic in topic_obj.get('related_topics', []):
+                if not related_topic:
+                    continue
+
+                nodes[related_topic] = None
+                relationships[(main_topic, related_topic, relationship_type)] = {
+                    'source': main_topic,
+                    'target': related_topic,
+                    'type': relationship_type
+                }
+
+        return {
+            'nodes': list(nodes),
+            'relationships': list(relationships.values())
+        }
+
+    def write_graph(self, nodes: list, relationships: list):
+        """Write nodes and relationships in as few transactions as possible.
+
+        The whole payload goes out as one UNWIND query per transaction; only
+        payloads larger than NEO4J_WRITE_BATCH_SIZE are split into chunks.
+        Every statement is a MERGE, so a failed write is safe to repeat whole.
+        """
+        chunks = self._chunk_payload(nodes, relationships)
+
+        def write(timeout):
+            work = unit_of_work(timeout=timeout)(self._write_batch)
+            with self.driver.session() as session:
+                for node_chunk, rel_chunk in chunks:
+                    session.execute_write(work, node_chunk, rel_chunk)
+
+        with span('graph_write', size=len(nodes) + len(relationships)):
+            self.upstream.call(write)
+
+        print(f"✓ Wrote {len(nodes)} nodes and {len(relationships)} relationships in {len(chunks)} transaction(s)")
+
+    @staticmethod
+    def _chunk_payload(nodes, relationships):
+        batch_size = settings.NEO4J_WRITE_BATCH_SIZE
+        node_chunks = [nodes[i:i + batch_size] for i in range(0, len(nodes), batch_size)]
+        rel_chunks = [relationships[i:i + batch_size] for i in range(0, len(relationships), batch_size)]
+
+        return [
+            (
+                node_chunks[i] if i < len(node_chunks) else [],
+                rel_chunks[i] if i < len(rel_chunks) else []
+            )
+            for i in range(max(len(node_chunks), len(rel_chunks)))
+        ]
+
+    @staticmethod
+    def _write_batch(tx, nodes, relationships):
+        tx.run(WRITE_BATCH_QUERY, nodes=nodes, relationships=relationships).consume()
+
     def create_topic_node(self, topic):
         with self.driver.session() as session:
             session.run(
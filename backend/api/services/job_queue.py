@@ -0,0 +1,229 @@
+import queue
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class DeferJob(Exception):
+    """Raised by a handler to run the job again after `delay` seconds.
+
+    Unlike a failure, a deferral does not use up one of the job's attempts.
+    """
+
+    def __init__(self, message, delay=1.0):
+        super().__init__(message)
+        self.delay = delay
+
+
+@dataclass
+class Job:
+    id: str
+    conversation_id: int
+    payload: dict
+    status: str = QUEUED
+    attempts: int = 0
+    error: str = ''
+    result: dict = None
+    created_at: object = field(default_factory=timezone.now)
+    updated_at: object = field(default_factory=timezone.now)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversation_id': self.conversation_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'result': self.result,
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
+        }
+
+
+class MemoryJobStore:
+    """Keeps job state in this process only"""
+
+    def __init__(self, max_jobs_per_conversation=50):
+        self._jobs = {}
+        self._by_conversation = {}
+        self._max_jobs = max_jobs_per_conversation
+        self._lock = threading.Lock()
+
+    def create(self, conversation_id, payload):
+        job = Job(id=uuid.uuid4().hex, conversation_id=conversation_id, payload=payload)
+        with self._lock:
+            self._jobs[job.id] = job
+            jobs = self._by_conversation.setdefault(conversation_id, [])
+            jobs.append(job.id)
+            # Only the most recent jobs per conversation are kept for polling
+            while len(jobs) > self._max_jobs:
+                self._jobs.pop(jobs.pop(0), None)
+        return job
+
+    def update(self, job, **changes):
+        with self._lock:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.updated_at = timezone.now()
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def for_conversation(self, conversation_id):
+        with self._lock:
+            job_ids = list(self._by_conversation.get(conversation_id, []))
+        return [self._jobs[job_id] for job_id in job_ids if job_id in self._jobs]
+
+
+class DatabaseJobStore:
+    """Mirrors job state into the GraphJob table so any process can poll it.
+
+    This is for observability only: jobs still run from the in-process
+    queue, so jobs that were queued or running when the process stopped are
+    not picked up again on restart.
+    """
+
+    def create(self, conversation_id, payload):
+        from ..models import GraphJob
+
+        record = GraphJob.objects.create(conversation_id=conversation_id, payload=payload)
+        return self._to_job(record)
+
+    def update(self, job, **changes):
+        from ..models import GraphJob
+
+        for name, value in changes.items():
+            setattr(job, name, value)
+        job.updated_at = timezone.now()
+        GraphJob.objects.filter(id=job.id).update(**changes, updated_at=job.updated_at)
+
+    def get(self, job_id):
+        from ..models import GraphJob
+
+        record = GraphJob.objects.filter(id=job_id).first()
+        return self._to_job(record) if record else None
+
+    def for_conversation(self, conversation_id):
+        from ..models import GraphJob
+
+        records = GraphJob.objects.filter(conversation_id=conversation_id).order_by('created_at')
+        return [self._to_job(record) for record in records]
+
+    @staticmethod
+    def _to_job(record):
+        return Job(
+            id=record.id,
+            conversation_id=record.conversation_id,
+            payload=record.payload,
+            status=record.status,
+            attempts=record.attempts,
+            error=record.error,
+            result=record.result,
+            created_at=record.created_at,
+            updated_at=record.updated_at
+        )
+
+
+class JobQueue:
+    """In-process job queue with a pool of worker threads.
+
+    Jobs are sharded onto workers by conversation ID, so jobs for the same
+    conversation always run one at a time and in submission order. Failed
+    jobs are retried with exponential backoff before being marked failed;
+    deferred jobs (DeferJob) wait and run again, holding back the jobs
+    queued behind them.
+    """
+
+    _STOP = object()
+
+    def __init__(self, handler, store, workers=2, max_retries=3, retry_backoff=1.0):
+        self.handler = handler
+        self.store = store
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queues = []
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                job_queue = queue.Queue()
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(job_queue,),
+                    name=f"job-worker-{i}",
+                    daemon=True
+                )
+                self._queues.append(job_queue)
+                self._threads.append(thread)
+                thread.start()
+
+    def shutdown(self, timeout=None):
+        """Let the workers drain their queues, then stop them"""
+        with self._lock:
+            threads, queues = self._threads, self._queues
+            self._threads, self._queues = [], []
+
+        for job_queue in queues:
+            job_queue.put(self._STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def submit(self, conversation_id, payload):
+        self.start()
+        job = self.store.create(conversation_id, payload)
+        self._queues[hash(conversation_id) % len(self._queues)].put(job)
+        return job
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def status(self, conversation_id):
+        return self.store.for_conversation(conversation_id)
+
+    def _work(self, job_queue):
+        while True:
+            job = job_queue.get()
+            if job is self._STOP:
+                return
+            try:
+                self._run(job)
+            except Exception as e:
+                # e.g. the job store is unreachable; the worker must outlive it
+                print(f"❌ Job {job.id} could not be run: {str(e)}")
+            finally:
+                close_old_connections()
+
+    def _run(self, job):
+        attempt = 1
+        while True:
+            self.store.update(job, status=RUNNING, attempts=attempt)
+            try:
+                result = self.handler(job.conversation_id, job.payload)
+                self.store.update(job, status=SUCCEEDED, result=result, error='')
+                return
+            except DeferJob as e:
+                print(f"⚠️ Job {job.id} deferred for {e.delay}s: {str(e)}")
+                self.store.update(job, status=QUEUED, error=str(e))
+                time.sleep(e.delay)
+            except Exception as e:
+                print(f"❌ Job {job.id} attempt {attempt} failed: {str(e)}")
+                if attempt > self.max_retries:
+                    self.store.update(job, status=FAILED, error=str(e))
+                    return
+                self.store.update(job, status=QUEUED, error=str(e))
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+                attempt += 1
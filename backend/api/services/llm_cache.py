@@ -0,0 +1,160 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_WHITESPACE = re.compile(r'\s+')
+_TRAILING_PUNCTUATION = re.compile(r'[\s.!?]+$')
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize_message(text):
+    """Case-fold and collapse whitespace so trivially different inputs share a key"""
+    text = _WHITESPACE.sub(' ', text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub('', text)
+
+
+class TokenJaccardMatcher:
+    """Near-duplicate matcher based on word-set Jaccard similarity.
+
+    Candidates are found through an inverted index from token to entry, so a
+    lookup only scores entries that share at least one word with the query.
+    """
+
+    def __init__(self, threshold=0.9):
+        self.threshold = threshold
+        self._tokens = {}
+        self._index = {}
+
+    @staticmethod
+    def _tokenize(normalized):
+        return frozenset(_TOKEN.findall(normalized))
+
+    def add(self, scope, normalized, key):
+        tokens = self._tokenize(normalized)
+        self._tokens[key] = tokens
+        for token in tokens:
+            self._index.setdefault((scope, token), set()).add(key)
+
+    def remove(self, scope, key):
+        for token in self._tokens.pop(key, ()):
+            keys = self._index.get((scope, token))
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._index[(scope, token)]
+
+    def find(self, scope, normalized):
+        tokens = self._tokenize(normalized)
+        if not tokens:
+            return None
+
+        candidates = set()
+        for token in tokens:
+            candidates.update(self._index.get((scope, token), ()))
+
+        best_key, best_score = None, self.threshold
+        for key in candidates:
+            other = self._tokens[key]
+            score = len(tokens & other) / len(tokens | other)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
+
+
+class ResponseCache:
+    """TTL + LRU cache for LLM results keyed by normalised input, model and parameters.
+
+    An optional near-duplicate matcher is consulted on an exact-key miss;
+    matches are only considered within the same namespace, model and
+    parameters.
+    """
+
+    def __init__(self, max_entries, ttl, matcher=None, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.matcher = matcher
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    @staticmethod
+    def _scope(namespace, params):
+        return hashlib.sha256(
+            json.dumps([namespace, params], sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+    @staticmethod
+    def _key(scope, normalized):
+        return hashlib.sha256(f"{scope}:{normalized}".encode('utf-8')).hexdigest()
+
+    def get(self, namespace, message, params):
+        scope = self._scope(namespace, params)
+        normalized = normalize_message(message)
+        key = self._key(scope, normalized)
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self._counters['hits'] += 1
+                return value
+
+            if self.matcher is not None:
+                near_key = self.matcher.find(scope, normalized)
+                value = self._lookup(near_key) if near_key else None
+                if value is not None:
+                    self._counters['near_hits'] += 1
+                    return value
+
+            self._counters['misses'] += 1
+            return None
+
+    def set(self, namespace, message, params, value):
+        scope = self._scope(namespace, params)
+        normalized = normalize_message(message)
+        key = self._key(scope, normalized)
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (scope, self.clock() + self.ttl, value)
+            if self.matcher is not None:
+                self.matcher.add(scope, normalized, key)
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['near_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['hits'] + stats['near_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _lookup(self, key):
+        # Caller holds self._lock
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        _, expires_at, value = entry
+        if expires_at <= self.clock():
+            self._drop(key)
+            self._counters['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _drop(self, key):
+        scope, _, _ = self._entries.pop(key)
+        if self.matcher is not None:
+            self.matcher.remove(scope, key)
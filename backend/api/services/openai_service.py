@@ -1,115 +1,490 @@
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from django.conf import settings
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from django.utils.module_loading import import_string
+from ..utils.loop_local import LoopLocal
+from ..utils.metrics import span
+from .llm_cache import ResponseCache
+from ..utils.tokens import estimate_request_tokens
+from .admission import NORMAL, degradation_level, get_openai_token_budget, token_reserve
+from .resilience import OverloadedError, get_upstream
+import copy
+import httpx
 import json
 
+TOPIC_PROMPT = """
+            Analyze this text and extract key topics and their relationships.
+            Format the response EXACTLY as a JSON array of objects with this structure:
+            [
+                {{
+                    "topic": "main topic",
+                    "related_topics": ["related topic 1", "related topic 2"],
+                    "relationship_type": "describes/contains/relates to"
+                }}
+            ]
+
+            Text to analyze:
+            {text}
+
+            Remember: Response must be valid JSON array only, no other text.
+            """
+
+SUMMARY_FAILED = "Failed to generate summary"
+
+REPLY_SYSTEM_PROMPT = "You are a helpful assistant having a conversation with a user."
+
+TURN_PROMPT = (
+    REPLY_SYSTEM_PROMPT + " Put your reply in `reply`. In `topics`, list the key topics "
+    "of the exchange (the user's message and your reply) and how they relate, with "
+    "`relationship_type` one of describes, contains or relates to."
+)
+
+# Strict structured-output schema for a reply plus its topics in one completion
+TURN_SCHEMA = {
+    'name': 'conversation_turn',
+    'strict': True,
+    'schema': {
+        'type': 'object',
+        'properties': {
+            'reply': {'type': 'string'},
+            'topics': {
+                'type': 'array',
+                'items': {
+                    'type': 'object',
+                    'properties': {
+                        'topic': {'type': 'string'},
+                        'related_topics': {'type': 'array', 'items': {'type': 'string'}},
+                        'relationship_type': {'type': 'string'}
+                    },
+                    'required': ['topic', 'related_topics', 'relationship_type'],
+                    'additionalProperties': False
+                }
+            }
+        },
+        'required': ['reply', 'topics'],
+        'additionalProperties': False
+    }
+}
+
+# Completions that produce the reply; they may wait for token budget and may
+# use all of it, while optional calls are skipped rather than eat the reserve
+CRITICAL_STAGES = ('llm_reply',)
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=settings.OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS
+    )
+
+def _build_async_client():
+    return AsyncOpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        http_client=httpx.AsyncClient(limits=_pool_limits()),
+        # Retries and timeouts are applied by the 'openai' upstream policy
+        max_retries=0
+    )
+
+def _build_cache():
+    if not settings.OPENAI_CACHE_ENABLED:
+        return None
+    matcher = None
+    if settings.OPENAI_CACHE_MATCHER:
+        matcher = import_string(settings.OPENAI_CACHE_MATCHER)(threshold=settings.OPENAI_CACHE_SIMILARITY)
+    return ResponseCache(
+        max_entries=settings.OPENAI_CACHE_MAX_ENTRIES,
+        ttl=settings.OPENAI_CACHE_TTL,
+        matcher=matcher
+    )
+
 class OpenAIService:
-    def __init__(self):
-        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, client=None, async_client=None, cache=None, upstream=None, token_budget=None):
+        self.client = client or OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            http_client=httpx.Client(limits=_pool_limits()),
+            max_retries=0
+        )
+        self.upstream = upstream or get_upstream('openai')
+        self.token_budget = token_budget if token_budget is not None else get_openai_token_budget()
+        self._async_clients = LoopLocal(_build_async_client, async_client)
+        self.cache = cache if cache is not None else _build_cache()
         self.model = "gpt-3.5-turbo"
+
+    @property
+    def async_client(self):
+        return self._async_clients.get()
+
+    def warm_up(self):
+        """Open a pooled HTTPS connection to the API"""
+        self.client.models.list()
+
+    def health_check(self):
+        self.warm_up()
+
+    def close(self):
+        self.client.close()
+        self._async_clients.close(lambda client: client.close())
     
-    def generate_response(self, user_message: str) -> str:
+    def generate_response(self, user_message: str, use_cache: bool = True, context: Optional[List[Dict]] = None) -> str:
         """Generate a response using OpenAI's API"""
+        request = self._reply_request(user_message, context)
+        cached = self._cache_get('reply', user_message, request, use_cache)
+        if cached is not None:
+            return cached
+
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant having a conversation with a user."},
-                    {"role": "user", "content": user_message}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
-            
-            return response.choices[0].message.content.strip()
+            response = self._create(request, 'llm_reply', hedge=True)
+            reply = response.choices[0].message.content.strip()
             
+        except OverloadedError:
+            raise
         except Exception as e:
             print(f"OpenAI API Error: {str(e)}")
             raise Exception("Failed to generate response")
 
-    def extract_topics(self, text: str) -> List[Dict]:
-        """Extract topics and their relationships from text"""
+        self._cache_set('reply', user_message, request, reply, use_cache)
+        return reply
+
+    async def astream_response(self, user_message: str, use_cache: bool = True, context: Optional[List[Dict]] = None):
+        """Yield the reply token by token from a streamed chat completion on the async client.
+
+        An async generator, so an ASGI server sends each token as it arrives
+        rather than buffering the whole body.
+        """
+        request = self._reply_request(user_message, context)
+        cached = self._cache_get('reply', user_message, request, use_cache)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
         try:
-            prompt = """
-            Analyze this text and extract key topics and their relationships.
-            Format the response EXACTLY as a JSON array of objects with this structure:
-            [
-                {
-                    "topic": "main topic",
-                    "related_topics": ["related topic 1", "related topic 2"],
-                    "relationship_type": "describes/contains/relates to"
-                }
-            ]
+            stream = await self._acreate({**request, 'stream': True}, 'llm_reply')
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"OpenAI API Error: {str(e)}")
+            raise Exception("Failed to generate response")
 
-            Text to analyze:
-            {text}
+        try:
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            print(f"OpenAI API Error: {str(e)}")
+            raise Exception("Failed to generate response")
+        finally:
+            await stream.close()
 
-            Remember: Response must be valid JSON array only, no other text.
-            """.format(text=text)
+        self._cache_set('reply', user_message, request, ''.join(parts).strip(), use_cache)
+
+    async def agenerate_response(self, user_message: str, use_cache: bool = True, context: Optional[List[Dict]] = None) -> str:
+        """Generate a response using the async OpenAI client"""
+        request = self._reply_request(user_message, context)
+        cached = self._cache_get('reply', user_message, request, use_cache)
+        if cached is not None:
+            return cached
+
+        try:
+            response = await self._acreate(request, 'llm_reply', hedge=True)
+            reply = response.choices[0].message.content.strip()
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"OpenAI API Error: {str(e)}")
+            raise Exception("Failed to generate response")
+
+        self._cache_set('reply', user_message, request, reply, use_cache)
+        return reply
 
+    def generate_turn(self, user_message: str, use_cache: bool = True, context: Optional[List[Dict]] = None,
+                      with_topics: bool = True) -> Tuple[str, Optional[List[Dict]]]:
+        """Reply to a message, with the exchange's topics when OPENAI_COMBINED_TURN is on.
+
+        Returns (reply, topics). Topics come from the same completion as the
+        reply; they are None when combined turns are off, `with_topics` is
+        false (the caller asked for a specific topic extractor), the system
+        is under load (the shorter reply-only completion is used), or the
+        structured output could not be parsed, in which case the reply comes
+        from the plain reply call and topics are left to the graph job.
+        """
+        if not with_topics or not settings.OPENAI_COMBINED_TURN or degradation_level() != NORMAL:
+            return self.generate_response(user_message, use_cache, context), None
+
+        request = self._turn_request(user_message, context)
+        cached = self._cache_get('turn', user_message, request, use_cache)
+        if cached is not None:
+            return cached['reply'], cached['topics']
+
+        try:
+            response = self._create(request, 'llm_reply', hedge=True)
+            turn = self._parse_turn(response.choices[0].message)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Combined turn failed, falling back to separate calls: {str(e)}")
+            return self.generate_response(user_message, use_cache, context), None
+
+        self._cache_set('turn', user_message, request, turn, use_cache)
+        return turn['reply'], turn['topics']
+
+    async def agenerate_turn(self, user_message: str, use_cache: bool = True, context: Optional[List[Dict]] = None,
+                             with_topics: bool = True) -> Tuple[str, Optional[List[Dict]]]:
+        """Async counterpart of generate_turn"""
+        if not with_topics or not settings.OPENAI_COMBINED_TURN or degradation_level() != NORMAL:
+            return await self.agenerate_response(user_message, use_cache, context), None
+
+        request = self._turn_request(user_message, context)
+        cached = self._cache_get('turn', user_message, request, use_cache)
+        if cached is not None:
+            return cached['reply'], cached['topics']
+
+        try:
+            response = await self._acreate(request, 'llm_reply', hedge=True)
+            turn = self._parse_turn(response.choices[0].message)
+
+        except OverloadedError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Combined turn failed, falling back to separate calls: {str(e)}")
+            return await self.agenerate_response(user_message, use_cache, context), None
+
+        self._cache_set('turn', user_message, request, turn, use_cache)
+        return turn['reply'], turn['topics']
+
+    def extract_topics(self, text: str, use_cache: bool = True) -> List[Dict]:
+        """Extract topics and their relationships from text"""
+        request = self._topics_request(text)
+        cached = self._cache_get('topics', text, request, use_cache)
+        if cached is not None:
+            return cached
+
+        try:
             print(f"\nExtracting topics from: {text}")
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a topic extraction specialist. Return only valid JSON arrays."},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,
-                max_tokens=300
+            response = self._create(request, 'llm_topics')
+            topics = self._parse_topics(response.choices[0].message.content.strip())
+                
+        except Exception as e:
+            print(f"❌ Topic extraction error: {str(e)}")
+            raise
+
+        if topics:
+            self._cache_set('topics', text, request, topics, use_cache)
+        return topics
+
+    def _create(self, request: Dict, stage: str, hedge: bool = False):
+        """Chat completion under the 'openai' deadline, retry and circuit policy,
+        timed as the metrics stage `stage`"""
+        with span(stage) as timing:
+            response = self.upstream.call(
+                lambda timeout: self.client.chat.completions.create(**request, timeout=timeout),
+                hedge=hedge,
+                admit=self._admission(request, stage)
             )
-            
-            topics_str = response.choices[0].message.content.strip()
-            print(f"OpenAI response: {topics_str}")
-            
+            timing.size = self._response_size(response)
+        return response
+
+    async def _acreate(self, request: Dict, stage: str, hedge: bool = False):
+        with span(stage) as timing:
+            response = await self.upstream.acall(
+                lambda timeout: self.async_client.chat.completions.create(**request, timeout=timeout),
+                hedge=hedge,
+                admit=self._aadmission(request, stage)
+            )
+            timing.size = self._response_size(response)
+        return response
+
+    def _admission(self, request: Dict, stage: str):
+        """Charges each attempt at `request` (retries and hedges too) to the token budget.
+
+        Replies wait for tokens; optional calls and hedges only go ahead if
+        the tokens are there now.
+        """
+        if self.token_budget is None:
+            return None
+        amount, reserve = self._token_cost(request, stage)
+
+        def admit(hedge):
+            if stage in CRITICAL_STAGES and not hedge:
+                self.token_budget.acquire(amount, settings.UPSTREAM_WAIT_TIMEOUT)
+            elif not self.token_budget.try_acquire(amount, reserve):
+                raise OverloadedError(f"Skipping {stage}: token budget is reserved for replies")
+        return admit
+
+    def _aadmission(self, request: Dict, stage: str):
+        if self.token_budget is None:
+            return None
+        amount, reserve = self._token_cost(request, stage)
+
+        async def admit(hedge):
+            if stage in CRITICAL_STAGES and not hedge:
+                await self.token_budget.aacquire(amount, settings.UPSTREAM_WAIT_TIMEOUT)
+            elif not self.token_budget.try_acquire(amount, reserve):
+                raise OverloadedError(f"Skipping {stage}: token budget is reserved for replies")
+        return admit
+
+    def _token_cost(self, request: Dict, stage: str) -> Tuple[int, float]:
+        """Tokens the request may use, and what optional calls must leave in the budget"""
+        reserve = 0 if stage in CRITICAL_STAGES else token_reserve(self.token_budget)
+        return estimate_request_tokens(request), reserve
+
+    @staticmethod
+    def _response_size(response):
+        """Bytes of completion text; None for streams, which are still unread"""
+        choices = getattr(response, 'choices', None)
+        if not choices:
+            return None
+        return len((choices[0].message.content or '').encode())
+
+    @staticmethod
+    def _cache_params(request: Dict) -> Dict:
+        """Everything in the request except the caller's own (final) message.
+
+        Earlier messages, including conversation context, are part of the
+        key, so the same question in a different conversation is not a hit.
+        """
+        params = {k: v for k, v in request.items() if k != 'messages'}
+        params['history'] = [[m['role'], m['content']] for m in request['messages'][:-1]]
+        return params
+
+    def _cache_get(self, namespace, text, request, use_cache):
+        if self.cache is None or not use_cache:
+            return None
+        cached = self.cache.get(namespace, text, self._cache_params(request))
+        if cached is not None:
+            print(f"✓ OpenAI {namespace} cache hit")
+            # Callers may mutate the topic lists they get back
+            return copy.deepcopy(cached)
+        return None
+
+    def _cache_set(self, namespace, text, request, value, use_cache):
+        if self.cache is None or not use_cache:
+            return
+        self.cache.set(namespace, text, self._cache_params(request), copy.deepcopy(value))
+
+    def _reply_request(self, user_message: str, context: Optional[List[Dict]] = None) -> Dict:
+        return {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": REPLY_SYSTEM_PROMPT},
+                *(context or []),
+                {"role": "user", "content": user_message}
+            ],
+            'temperature': 0.7,
+            'max_tokens': 150
+        }
+
+    def _turn_request(self, user_message: str, context: Optional[List[Dict]] = None) -> Dict:
+        return {
+            'model': settings.OPENAI_COMBINED_MODEL,
+            'messages': [
+                {"role": "system", "content": TURN_PROMPT},
+                *(context or []),
+                {"role": "user", "content": user_message}
+            ],
+            'response_format': {'type': 'json_schema', 'json_schema': TURN_SCHEMA},
+            'temperature': 0.7,
+            'max_tokens': 450
+        }
+
+    def _topics_request(self, text: str) -> Dict:
+        return {
+            'model': self.model,
+            'messages': [
+                {"role": "system", "content": "You are a topic extraction specialist. Return only valid JSON arrays."},
+                {"role": "user", "content": TOPIC_PROMPT.format(text=text)}
+            ],
+            'temperature': 0.3,
+            'max_tokens': 300
+        }
+
+    @staticmethod
+    def _parse_turn(message) -> Dict:
+        """Validate a structured turn; raises ValueError on anything malformed"""
+        if getattr(message, 'refusal', None):
+            raise ValueError(f"Model refused: {message.refusal}")
+
+        try:
+            turn = json.loads(message.content or '')
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+
+        if not isinstance(turn, dict):
+            raise ValueError("Turn is not an object")
+        reply = turn.get('reply')
+        if not isinstance(reply, str) or not reply.strip():
+            raise ValueError("Turn has no reply")
+        topics = turn.get('topics')
+        if not isinstance(topics, list):
+            raise ValueError("Turn has no topic list")
+        for topic in topics:
+            if not (
+                isinstance(topic, dict)
+                and isinstance(topic.get('topic'), str)
+                and isinstance(topic.get('related_topics'), list)
+                and all(isinstance(t, str) for t in topic['related_topics'])
+                and isinstance(topic.get('relationship_type'), str)
+            ):
+                raise ValueError(f"Invalid topic: {topic}")
+
+        return {'reply': reply.strip(), 'topics': topics}
+
+    @staticmethod
+    def _parse_topics(topics_str: str) -> List[Dict]:
+        print(f"OpenAI response: {topics_str}")
+
+        try:
             topics = json.loads(topics_str)
-            print(f"Parsed topics: {topics}")
-            
-            if not topics:  # If empty array
-                print("⚠️ No topics extracted")
-                return []
-                
-            return topics
-                
         except json.JSONDecodeError as e:
             print(f"❌ JSON parsing error: {e}")
             print(f"Raw response: {topics_str}")
             return []
-        except Exception as e:
-            print(f"❌ Topic extraction error: {str(e)}")
+
+        print(f"Parsed topics: {topics}")
+        
+        if not topics:  # If empty array
+            print("⚠️ No topics extracted")
             return []
+            
+        return topics
 
     def summarize_conversation(self, transcript: str) -> str:
         """Generate a summary of the conversation"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            response = self._create({
+                'model': self.model,
+                'messages': [
                     {"role": "system", "content": "Summarize the following conversation concisely:"},
                     {"role": "user", "content": transcript}
                 ],
-                temperature=0.5,
-                max_tokens=100
-            )
+                'temperature': 0.5,
+                'max_tokens': 100
+            }, 'llm_summary')
             
             return response.choices[0].message.content.strip()
             
         except Exception as e:
             print(f"Summarization error: {str(e)}")
-            return "Failed to generate summary"
+            return SUMMARY_FAILED
 
     def analyze_sentiment(self, text: str) -> Dict:
         """Analyze the sentiment of the conversation"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
+            response = self._create({
+                'model': self.model,
+                'messages': [
                     {"role": "system", "content": "Analyze the sentiment of this text and return a JSON object with 'sentiment' (positive/negative/neutral) and 'confidence' (0-1):"},
                     {"role": "user", "content": text}
                 ],
-                temperature=0.3,
-                max_tokens=50
-            )
+                'temperature': 0.3,
+                'max_tokens': 50
+            }, 'llm_sentiment')
             
             return json.loads(response.choices[0].message.content.strip())
             
@@ -0,0 +1,548 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+
+import grpc
+import httpx
+import neo4j.exceptions
+import openai
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Failures worth retrying, and which count against an upstream's circuit.
+# Anything else (bad requests, auth errors) is the caller's problem.
+TRANSIENT_ERRORS = (
+    TimeoutError,
+    ConnectionError,
+    asyncio.TimeoutError,
+    httpx.TransportError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.RetryError,
+    grpc.FutureTimeoutError,
+    neo4j.exceptions.ServiceUnavailable,
+    neo4j.exceptions.SessionExpired,
+    neo4j.exceptions.TransientError,
+)
+
+
+class OverloadedError(Exception):
+    """Refused without being attempted because capacity is exhausted.
+
+    `retry_after` is a hint, in seconds, for when capacity may be back.
+    """
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(OverloadedError):
+    """The upstream has failed repeatedly and calls are being refused.
+
+    `retry_after` is the time left until a trial call is let through.
+    """
+
+
+class Bulkhead:
+    """Caps concurrent calls at `limit`, with a bounded queue of waiters.
+
+    A caller that finds every slot taken waits up to `wait_timeout` seconds
+    for one, unless `max_waiting` callers are already waiting, in which case
+    it is refused at once with OverloadedError. Threads wait on a condition;
+    coroutines poll, so they never block the event loop.
+    """
+
+    def __init__(self, name, limit, max_waiting=0, wait_timeout=0.0):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def _try_enter(self):
+        """Take a slot if one is free; join the queue if not; raise if the queue is full"""
+        if self.in_flight < self.limit:
+            self.in_flight += 1
+            return True
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise OverloadedError(f"{self.name} is at capacity", retry_after=self.wait_timeout or 1.0)
+        self.waiting += 1
+        return False
+
+    def _timed_out(self):
+        self.rejected += 1
+        return OverloadedError(
+            f"Timed out after {self.wait_timeout}s waiting for {self.name}",
+            retry_after=self.wait_timeout or 1.0
+        )
+
+    def acquire(self):
+        with self._condition:
+            if self._try_enter():
+                return
+            try:
+                if not self._condition.wait_for(lambda: self.in_flight < self.limit, self.wait_timeout):
+                    raise self._timed_out()
+                self.in_flight += 1
+            finally:
+                self.waiting -= 1
+
+    async def aacquire(self, poll_interval=0.005):
+        with self._condition:
+            if self._try_enter():
+                return
+        deadline = time.monotonic() + self.wait_timeout
+        try:
+            while True:
+                await asyncio.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+                with self._condition:
+                    if self.in_flight < self.limit:
+                        self.in_flight += 1
+                        return
+                    if time.monotonic() >= deadline:
+                        raise self._timed_out()
+                poll_interval = min(poll_interval * 2, 0.05)
+        finally:
+            # Also runs when the waiter is cancelled, e.g. because the client disconnected
+            with self._condition:
+                self.waiting -= 1
+
+    def try_acquire(self):
+        """Take a free slot without waiting or joining the queue"""
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        await self.aacquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def load(self):
+        """Callers in flight or waiting, as a fraction of the limit"""
+        with self._condition:
+            return (self.in_flight + self.waiting) / self.limit
+
+    def stats(self):
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'rejected': self.rejected
+            }
+
+
+class TokenBucket:
+    """Budget of `rate` units per second, accumulating up to `capacity`.
+
+    `reserve` keeps part of the bucket for other callers: a request that
+    would leave less than that much is treated as unaffordable.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.denied = 0
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, amount, reserve):
+        """Spend `amount` if affordable; otherwise the seconds until it will be"""
+        # A request larger than the whole bucket waits for a full one
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens - amount >= reserve:
+                self.tokens -= amount
+                return 0.0
+            return (amount + reserve - self.tokens) / self.rate
+
+    def try_acquire(self, amount, reserve=0):
+        if self._take(amount, reserve) == 0.0:
+            return True
+        with self._lock:
+            self.denied += 1
+        return False
+
+    def acquire(self, amount, timeout, reserve=0):
+        deadline = self.clock() + timeout
+        while (wait := self._take(amount, reserve)) > 0:
+            if self.clock() + wait > deadline:
+                with self._lock:
+                    self.denied += 1
+                raise OverloadedError("Token budget exhausted", retry_after=wait)
+            time.sleep(wait)
+
+    async def aacquire(self, amount, timeout, reserve=0):
+        deadline = self.clock() + timeout
+        while (wait := self._take(amount, reserve)) > 0:
+            if self.clock() + wait > deadline:
+                with self._lock:
+                    self.denied += 1
+                raise OverloadedError("Token budget exhausted", retry_after=wait)
+            await asyncio.sleep(wait)
+
+    def available(self):
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+    def stats(self):
+        return {'available': int(self.available()), 'capacity': self.capacity, 'denied': self.denied}
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter between attempts"""
+
+    def __init__(self, retries=2, base_delay=0.2, max_delay=2.0, transient=TRANSIENT_ERRORS):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.transient = transient
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def is_transient(self, error):
+        return isinstance(error, self.transient)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive transient failures.
+
+    While open, calls fail immediately with CircuitOpenError. After
+    `reset_timeout` seconds one trial call is let through (half-open); its
+    success closes the circuit and its failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            # While half-open the trial call decides, so ask again shortly
+            retry_after = self.opened_at + self.reset_timeout - self.clock() if self.state == OPEN else 1.0
+        raise CircuitOpenError(f"{self.name} circuit is open", retry_after=max(retry_after, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_abandoned(self):
+        """A call gave up before the upstream answered; let another trial through"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"⚠️ {self.name} circuit opened after {self.failures} failure(s)")
+                self.state = OPEN
+                self.opened_at = self.clock()
+                self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures, 'rejected': self.rejected}
+
+
+class Upstream:
+    """Deadline, retry, circuit-breaker and hedging policy for one upstream service.
+
+    Calls are made as `fn(timeout)`, where `fn` passes the per-attempt
+    deadline on to its client. Only idempotent calls are retried. With
+    `hedge=True` and `hedge_after` set, a second identical attempt is started
+    if the first has not answered within `hedge_after` seconds, and whichever
+    finishes first wins. With a `bulkhead`, at most its limit of attempts are
+    in flight at once and callers beyond its queue are refused.
+
+    `admit(hedge)`, when given, is called before every attempt to charge it
+    to a budget and raises OverloadedError to refuse it. A hedge is only
+    started if a bulkhead slot is free and `admit(True)` accepts it at once;
+    otherwise the first attempt is left to finish on its own. For `acall`,
+    `admit` is a coroutine function.
+    """
+
+    def __init__(self, name, timeout, retry=None, breaker=None, hedge_after=None, hedge_workers=8,
+                 bulkhead=None):
+        self.name = name
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy(retries=0)
+        self.breaker = breaker or CircuitBreaker(name)
+        self.bulkhead = bulkhead
+        self.hedge_after = hedge_after
+        self.hedges = 0
+        self._hedge_workers = hedge_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def call(self, fn, idempotent=True, hedge=False, admit=None):
+        attempts = self.retry.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if admit is not None:
+                admit(False)
+            # A slot is held per attempt (a hedge takes its own), never while backing off
+            with self._slot():
+                self.breaker.allow()
+                try:
+                    if hedge and self.hedge_after is not None:
+                        result = self._hedged(fn, admit)
+                    else:
+                        result = fn(self.timeout)
+                except Exception as e:
+                    if not self.retry.is_transient(e):
+                        # The upstream answered, it just refused this request
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    if attempt == attempts - 1:
+                        raise
+                    error = e
+                except BaseException:
+                    # Cancelled (e.g. the client went away): no verdict on the upstream
+                    self.breaker.record_abandoned()
+                    raise
+                else:
+                    self.breaker.record_success()
+                    return result
+            delay = self.retry.delay(attempt)
+            print(f"⚠️ {self.name} call failed ({type(error).__name__}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    async def acall(self, fn, idempotent=True, hedge=False, admit=None):
+        """Async counterpart of call; `fn(timeout)` returns an awaitable"""
+        attempts = self.retry.retries + 1 if idempotent else 1
+        for attempt in range(attempts):
+            if admit is not None:
+                await admit(False)
+            async with self._aslot():
+                self.breaker.allow()
+                try:
+                    if hedge and self.hedge_after is not None:
+                        result = await self._ahedged(fn, admit)
+                    else:
+                        result = await asyncio.wait_for(fn(self.timeout), self.timeout)
+                except Exception as e:
+                    if not self.retry.is_transient(e):
+                        # The upstream answered, it just refused this request
+                        self.breaker.record_success()
+                        raise
+                    self.breaker.record_failure()
+                    if attempt == attempts - 1:
+                        raise
+                    error = e
+                except BaseException:
+                    # Cancelled (e.g. the client went away): no verdict on the upstream
+                    self.breaker.record_abandoned()
+                    raise
+                else:
+                    self.breaker.record_success()
+                    return result
+            delay = self.retry.delay(attempt)
+            print(f"⚠️ {self.name} call failed ({type(error).__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    def _slot(self):
+        return self.bulkhead.slot() if self.bulkhead is not None else nullcontext()
+
+    def _aslot(self):
+        return self.bulkhead.aslot() if self.bulkhead is not None else nullcontext()
+
+    def _take_hedge_slot(self):
+        return self.bulkhead is None or self.bulkhead.try_acquire()
+
+    def _release_hedge_slot(self):
+        if self.bulkhead is not None:
+            self.bulkhead.release()
+
+    def _admit_hedge(self, admit):
+        """Take a slot and the budget for a hedge without waiting for either"""
+        if not self._take_hedge_slot():
+            return False
+        try:
+            if admit is not None:
+                admit(True)
+        except OverloadedError:
+            self._release_hedge_slot()
+            return False
+        return True
+
+    async def _aadmit_hedge(self, admit):
+        if not self._take_hedge_slot():
+            return False
+        try:
+            if admit is not None:
+                await admit(True)
+        except OverloadedError:
+            self._release_hedge_slot()
+            return False
+        return True
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self._hedge_workers,
+                    thread_name_prefix=f'{self.name}-hedge'
+                )
+            return self._executor
+
+    def _hedged(self, fn, admit=None):
+        executor = self._get_executor()
+        pending = {executor.submit(fn, self.timeout)}
+        done, _ = wait(pending, timeout=self.hedge_after)
+        if not done and self._admit_hedge(admit):
+            self.hedges += 1
+            hedge_future = executor.submit(fn, self.timeout)
+            # Also runs if the hedge is cancelled before it starts
+            hedge_future.add_done_callback(lambda _: self._release_hedge_slot())
+            pending.add(hedge_future)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _ahedged(self, fn, admit=None):
+        first = asyncio.ensure_future(asyncio.wait_for(fn(self.timeout), self.timeout))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        pending = {first}
+        if not done and await self._aadmit_hedge(admit):
+            self.hedges += 1
+            hedge_task = asyncio.ensure_future(asyncio.wait_for(fn(self.timeout), self.timeout))
+            hedge_task.add_done_callback(lambda _: self._release_hedge_slot())
+            pending.add(hedge_task)
+
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self):
+        stats = {'timeout': self.timeout, 'hedges': self.hedges, **self.breaker.stats()}
+        if self.bulkhead is not None:
+            stats['concurrency'] = self.bulkhead.stats()
+        return stats
+
+
+def _build_upstream(name):
+    return Upstream(
+        name,
+        timeout=settings.UPSTREAM_TIMEOUTS[name],
+        retry=RetryPolicy(
+            retries=settings.UPSTREAM_RETRIES,
+            base_delay=settings.UPSTREAM_RETRY_BASE_DELAY,
+            max_delay=settings.UPSTREAM_RETRY_MAX_DELAY
+        ),
+        breaker=CircuitBreaker(
+            name,
+            failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+            reset_timeout=settings.CIRCUIT_RESET_TIMEOUT
+        ),
+        hedge_after=settings.OPENAI_HEDGE_AFTER if name == 'openai' else None,
+        # Hedged calls run both attempts on this pool, so size it like the connection pool
+        hedge_workers=settings.OPENAI_MAX_CONNECTIONS,
+        bulkhead=Bulkhead(
+            name,
+            limit=settings.UPSTREAM_CONCURRENCY[name],
+            max_waiting=settings.UPSTREAM_MAX_WAITING,
+            wait_timeout=settings.UPSTREAM_WAIT_TIMEOUT
+        )
+    )
+
+
+_upstreams = {}
+_upstreams_lock = threading.Lock()
+
+
+def get_upstream(name):
+    """The process-wide policy for 'openai', 'stt', 'tts' or 'neo4j'"""
+    with _upstreams_lock:
+        if name not in _upstreams:
+            _upstreams[name] = _build_upstream(name)
+        return _upstreams[name]
+
+
+def upstream_stats():
+    with _upstreams_lock:
+        return {name: upstream.stats() for name, upstream in _upstreams.items()}
@@ -0,0 +1,226 @@
+import html
+import re
+
+from django.db import connection
+
+from ..models import ConversationGraph, Message
+from ..utils.pagination import decode_rank_cursor, encode_rank_cursor
+
+SEARCH_KINDS = ('messages', 'topics')
+MAX_QUERY_LENGTH = 200
+
+# Highlight delimiters that cannot survive in stored text; swapped for <mark>
+# after the snippet is HTML-escaped
+_START, _STOP = '\x02', '\x03'
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def highlight(snippet):
+    """Escape a raw snippet for HTML and mark the matched terms"""
+    return html.escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def fts5_query(text):
+    """Free text as an FTS5 query in which every word or "quoted phrase" must match.
+
+    Each term is quoted, so FTS5 operators and column filters typed by the
+    user are searched for as plain words.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(text):
+        term = ' '.join((phrase or word).replace('"', ' ').split())
+        if re.search(r'\w', term):
+            terms.append(f'"{term}"')
+    return ' '.join(terms)
+
+
+class PostgresSearchBackend:
+    """tsvector columns with GIN indexes (migration 0007), ranked by ts_rank_cd.
+
+    Queries use websearch_to_tsquery, so quoted phrases, "or" and -exclusions
+    work. Snippets are only built for the page being returned.
+    """
+
+    HEADLINE_OPTIONS = (
+        f'StartSel={_START}, StopSel={_STOP}, MaxWords=24, MinWords=8, '
+        'MaxFragments=2, FragmentDelimiter=" … "'
+    )
+    SOURCES = {
+        'messages': ('messages', 'm.conversation_id', 'm.content'),
+        'topics': (
+            'conversation_graphs', 'm.conversation_id',
+            "array_to_string(ARRAY(SELECT jsonb_array_elements_text(m.nodes)), ', ')"
+        ),
+    }
+
+    def search(self, kind, query, user_id=None, after=None, limit=20):
+        table, conversation, document = self.SOURCES[kind]
+        params = {'query': query, 'headline': self.HEADLINE_OPTIONS, 'limit': limit}
+
+        user_join = user_filter = cursor_filter = ''
+        if user_id is not None:
+            user_join = f'JOIN conversations c ON c.id = {conversation}'
+            user_filter = 'AND c.user_id = %(user_id)s'
+            params['user_id'] = user_id
+        if after is not None:
+            cursor_filter = (
+                'WHERE ranked.score < %(after_score)s '
+                'OR (ranked.score = %(after_score)s AND ranked.id < %(after_id)s)'
+            )
+            params['after_score'], params['after_id'] = after
+
+        sql = f"""
+            WITH q AS (SELECT websearch_to_tsquery('english', %(query)s) AS query),
+            ranked AS (
+                -- float8, so the score round-trips exactly through the cursor
+                SELECT m.id, ts_rank_cd(m.search_vector, q.query)::float8 AS score
+                FROM {table} m
+                CROSS JOIN q
+                {user_join}
+                WHERE m.search_vector @@ q.query {user_filter}
+            )
+            SELECT ranked.id, ranked.score, ts_headline('english', {document}, q.query, %(headline)s)
+            FROM ranked
+            JOIN {table} m ON m.id = ranked.id
+            CROSS JOIN q
+            {cursor_filter}
+            ORDER BY ranked.score DESC, ranked.id DESC
+            LIMIT %(limit)s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [(pk, float(score), snippet) for pk, score, snippet in cursor.fetchall()]
+
+
+class SQLiteSearchBackend:
+    """FTS5 tables maintained by triggers (migration 0007), ranked by bm25.
+
+    Scores are negated bm25 so that, as on PostgreSQL, higher is better.
+    """
+
+    SOURCES = {
+        'messages': ('message_search', 'messages', 'm.conversation_id'),
+        'topics': ('topic_search', 'conversation_graphs', 'm.conversation_id'),
+    }
+
+    def search(self, kind, query, user_id=None, after=None, limit=20):
+        index, table, conversation = self.SOURCES[kind]
+        match = fts5_query(query)
+        if not match:
+            return []
+
+        params = [match]
+        user_join = user_filter = cursor_filter = ''
+        if user_id is not None:
+            user_join = f'JOIN conversations c ON c.id = {conversation}'
+            user_filter = 'AND c.user_id = %s'
+            params.append(user_id)
+        if after is not None:
+            cursor_filter = 'WHERE score < %s OR (score = %s AND id < %s)'
+            params.extend([after[0], after[0], after[1]])
+        params.append(limit)
+
+        # bm25() is only available in the full-text query itself, so the page is
+        # picked in an outer query, and snippets are built for that page alone
+        page_sql = f"""
+            SELECT id, score FROM (
+                SELECT m.id AS id, -bm25({index}) AS score
+                FROM {index}
+                JOIN {table} m ON m.id = {index}.rowid
+                {user_join}
+                WHERE {index} MATCH %s {user_filter}
+                LIMIT -1
+            )
+            {cursor_filter}
+            ORDER BY score DESC, id DESC
+            LIMIT %s
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(page_sql, params)
+            page = cursor.fetchall()
+            if not page:
+                return []
+
+            placeholders = ', '.join(['%s'] * len(page))
+            cursor.execute(
+                f"""
+                SELECT rowid, snippet({index}, 0, %s, %s, ' … ', 16)
+                FROM {index}
+                WHERE {index} MATCH %s AND rowid IN ({placeholders})
+                """,
+                [_START, _STOP, match, *(pk for pk, _ in page)]
+            )
+            snippets = dict(cursor.fetchall())
+        return [(pk, score, snippets.get(pk, '')) for pk, score in page]
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+class SearchService:
+    """Ranked full-text search over message content and conversation topics.
+
+    The index lives in the database and is updated in the same transaction
+    as every message and graph write (see migration 0007), so results are
+    current as soon as a turn is saved.
+    """
+
+    def __init__(self, backend=None):
+        if backend is None:
+            if connection.vendor not in BACKENDS:
+                raise NotImplementedError(f"Full-text search is not available on {connection.vendor}")
+            backend = BACKENDS[connection.vendor]()
+        self.backend = backend
+
+    def search(self, query, kind='messages', user_id=None, cursor=None, limit=20):
+        """One page of results, best first, and the cursor for the next page (or None)"""
+        query = (query or '').strip()
+        if not query:
+            raise ValueError("A search query is required")
+        if len(query) > MAX_QUERY_LENGTH:
+            raise ValueError(f"Search queries are limited to {MAX_QUERY_LENGTH} characters")
+        if kind not in SEARCH_KINDS:
+            raise ValueError(f"type must be one of: {', '.join(SEARCH_KINDS)}")
+
+        after = decode_rank_cursor(cursor) if cursor else None
+        # One extra row tells us whether there is a next page
+        rows = self.backend.search(kind, query, user_id=user_id, after=after, limit=limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        results = (self._messages if kind == 'messages' else self._topics)(rows)
+        next_cursor = encode_rank_cursor(rows[-1][1], rows[-1][0]) if has_more else None
+        return results, next_cursor
+
+    @staticmethod
+    def _messages(rows):
+        messages = Message.objects.in_bulk([pk for pk, _, _ in rows])
+        return [
+            {
+                'type': 'message',
+                'conversation_id': messages[pk].conversation_id,
+                'message_id': pk,
+                'sequence': messages[pk].sequence,
+                'role': messages[pk].role,
+                'created_at': messages[pk].created_at,
+                'score': score,
+                'snippet': highlight(snippet)
+            }
+            for pk, score, snippet in rows if pk in messages
+        ]
+
+    @staticmethod
+    def _topics(rows):
+        graphs = ConversationGraph.objects.in_bulk([pk for pk, _, _ in rows])
+        return [
+            {
+                'type': 'topic',
+                'conversation_id': graphs[pk].conversation_id,
+                'score': score,
+                'snippet': highlight(snippet)
+            }
+            for pk, score, snippet in rows if pk in graphs
+        ]
@@ -1,47 +1,162 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+
+import grpc
+from django.conf import settings
 from google.cloud import speech_v1
+from ..utils.loop_local import LoopLocal
+from ..utils.audio import PreparedAudio, segment_upload
+from ..utils.metrics import span
+from .resilience import get_upstream
 
 class STTService:
-    def __init__(self):
+    def __init__(self, client=None, async_client=None, upstream=None):
         print("Initializing STT Service...")
-        self.client = speech_v1.SpeechClient()
+        self.client = client or speech_v1.SpeechClient()
+        self.upstream = upstream or get_upstream('stt')
+        self._async_clients = LoopLocal(speech_v1.SpeechAsyncClient, async_client)
+        self._executor = ThreadPoolExecutor(
+            max_workers=settings.STT_SEGMENT_WORKERS,
+            thread_name_prefix='stt-segment'
+        )
+
+    @property
+    def async_client(self):
+        return self._async_clients.get()
+
+    def warm_up(self):
+        """Open the gRPC channel so the first request skips the handshake"""
+        channel = self.client.transport.grpc_channel
+        grpc.channel_ready_future(channel).result(timeout=settings.CLIENT_WARM_UP_TIMEOUT)
+
+    def health_check(self):
+        self.warm_up()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.client.transport.close()
+        self._async_clients.close(lambda client: client.transport.close())
     
     def transcribe(self, audio_file):
+        """Transcribe an upload, recognising its voiced segments concurrently"""
         try:
-            print(f"\nSTT Debug:")
-            print(f"Audio file type: {audio_file.content_type}")
-            print(f"Audio file size: {audio_file.size} bytes")
-            
-            # Read the audio content
-            content = audio_file.read()
-            print(f"Read {len(content)} bytes from file")
-            
-            # Configure audio and recognition settings
-            audio = speech_v1.RecognitionAudio(content=content)
-            
-            config = speech_v1.RecognitionConfig(
-                encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,  # Changed from LINEAR16
-                sample_rate_hertz=48000,  # Common sample rate for web audio
-                language_code="en-US",
-                enable_automatic_punctuation=True
-            )
-            
-            print("Sending request to Google STT...")
-            response = self.client.recognize(config=config, audio=audio)
-            print(f"Received response: {response}")
-            
-            if response.results:
-                transcript = response.results[0].alternatives[0].transcript
-                confidence = response.results[0].alternatives[0].confidence
-                print(f"Transcript: '{transcript}'")
-                print(f"Confidence: {confidence}")
-                return transcript
-            else:
-                print("No transcription results returned")
-                return ""
+            with span('stt', size=audio_file.size), self._segments(audio_file) as loaders:
+                print(f"Sending {len(loaders)} request(s) to Google STT...")
+                transcripts = list(self._executor.map(self._recognize, loaders))
+            return self._join(transcripts)
                 
         except Exception as e:
             print(f"STT Error: {str(e)}")
             print("Full error:")
             import traceback
             traceback.print_exc()
-            raise e
\ No newline at end of file
+            raise e
+
+    def _recognize(self, load):
+        config, audio = self._build_request(load())
+        response = self.upstream.call(
+            lambda timeout: self.client.recognize(config=config, audio=audio, timeout=timeout)
+        )
+        return self._parse_response(response)
+
+    def streaming_recognize(self, audio_chunks, encoding='WEBM_OPUS', sample_rate_hertz=48000):
+        """Yield (transcript, is_final) pairs while audio chunks are still arriving"""
+        streaming_config = speech_v1.StreamingRecognitionConfig(
+            config=speech_v1.RecognitionConfig(
+                encoding=speech_v1.RecognitionConfig.AudioEncoding[encoding],
+                sample_rate_hertz=sample_rate_hertz,
+                language_code="en-US",
+                enable_automatic_punctuation=True
+            ),
+            interim_results=True
+        )
+        requests = (
+            speech_v1.StreamingRecognizeRequest(audio_content=chunk)
+            for chunk in audio_chunks
+        )
+
+        responses = self.client.streaming_recognize(config=streaming_config, requests=requests)
+        for response in responses:
+            for result in response.results:
+                if result.alternatives:
+                    yield result.alternatives[0].transcript, result.is_final
+
+    async def atranscribe(self, audio_file):
+        try:
+            semaphore = asyncio.Semaphore(settings.STT_SEGMENT_WORKERS)
+
+            async def recognize(load):
+                async with semaphore:
+                    config, audio = self._build_request(await asyncio.to_thread(load))
+                    response = await self.upstream.acall(
+                        lambda timeout: self.async_client.recognize(config=config, audio=audio, timeout=timeout)
+                    )
+                return self._parse_response(response)
+
+            with span('stt', size=audio_file.size), ExitStack() as stack:
+                # Scanning the upload for speech is blocking file I/O
+                loaders = await asyncio.to_thread(stack.enter_context, self._segments(audio_file))
+                print(f"Sending {len(loaders)} async request(s) to Google STT...")
+                transcripts = await asyncio.gather(*(recognize(load) for load in loaders))
+            return self._join(transcripts)
+
+        except Exception as e:
+            print(f"STT Error: {str(e)}")
+            raise e
+
+    @staticmethod
+    def _segments(audio_file):
+        """Context manager yielding one loader per segment to recognise"""
+        if settings.AUDIO_PREPROCESSING:
+            return segment_upload(audio_file)
+
+        def load():
+            content = audio_file.read()
+            return PreparedAudio(
+                content=content,
+                encoding='WEBM_OPUS',
+                sample_rate=48000,
+                container='webm',
+                original_bytes=len(content)
+            )
+        return nullcontext([load])
+
+    @staticmethod
+    def _build_request(prepared):
+        print(f"\nSTT Debug:")
+        print(f"Audio: {prepared.container} upload of {prepared.original_bytes} bytes")
+        print(f"Sending {len(prepared.content)} bytes of {prepared.encoding}")
+        
+        # Configure audio and recognition settings
+        audio = speech_v1.RecognitionAudio(content=prepared.content)
+        
+        config = speech_v1.RecognitionConfig(
+            encoding=speech_v1.RecognitionConfig.AudioEncoding[prepared.encoding],
+            language_code="en-US",
+            enable_automatic_punctuation=True
+        )
+        # Left unset for formats that carry their own rate in the header
+        if prepared.sample_rate:
+            config.sample_rate_hertz = prepared.sample_rate
+        return config, audio
+
+    @staticmethod
+    def _join(transcripts):
+        return ' '.join(t for t in transcripts if t).strip()
+
+    @staticmethod
+    def _parse_response(response):
+        print(f"Received response: {response}")
+        
+        if response.results:
+            # Longer audio comes back as consecutive results
+            alternatives = [result.alternatives[0] for result in response.results if result.alternatives]
+            transcript = ' '.join(a.transcript.strip() for a in alternatives)
+            confidence = min(a.confidence for a in alternatives) if alternatives else 0
+            print(f"Transcript: '{transcript}'")
+            print(f"Confidence: {confidence}")
+            return transcript
+        else:
+            print("No transcription results returned")
+            return ""
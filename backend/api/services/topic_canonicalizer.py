@@ -0,0 +1,210 @@
+import json
+import re
+import threading
+import unicodedata
+
+from django.conf import settings
+
+_SEPARATORS = re.compile(r'[\s_\-/]+')
+_EDGE_PUNCTUATION = re.compile(r'^[^\w]+|[^\w]+$')
+_DIGITS = re.compile(r'\d+')
+
+# Acronyms are too short to fuzzy-match, so common ones are aliased up front.
+# TOPIC_ALIASES_FILE can add to or override these.
+DEFAULT_ALIASES = {
+    'AI': 'Artificial Intelligence',
+    'ML': 'Machine Learning',
+    'DL': 'Deep Learning',
+    'NLP': 'Natural Language Processing',
+    'LLM': 'Large Language Model',
+    'CV': 'Computer Vision',
+    'UI': 'User Interface',
+    'UX': 'User Experience',
+    'DB': 'Database',
+}
+
+
+def _singular(word):
+    if len(word) <= 3:
+        return word
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'shes', 'ches', 'xes')):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def normalize_topic(name):
+    """Lookup key for a topic: case-folded, single-spaced, last word singular.
+
+    "Neural-Networks ", "neural network" and "Neural  networks" share a key.
+    """
+    text = unicodedata.normalize('NFKC', name).casefold()
+    text = _SEPARATORS.sub(' ', text).strip()
+    text = _EDGE_PUNCTUATION.sub('', text)
+    if not text:
+        return ''
+    words = text.split(' ')
+    words[-1] = _singular(words[-1])
+    return ' '.join(words)
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def load_aliases():
+    aliases = dict(DEFAULT_ALIASES)
+    if settings.TOPIC_ALIASES_FILE:
+        try:
+            with open(settings.TOPIC_ALIASES_FILE) as f:
+                aliases.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load topic aliases from {settings.TOPIC_ALIASES_FILE}: {str(e)}")
+    return aliases
+
+
+class TopicCanonicalizer:
+    """Maps extracted topic names onto the names already in the graph.
+
+    A name resolves, in order, through its normalised key, the alias table,
+    and a trigram index over known keys (Dice similarity, with numbers
+    required to match so "Python 2" and "Python 3" stay apart). Names that
+    match nothing become canonical themselves. `seed` is called once, on
+    first use, to load the existing vocabulary.
+    """
+
+    def __init__(self, aliases=None, threshold=0.85, seed=None):
+        self.threshold = threshold
+        self._seed = seed
+        self._display = {}
+        self._aliases = {}
+        self._trigrams = {}
+        self._index = {}
+        self._lock = threading.RLock()
+        self.counts = {'exact': 0, 'alias': 0, 'fuzzy': 0, 'new': 0}
+
+        for alias, canonical in (aliases or {}).items():
+            self.add_alias(alias, canonical)
+
+    def add_alias(self, alias, canonical):
+        with self._lock:
+            canonical_key = self._register(canonical)
+            alias_key = normalize_topic(alias)
+            if alias_key and alias_key != canonical_key:
+                self._aliases[alias_key] = canonical_key
+
+    def add(self, names):
+        with self._lock:
+            for name in names:
+                self._register(name)
+
+    def _register(self, name):
+        key = normalize_topic(name)
+        if key and key not in self._display:
+            self._display[key] = ' '.join(name.split())
+            grams = _trigrams(key)
+            self._trigrams[key] = len(grams)
+            for gram in grams:
+                self._index.setdefault(gram, set()).add(key)
+        return key
+
+    def _ensure_seeded(self):
+        if self._seed is None:
+            return
+        seed, self._seed = self._seed, None
+        try:
+            self.add(seed())
+        except Exception as e:
+            print(f"⚠️ Could not seed topic canonicalizer: {str(e)}")
+
+    def _fuzzy(self, key):
+        if len(key) < 4:
+            return None
+
+        grams = _trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self._index.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+
+        digits = _DIGITS.findall(key)
+        best_key, best_score = None, self.threshold
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + self._trigrams[candidate])
+            if score >= best_score and _DIGITS.findall(candidate) == digits:
+                best_key, best_score = candidate, score
+        return best_key
+
+    def canonicalize(self, name):
+        """The canonical display name for `name`, or None if it is blank"""
+        with self._lock:
+            self._ensure_seeded()
+            key = normalize_topic(name)
+            if not key:
+                return None
+
+            if key in self._aliases:
+                self.counts['alias'] += 1
+                return self._display[self._aliases[key]]
+            if key in self._display:
+                self.counts['exact'] += 1
+                return self._display[key]
+
+            match = self._fuzzy(key)
+            if match is not None:
+                self.counts['fuzzy'] += 1
+                self._aliases[key] = match
+                return self._display[match]
+
+            self.counts['new'] += 1
+            self._register(name)
+            return self._display[key]
+
+    def canonicalize_topics(self, topics):
+        """Rewrite extracted topic objects onto canonical names.
+
+        Related topics that collapse onto their main topic, or onto each
+        other, are dropped.
+        """
+        result = []
+        for topic_obj in topics:
+            main_topic = self.canonicalize(topic_obj.get('topic') or '')
+            if not main_topic:
+                result.append(topic_obj)
+                continue
+
+            related = []
+            for related_topic in topic_obj.get('related_topics', []):
+                canonical = self.canonicalize(related_topic or '')
+                if canonical and canonical != main_topic and canonical not in related:
+                    related.append(canonical)
+
+            result.append({**topic_obj, 'topic': main_topic, 'related_topics': related})
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'topics': len(self._display),
+                'aliases': len(self._aliases),
+                **self.counts
+            }
+
+
+def _seed_from_graph_index():
+    from .graph_index import get_graph_index
+    return get_graph_index().topics()
+
+
+def build_canonicalizer():
+    if not settings.TOPIC_CANONICALIZATION:
+        return None
+    return TopicCanonicalizer(
+        aliases=load_aliases(),
+        threshold=settings.TOPIC_FUZZY_THRESHOLD,
+        seed=_seed_from_graph_index
+    )
@@ -0,0 +1,125 @@
+import math
+import re
+import threading
+from collections import Counter
+
+_SENTENCE = re.compile(r'[.!?;:\n]+')
+_WORD = re.compile(r"[A-Za-z][A-Za-z0-9+#'\-]*|\d+(?:\.\d+)?")
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before
+being below between both but by can could did do does doing down during each either else
+even ever every few for from further get gets got had has have having he her here hers
+herself him himself his how i if in into is it its itself just know let like lot make many
+may me might more most much must my myself need no nor not now of off often on once only or
+other our ours ourselves out over own please pretty quite rather really right said same say
+says see she should so some something such sure tell than thank thanks that the their
+theirs them themselves then there these they thing things think this those through to too
+under until up us use used using very want was way we well were what when where which while
+who whom why will with would yes yet you your yours yourself yourselves i'm it's that's
+you're don't can't let's hello hi okay ok great good sounds help
+explain explains learn learns adjust adjusts work works mean means find give gives go goes
+going come take takes show shows try call called keep look seem feel ask become leave put
+run runs start happen understand describe discuss talk include includes including based
+made makes done new different important large small big best better lots kind sort
+usually always sometimes early late popular plan planning
+""".split())
+
+
+class LocalTopicExtractor:
+    """Keyphrase-based topic extraction with no network calls.
+
+    Candidate phrases are runs of non-stopwords (RAKE). Each word scores
+    degree/frequency within the text, weighted by an inverse document
+    frequency learned from the turns seen so far, and a phrase scores the
+    sum of its words. Top phrases become topics, related to the lower-ranked
+    top phrases found within `window` sentences of them. Output has the same
+    shape as OpenAIService.extract_topics.
+
+    Scoring is plain Python rather than vectorised NumPy TF-IDF: a turn holds
+    tens of words, so building arrays would cost more than the loops it
+    replaces. The work is linear in the turn's words (about 0.1 ms for a
+    typical turn, 1-2 ms for several hundred words) and independent of how
+    many turns have been seen.
+    """
+
+    def __init__(self, max_topics=5, max_related=4, window=1, max_phrase_words=3):
+        self.max_topics = max_topics
+        self.max_related = max_related
+        self.window = window
+        self.max_phrase_words = max_phrase_words
+        self._document_frequency = Counter()
+        self._documents = 0
+        self._lock = threading.Lock()
+
+    def _phrases(self, sentence):
+        phrases, current = [], []
+        for word in _WORD.findall(sentence):
+            if word.lower() in STOPWORDS or len(word) < 2:
+                if current:
+                    phrases.append(current)
+                current = []
+            else:
+                current.append(word)
+                if len(current) == self.max_phrase_words:
+                    phrases.append(current)
+                    current = []
+        if current:
+            phrases.append(current)
+        return phrases
+
+    def _idf(self, word):
+        return math.log((1 + self._documents) / (1 + self._document_frequency[word])) + 1
+
+    def extract_topics(self, text):
+        sentences = [s for s in _SENTENCE.split(text or '') if s.strip()]
+        occurrences = []
+        for index, sentence in enumerate(sentences):
+            occurrences.extend((index, phrase) for phrase in self._phrases(sentence))
+        if not occurrences:
+            return []
+
+        frequency, degree = Counter(), Counter()
+        for _, phrase in occurrences:
+            for word in phrase:
+                frequency[word.lower()] += 1
+                degree[word.lower()] += len(phrase)
+
+        with self._lock:
+            weights = {word: degree[word] / frequency[word] * self._idf(word) for word in frequency}
+            self._documents += 1
+            self._document_frequency.update(frequency.keys())
+
+        # Each phrase keeps the casing and sentences of its occurrences
+        phrases = {}
+        for index, phrase in occurrences:
+            key = ' '.join(word.lower() for word in phrase)
+            entry = phrases.setdefault(key, {
+                'name': ' '.join(phrase),
+                'score': sum(weights[word.lower()] for word in phrase),
+                'sentences': set()
+            })
+            entry['sentences'].add(index)
+
+        ranked = sorted(phrases.values(), key=lambda entry: entry['score'], reverse=True)
+        top = ranked[:self.max_topics + self.max_related]
+
+        topics = []
+        for position, entry in enumerate(top[:self.max_topics]):
+            # Only lower-ranked phrases, so each pair is related once
+            related = [
+                other['name'] for other in top[position + 1:]
+                if any(
+                    abs(a - b) <= self.window
+                    for a in entry['sentences'] for b in other['sentences']
+                )
+            ]
+            topics.append({
+                'topic': entry['name'],
+                'related_topics': related[:self.max_related],
+                'relationship_type': 'relates to'
+            })
+        return topics
+
+
+local_topic_extractor = LocalTopicExtractor()
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class TTSCache:
+    """Content-addressed cache for synthesised audio.
+
+    Entries are keyed by a hash of everything that affects the audio. A
+    byte-bounded in-memory LRU sits in front of an optional on-disk store that
+    every worker process on the host can share. Disk writes are atomic
+    renames, and file mtimes double as the LRU clock for disk eviction.
+    """
+
+    def __init__(self, memory_max_bytes, disk_dir=None, disk_max_bytes=0):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+        self._counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+
+    @staticmethod
+    def make_key(text, voice_name, language_code, encoding):
+        raw = json.dumps([text, voice_name, language_code, str(encoding)], ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._counters['memory_hits'] += 1
+                return audio
+
+        audio = self._read_disk(key)
+        with self._lock:
+            if audio is None:
+                self._counters['misses'] += 1
+                return None
+            self._counters['disk_hits'] += 1
+            self._remember(key, audio)
+        return audio
+
+    def set(self, key, audio):
+        with self._lock:
+            self._remember(key, audio)
+        self._write_disk(key, audio)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['memory_entries'] = len(self._memory)
+        stats['disk_bytes'] = self._disk_bytes or 0
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _remember(self, key, audio):
+        # Caller holds self._lock
+        if len(audio) > self.memory_max_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key))
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self._counters['memory_evictions'] += 1
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, key[:2], f"{key}.audio")
+
+    def _read_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                audio = f.read()
+            os.utime(path)
+            return audio
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print(f"⚠️ TTS cache read failed: {str(e)}")
+            return None
+
+    def _write_disk(self, key, audio):
+        if not self.disk_dir or len(audio) > self.disk_max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ TTS cache write failed: {str(e)}")
+            return
+
+        with self._disk_lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(audio)
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.audio'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(root, name)))
+        return entries
+
+    def _scan_disk_bytes(self):
+        return sum(size for _, size, _ in self._disk_entries())
+
+    def _evict_disk(self):
+        # Other processes write to the same directory, so re-scan rather than
+        # trusting the local estimate, then drop the least recently used files
+        # until the store is back under 90% of its budget.
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.disk_max_bytes * 0.9
+
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self._counters['disk_evictions'] += 1
+            except FileNotFoundError:
+                total -= size
+
+        self._disk_bytes = total
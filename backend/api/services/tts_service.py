@@ -1,25 +1,157 @@
+import asyncio
+import re
+from collections import deque
+
+import grpc
+from django.conf import settings
 from google.cloud import texttospeech
+from ..utils.loop_local import LoopLocal
+from ..utils.metrics import span
+from .resilience import get_upstream
+from .tts_cache import TTSCache
+
+LANGUAGE_CODE = 'en-US'
+AUDIO_ENCODING = texttospeech.AudioEncoding.MP3
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;])\s+')
+
+def split_sentences(text):
+    """Split text at sentence-ending punctuation, dropping empty pieces"""
+    return [sentence.strip() for sentence in SENTENCE_BOUNDARY.split(text) if sentence.strip()]
+
+def _build_cache():
+    if not settings.TTS_CACHE_ENABLED:
+        return None
+    return TTSCache(
+        memory_max_bytes=settings.TTS_CACHE_MEMORY_BYTES,
+        disk_dir=settings.TTS_CACHE_DIR,
+        disk_max_bytes=settings.TTS_CACHE_DISK_BYTES
+    )
 
 class TTSService:
-    def __init__(self):
-        self.client = texttospeech.TextToSpeechClient()
+    def __init__(self, client=None, async_client=None, cache=None, upstream=None):
+        self.client = client or texttospeech.TextToSpeechClient()
+        self.upstream = upstream or get_upstream('tts')
+        self.cache = cache if cache is not None else _build_cache()
+        self._async_clients = LoopLocal(texttospeech.TextToSpeechAsyncClient, async_client)
+
+    @property
+    def async_client(self):
+        return self._async_clients.get()
+
+    def warm_up(self):
+        """Open the gRPC channel so the first request skips the handshake"""
+        channel = self.client.transport.grpc_channel
+        grpc.channel_ready_future(channel).result(timeout=settings.CLIENT_WARM_UP_TIMEOUT)
+
+    def health_check(self):
+        self.warm_up()
+
+    def close(self):
+        self.client.transport.close()
+        self._async_clients.close(lambda client: client.transport.close())
 
     def synthesize_speech(self, text, voice_name='en-US-Standard-A'):
+        with span('tts') as timing:
+            audio = self._synthesize(text, voice_name)
+            timing.size = len(audio)
+        return audio
+
+    def _synthesize(self, text, voice_name):
+        cache_key = self._cache_key(text, voice_name)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        request = self._build_request(text, voice_name)
+        response = self.upstream.call(
+            lambda timeout: self.client.synthesize_speech(**request, timeout=timeout)
+        )
+        
+        if cache_key:
+            self.cache.set(cache_key, response.audio_content)
+        return response.audio_content
+
+    async def asynthesize_stream(self, text, voice_name='en-US-Standard-A', parallelism=None):
+        """Yield MP3 audio sentence by sentence, in order, as soon as each is ready.
+
+        Up to `parallelism` sentences are synthesised ahead of the one being
+        sent. MP3 frames are self-delimiting, so the chunks can be played
+        back-to-back as a single stream. This is an async generator because
+        under ASGI a sync one is read to the end before anything is sent.
+        """
+        parallelism = parallelism or settings.TTS_STREAM_PARALLELISM
+        sentences = iter(split_sentences(text))
+        pending = deque()
+
+        def start_next():
+            sentence = next(sentences, None)
+            if sentence is not None:
+                pending.append(asyncio.ensure_future(self.asynthesize_speech(sentence, voice_name)))
+            return sentence is not None
+
+        try:
+            while len(pending) < parallelism and start_next():
+                pass
+
+            while pending:
+                audio_chunk = await pending.popleft()
+                start_next()
+                yield audio_chunk
+        finally:
+            # The client may disconnect mid-stream; drop work nobody will hear
+            for task in pending:
+                task.cancel()
+
+    async def asynthesize_speech(self, text, voice_name='en-US-Standard-A'):
+        with span('tts') as timing:
+            audio = await self._asynthesize(text, voice_name)
+            timing.size = len(audio)
+        return audio
+
+    async def _asynthesize(self, text, voice_name):
+        cache_key = self._cache_key(text, voice_name)
+        if cache_key:
+            cached = await self._acache(self.cache.get, cache_key)
+            if cached is not None:
+                return cached
+
+        request = self._build_request(text, voice_name)
+        response = await self.upstream.acall(
+            lambda timeout: self.async_client.synthesize_speech(**request, timeout=timeout)
+        )
+
+        if cache_key:
+            await self._acache(self.cache.set, cache_key, response.audio_content)
+        return response.audio_content
+
+    async def _acache(self, operation, *args):
+        # The disk tier is blocking file I/O; keep it off the event loop
+        if self.cache.disk_dir:
+            return await asyncio.to_thread(operation, *args)
+        return operation(*args)
+
+    def _cache_key(self, text, voice_name):
+        if self.cache is None:
+            return None
+        return self.cache.make_key(text, voice_name, LANGUAGE_CODE, AUDIO_ENCODING)
+
+    @staticmethod
+    def _build_request(text, voice_name):
         synthesis_input = texttospeech.SynthesisInput(text=text)
         
         voice = texttospeech.VoiceSelectionParams(
-            language_code='en-US',
+            language_code=LANGUAGE_CODE,
             name=voice_name
         )
         
         audio_config = texttospeech.AudioConfig(
-            audio_encoding=texttospeech.AudioEncoding.MP3
+            audio_encoding=AUDIO_ENCODING
         )
-        
-        response = self.client.synthesize_speech(
-            input=synthesis_input,
-            voice=voice,
-            audio_config=audio_config
-        )
-        
-        return response.audio_content
\ No newline at end of file
+
+        return {
+            'input': synthesis_input,
+            'voice': voice,
+            'audio_config': audio_config
+        }
@@ -0,0 +1,55 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from ..models import Message
+from .conversation_service import ConversationService
+from .graph_jobs import enqueue_graph_job
+
+
+class VoicePipeline:
+    """Async voice turn: STT → LLM reply → TTS, with independent stages overlapped.
+
+    Saving the user's message runs alongside the LLM call, and once the reply
+    exists TTS synthesis runs alongside the transcript update. Topic
+    extraction (when the reply did not already carry topics) and graph writes
+    are handed to the background job queue.
+    """
+
+    def __init__(self, stt_service, openai_service, tts_service, conv_service=None):
+        self.stt_service = stt_service
+        self.openai_service = openai_service
+        self.tts_service = tts_service
+        self.conv_service = conv_service or ConversationService()
+
+    async def run(self, audio_file, user_id, topic_extractor=None) -> dict:
+        user_input = await self.stt_service.atranscribe(audio_file)
+        if not user_input:
+            raise ValueError('Could not transcribe audio')
+        print(f"✓ Transcription successful: '{user_input}'")
+
+        conversation, (ai_response, topics) = await asyncio.gather(
+            self.conv_service.asave_conversation(user_id, [(Message.USER, user_input)]),
+            self.openai_service.agenerate_turn(user_input, with_topics=topic_extractor is None)
+        )
+        print(f"✓ AI response generated for conversation {conversation.id}")
+
+        audio_response, graph_job = await asyncio.gather(
+            self.tts_service.asynthesize_speech(ai_response),
+            self._record_turn(conversation.id, user_input, ai_response, topics, topic_extractor)
+        )
+        print("✓ Speech synthesis completed")
+
+        return {
+            'conversation_id': conversation.id,
+            'transcript': user_input,
+            'response': ai_response,
+            'audio_response': audio_response,
+            'graph_job_id': graph_job.id
+        }
+
+    async def _record_turn(self, conversation_id, user_input, ai_response, topics, topic_extractor):
+        await self.conv_service.aupdate_conversation(conversation_id, [(Message.ASSISTANT, ai_response)])
+        return await sync_to_async(enqueue_graph_job)(
+            conversation_id, user_input, ai_response, topics, topic_extractor
+        )
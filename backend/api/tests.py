@@ -1,3 +1,1801 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .fakes import FakeNeo4jDriver, FakeOpenAIClient, FakeSpeechClient, FlakyCall, lognormal_latency, make_wav
+from .management.commands.benchmark import parse_server_timing, percentile
+from .services.client_registry import ClientRegistry
+from .services.graph_service import KnowledgeGraphService
+from .services.graph_index import TopicGraphIndex, get_graph_index, index_graph_delta
+from .services.graph_jobs import extract_topics, process_graph_job
+from .services.batch_chat import BatchChatRunner
+from .services.voice_pipeline import VoicePipeline
+from .services.search_service import SearchService, fts5_query, highlight
+from .services.admission import CRITICAL, NORMAL, REDUCED, degradation_level
+from .services.resilience import (
+    Bulkhead, CircuitBreaker, CircuitOpenError, OverloadedError, RetryPolicy, TokenBucket, Upstream
+)
+from .services.topic_extractor import LocalTopicExtractor
+from .services.topic_canonicalizer import TopicCanonicalizer, DEFAULT_ALIASES
+from .services.tts_cache import TTSCache
+from .services.tts_service import TTSService
+from .services.llm_cache import ResponseCache, TokenJaccardMatcher
+from .services.openai_service import OpenAIService, SUMMARY_FAILED
+from .services.context_builder import ContextBuilder
+from .services.conversation_service import ConversationService
+from .models import Conversation, ConversationGraph, KnowledgeGraph, Message
+from .services.stt_service import STTService
+from .middleware import AdmissionControlMiddleware, ServerTimingMiddleware
+from .utils.loop_local import LoopLocal
+from .utils.metrics import Histogram, STAGE_SECONDS, render_metrics, span
+from .utils.pagination import decode_cursor, decode_rank_cursor, encode_cursor, encode_rank_cursor
+from .utils.audio import EmptyAudioError, plan_segments, segment_upload, sniff_container
+from .views import (
+    chat_response, chat_response_stream, get_conversation_history, health, topic_components, voice_input,
+    voice_input_async
+)
+from .websocket import voice_session_application
+from .services.job_queue import DeferJob, JobQueue, MemoryJobStore, SUCCEEDED, FAILED
+
+
+TOPICS = [
+    {
+        'topic': f'Topic {i}',
+        'related_topics': [f'Topic {i}.{j}' for j in range(4)],
+        'relationship_type': 'contains'
+    }
+    for i in range(5)
+]
+
+
+class ClientRegistryTests(SimpleTestCase):
+    def test_clients_are_built_once_on_first_use_across_threads(self):
+        built = []
+
+        def factory():
+            time.sleep(0.02)
+            built.append(object())
+            return built[-1]
+
+        registry = ClientRegistry()
+        registry.register('openai', factory)
+        self.assertEqual(built, [])
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            instances = list(executor.map(lambda _: registry.get('openai'), range(8)))
+
+        self.assertEqual(len(built), 1)
+        self.assertTrue(all(instance is built[0] for instance in instances))
+        with self.assertRaises(KeyError):
+            registry.get('missing')
+
+    def test_override_warm_up_health_and_close_all(self):
+        registry = ClientRegistry()
+        healthy = mock.Mock()
+        broken = mock.Mock()
+        broken.warm_up.side_effect = broken.health_check.side_effect = ConnectionError('refused')
+        broken.close.side_effect = RuntimeError('already closed')
+        registry.register('stt', lambda: healthy)
+        registry.register('tts', lambda: broken)
+
+        replacement = mock.Mock()
+        self.assertIsNone(registry.override('stt', replacement))
+        self.assertIs(registry.override('stt', healthy), replacement)
+
+        self.assertEqual(registry.warm_up(), {'stt': 'ok', 'tts': 'error: refused'})
+        self.assertEqual(registry.health(['stt']), {'stt': 'ok'})
+        healthy.warm_up.assert_called_once_with()
+        healthy.health_check.assert_called_once_with()
+
+        registry.close_all()
+        healthy.close.assert_called_once_with()
+        broken.close.assert_called_once_with()
+        registry.get('stt')
+        self.assertEqual(healthy.close.call_count, 1)
+
+    def test_async_clients_are_closed_on_their_own_loop(self):
+        closed = []
+
+        async def closer(client):
+            closed.append((client, asyncio.get_running_loop()))
+
+        clients = LoopLocal(object)
+        idle_loop = asyncio.new_event_loop()
+        self.addCleanup(idle_loop.close)
+        idle_client = idle_loop.run_until_complete(self.get(clients))
+        gone_loop = asyncio.new_event_loop()
+        gone_loop.run_until_complete(self.get(clients))
+        gone_loop.close()
+
+        clients.close(closer)
+
+        self.assertEqual(closed, [(idle_client, idle_loop)])
+
+        service = mock.Mock()
+        service.close = lambda: clients.close(closer)
+        registry = ClientRegistry()
+        registry.override('openai', service)
+
+        async def shut_down():
+            client = clients.get()
+            await registry.aclose_all()
+            return client, asyncio.get_running_loop()
+
+        client, loop = asyncio.run(shut_down())
+        self.assertEqual(closed[1:], [(client, loop)])
+
+    @staticmethod
+    async def get(clients):
+        return clients.get()
+
+    def test_health_view_reports_clients_and_open_circuits(self):
+        registry = ClientRegistry()
+        service = mock.Mock()
+        registry.register('openai', lambda: service)
+
+        with mock.patch('api.views.registry', registry), \
+                mock.patch('api.views.upstream_stats', return_value={'openai': {'state': 'closed'}}):
+            response = health(RequestFactory().get('/api/health/'))
+            self.assertEqual((response.status_code, response.data['status']), (200, 'ok'))
+            self.assertEqual(response.data['clients'], {'openai': 'ok'})
+
+            health(RequestFactory().get('/api/health/', {'warm_up': '1'}))
+            service.warm_up.assert_called_once_with()
+
+            service.health_check.side_effect = ConnectionError('refused')
+            response = health(RequestFactory().get('/api/health/'))
+            self.assertEqual((response.status_code, response.data['status']), (503, 'degraded'))
+
+        service.health_check.side_effect = None
+        with mock.patch('api.views.registry', registry), \
+                mock.patch('api.views.upstream_stats', return_value={'openai': {'state': 'open'}}):
+            self.assertEqual(health(RequestFactory().get('/api/health/')).status_code, 503)
+
+
+class KnowledgeGraphServiceTests(SimpleTestCase):
+    def setUp(self):
+        self.driver = FakeNeo4jDriver()
+        self.service = KnowledgeGraphService(
+            driver=self.driver,
+            canonicalizer=TopicCanonicalizer(aliases=DEFAULT_ALIASES)
+        )
+
+    def test_process_topics_uses_one_round_trip(self):
+        graph_data = self.service.process_topics(TOPICS, conversation_id=1)
+
+        self.assertEqual(self.driver.round_trips, 1)
+        self.assertEqual(self.driver.sessions, 1)
+        self.assertEqual(len(graph_data['nodes']), 25)
+        self.assertEqual(len(graph_data['relationships']), 20)
+        self.assertEqual(graph_data['relationships'][0], {
+            'source': 'Topic 0',
+            'target': 'Topic 0.0',
+            'type': 'contains'
+        })
+
+    @override_settings(NEO4J_WRITE_BATCH_SIZE=8)
+    def test_large_payload_is_chunked(self):
+        self.service.process_topics(TOPICS, conversation_id=1)
+
+        self.assertEqual(self.driver.round_trips, 4)
+        written_nodes = [n for _, params in self.driver.queries for n in params['nodes']]
+        written_rels = [r for _, params in self.driver.queries for r in params['relationships']]
+        self.assertEqual(len(written_nodes), 25)
+        self.assertEqual(len(written_rels), 20)
+
+    def test_topic_variants_share_one_node(self):
+        graph_data = self.service.process_topics([
+            {'topic': 'Machine Learning', 'related_topics': ['Neural Networks', 'ML'], 'relationship_type': 'uses'},
+            {'topic': 'machine-learning', 'related_topics': ['neural network', 'Python 3', 'Python 2'], 'relationship_type': 'uses'},
+        ], conversation_id=1)
+
+        self.assertEqual(graph_data['nodes'], ['Machine Learning', 'Neural Networks', 'Python 3', 'Python 2'])
+        _, params = self.driver.queries[0]
+        self.assertEqual(params['nodes'], graph_data['nodes'])
+        self.assertEqual(len(graph_data['relationships']), 3)
+        self.assertNotIn('ML', [r['target'] for r in graph_data['relationships']])
+
+    def test_empty_topics_skip_the_driver(self):
+        graph_data = self.service.process_topics([], conversation_id=1)
+
+        self.assertEqual(graph_data, {'nodes': [], 'relationships': []})
+        self.assertEqual(self.driver.round_trips, 0)
+
+
+class TopicCanonicalizerTests(SimpleTestCase):
+    def test_resolves_case_plural_alias_and_typo_variants(self):
+        canonicalizer = TopicCanonicalizer(aliases={'NLP': 'Natural Language Processing'})
+        canonicalizer.add(['Machine Learning'])
+
+        self.assertEqual(canonicalizer.canonicalize(' machine  learnings '), 'Machine Learning')
+        self.assertEqual(canonicalizer.canonicalize('Machine Learnin'), 'Machine Learning')
+        self.assertEqual(canonicalizer.canonicalize('nlp'), 'Natural Language Processing')
+        self.assertEqual(canonicalizer.canonicalize('Categories'), 'Categories')
+        self.assertEqual(canonicalizer.canonicalize('category'), 'Categories')
+        self.assertEqual(canonicalizer.counts, {'exact': 2, 'alias': 1, 'fuzzy': 1, 'new': 1})
+
+    def test_numbers_and_distinct_words_stay_apart(self):
+        canonicalizer = TopicCanonicalizer()
+
+        self.assertEqual(canonicalizer.canonicalize('Python 2'), 'Python 2')
+        self.assertEqual(canonicalizer.canonicalize('Python 3'), 'Python 3')
+        self.assertEqual(canonicalizer.canonicalize('Java'), 'Java')
+        self.assertEqual(canonicalizer.canonicalize('JavaScript'), 'JavaScript')
+        self.assertIsNone(canonicalizer.canonicalize('  '))
+
+    def test_seed_runs_once_on_first_use(self):
+        seed = mock.Mock(return_value=['Deep Learning'])
+        canonicalizer = TopicCanonicalizer(seed=seed)
+
+        self.assertEqual(canonicalizer.canonicalize('deep learning'), 'Deep Learning')
+        self.assertEqual(canonicalizer.canonicalize('Deep-Learning'), 'Deep Learning')
+        seed.assert_called_once_with()
+
+
+class LocalTopicExtractorTests(SimpleTestCase):
+    TEXT = (
+        "How do neural networks learn from training data? "
+        "Neural networks adjust weights using gradient descent. "
+        "I also want to see Japan."
+    )
+
+    def test_emits_process_topics_structure(self):
+        topics = LocalTopicExtractor().extract_topics(self.TEXT)
+
+        self.assertEqual(topics[0]['topic'], 'neural networks')
+        self.assertIn('training data', topics[0]['related_topics'])
+        for topic in topics:
+            self.assertEqual(set(topic), {'topic', 'related_topics', 'relationship_type'})
+            self.assertNotIn(topic['topic'], topic['related_topics'])
+        graph_data = KnowledgeGraphService.build_graph_data(topics)
+        self.assertIn('Japan', graph_data['nodes'])
+        self.assertNotIn(
+            ('training data', 'Japan'),
+            [(r['source'], r['target']) for r in graph_data['relationships']]
+        )
+
+    def test_blank_text_has_no_topics(self):
+        self.assertEqual(LocalTopicExtractor().extract_topics('Okay, thanks!'), [])
+
+    @override_settings(TOPIC_EXTRACTOR='auto')
+    def test_auto_falls_back_when_llm_returns_nothing(self):
+        openai_service = mock.Mock()
+        openai_service.extract_topics.return_value = []
+        with mock.patch('api.services.graph_jobs.get_openai_service', return_value=openai_service):
+            topics = extract_topics(self.TEXT)
+            local_topics = extract_topics(self.TEXT, 'local')
+
+        openai_service.extract_topics.assert_called_once_with(self.TEXT)
+        self.assertEqual(topics[0]['topic'], 'neural networks')
+        self.assertEqual(local_topics[0]['topic'], 'neural networks')
+
+    @override_settings(TOPIC_EXTRACTOR='auto')
+    def test_extraction_errors_fail_the_graph_job(self):
+        upstream = mock.Mock()
+        upstream.call.side_effect = CircuitOpenError('openai circuit is open')
+        openai_service = OpenAIService(
+            client=object(), async_client=object(), cache=ResponseCache(100, 60), upstream=upstream
+        )
+        graph_service = mock.Mock()
+        with mock.patch('api.services.graph_jobs.get_openai_service', return_value=openai_service), \
+                mock.patch('api.services.graph_jobs.get_graph_service', return_value=graph_service), \
+                mock.patch('api.services.graph_jobs.degradation_level', return_value=NORMAL):
+            with self.assertRaises(CircuitOpenError):
+                process_graph_job(1, {'text': self.TEXT})
+
+        graph_service.process_topics.assert_not_called()
+
+
+class TopicGraphIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = TopicGraphIndex()
+        self.index.add_graph({
+            'nodes': ['AI', 'ML', 'Data', 'Cooking'],
+            'relationships': [
+                {'source': 'AI', 'target': 'ML', 'type': 'includes'},
+                {'source': 'Data', 'target': 'ML', 'type': 'feeds'},
+            ]
+        })
+
+    def test_neighbours_respect_direction(self):
+        self.assertEqual(
+            [n['topic'] for n in self.index.neighbours('ML')],
+            ['AI', 'Data']
+        )
+        self.assertEqual(self.index.neighbours('ML', direction='out'), [])
+        self.assertEqual(
+            self.index.neighbours('AI', direction='out'),
+            [{'topic': 'ML', 'types': ['includes']}]
+        )
+
+    def test_expand_and_shortest_path(self):
+        expanded = self.index.expand('AI', hops=2)
+
+        self.assertEqual(
+            [(n['topic'], n['depth']) for n in expanded['nodes']],
+            [('AI', 0), ('ML', 1), ('Data', 2)]
+        )
+        self.assertEqual(self.index.shortest_path('AI', 'Data'), ['AI', 'ML', 'Data'])
+        self.assertIsNone(self.index.shortest_path('AI', 'Cooking'))
+
+    def test_components_and_unknown_topics(self):
+        self.assertEqual(self.index.components(), [['AI', 'Data', 'ML'], ['Cooking']])
+        self.assertEqual(self.index.components(min_size=2), [['AI', 'Data', 'ML']])
+        with self.assertRaises(KeyError):
+            self.index.neighbours('Nope')
+
+
+    @override_settings(GRAPH_INDEX_REFRESH_SECONDS=60)
+    def test_stale_index_is_served_while_rebuilt_in_background(self):
+        stale, fresh = TopicGraphIndex(), TopicGraphIndex()
+        stale.built_at = time.time() - 120
+        building, release = threading.Event(), threading.Event()
+
+        def build():
+            building.set()
+            release.wait(5)
+            fresh.built_at = time.time()
+            return fresh
+
+        with mock.patch('api.services.graph_index._index', stale), \
+                mock.patch('api.services.graph_index.build_graph_index', side_effect=build) as build_index:
+            self.assertIs(get_graph_index(), stale)
+            self.assertTrue(building.wait(5))
+            self.assertIs(get_graph_index(), stale)
+            release.set()
+            deadline = time.time() + 5
+            while get_graph_index() is not fresh and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIs(get_graph_index(), fresh)
+        build_index.assert_called_once_with()
+
+    @override_settings(GRAPH_INDEX_REFRESH_SECONDS=60)
+    def test_topics_written_during_a_rebuild_survive_the_swap(self):
+        stale, fresh = TopicGraphIndex(), TopicGraphIndex()
+        stale.built_at = time.time() - 120
+        delta = {'nodes': ['Tides', 'Moon'], 'relationships': [{'source': 'Tides', 'target': 'Moon', 'type': 'CAUSED_BY'}]}
+
+        def build():
+            # The rebuild's snapshot was read before this topic was written
+            index_graph_delta(delta)
+            fresh.built_at = time.time()
+            return fresh
+
+        with mock.patch('api.services.graph_index._index', stale), \
+                mock.patch('api.services.graph_index.build_graph_index', side_effect=build):
+            get_graph_index()
+            deadline = time.time() + 5
+            while get_graph_index() is not fresh and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertIs(get_graph_index(), fresh)
+        self.assertIn('Tides', stale)
+        self.assertEqual(fresh.neighbours('Tides'), [{'topic': 'Moon', 'types': ['CAUSED_BY']}])
+
+    def test_components_reject_non_numeric_min_size(self):
+        request = RequestFactory().get('/api/topics/components/', {'min_size': 'big'})
+        self.assertEqual(topic_components(request).status_code, 400)
+
+
+class JobQueueTests(SimpleTestCase):
+    def make_queue(self, handler, max_retries=2):
+        job_queue = JobQueue(handler, MemoryJobStore(), workers=2, max_retries=max_retries, retry_backoff=0)
+        self.addCleanup(job_queue.shutdown, 5)
+        return job_queue
+
+    def test_failed_job_is_retried(self):
+        calls = []
+
+        def flaky(conversation_id, payload):
+            calls.append(payload)
+            if len(calls) < 3:
+                raise Exception('upstream unavailable')
+            return {'graph_id': 7}
+
+        job_queue = self.make_queue(flaky)
+        job = job_queue.submit(1, {'text': 'hello'})
+        job_queue.shutdown(5)
+
+        self.assertEqual(job.status, SUCCEEDED)
+        self.assertEqual(job.attempts, 3)
+        self.assertEqual(job.result, {'graph_id': 7})
+
+    def test_job_fails_after_max_retries(self):
+        def broken(conversation_id, payload):
+            raise Exception('boom')
+
+        job_queue = self.make_queue(broken, max_retries=1)
+        job = job_queue.submit(1, {'text': 'hello'})
+        job_queue.shutdown(5)
+
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(job.error, 'boom')
+
+    def test_deferred_job_runs_again_without_using_an_attempt(self):
+        calls = []
+
+        def busy_once(conversation_id, payload):
+            calls.append(payload)
+            if len(calls) == 1:
+                raise DeferJob('overloaded', delay=0)
+            return {'graph_id': 7}
+
+        job_queue = self.make_queue(busy_once, max_retries=0)
+        job = job_queue.submit(1, {'text': 'hello'})
+        job_queue.shutdown(5)
+
+        self.assertEqual((job.status, job.attempts, len(calls)), (SUCCEEDED, 1, 2))
+
+    def test_worker_survives_a_failing_job_store(self):
+        store = MemoryJobStore()
+        update = store.update
+        failures = [Exception('database is unavailable')]
+
+        def flaky_update(job, **changes):
+            if failures:
+                raise failures.pop()
+            update(job, **changes)
+        store.update = flaky_update
+        job_queue = JobQueue(lambda conversation_id, payload: {'graph_id': 7}, store, workers=1, retry_backoff=0)
+        self.addCleanup(job_queue.shutdown, 5)
+
+        job_queue.submit(1, {'text': 'lost'})
+        job = job_queue.submit(1, {'text': 'hello'})
+        job_queue.shutdown(5)
+
+        self.assertEqual(job.status, SUCCEEDED)
+
+    def test_jobs_for_a_conversation_run_in_order(self):
+        seen = []
+        job_queue = self.make_queue(lambda conversation_id, payload: seen.append((conversation_id, payload['n'])))
+
+        for n in range(20):
+            job_queue.submit(n % 3, {'n': n})
+        job_queue.shutdown(5)
+
+        for conversation_id in range(3):
+            order = [n for cid, n in seen if cid == conversation_id]
+            self.assertEqual(order, sorted(order))
+        self.assertEqual([job.status for job in job_queue.status(0)], [SUCCEEDED] * 7)
+
+
+class TTSCacheTests(SimpleTestCase):
+    def key(self, text):
+        return TTSCache.make_key(text, 'en-US-Standard-A', 'en-US', 'MP3')
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        cache = TTSCache(memory_max_bytes=100)
+        cache.set(self.key('a'), b'x' * 40)
+        cache.set(self.key('b'), b'x' * 40)
+        cache.get(self.key('a'))
+        cache.set(self.key('c'), b'x' * 40)
+
+        self.assertIsNone(cache.get(self.key('b')))
+        self.assertIsNotNone(cache.get(self.key('a')))
+        self.assertEqual(cache.stats()['memory_evictions'], 1)
+
+    def test_disk_tier_is_shared_between_instances(self):
+        disk_dir = tempfile.mkdtemp()
+        writer = TTSCache(memory_max_bytes=100, disk_dir=disk_dir, disk_max_bytes=1000)
+        reader = TTSCache(memory_max_bytes=100, disk_dir=disk_dir, disk_max_bytes=1000)
+        writer.set(self.key('hello'), b'audio')
+
+        self.assertEqual(reader.get(self.key('hello')), b'audio')
+        self.assertEqual(reader.get(self.key('hello')), b'audio')
+        stats = reader.stats()
+        self.assertEqual((stats['disk_hits'], stats['memory_hits'], stats['misses']), (1, 1, 0))
+
+
+class ResponseCacheTests(SimpleTestCase):
+    PARAMS = {'model': 'gpt-3.5-turbo', 'temperature': 0.7}
+
+    def setUp(self):
+        self.now = 0
+        self.cache = ResponseCache(
+            max_entries=2,
+            ttl=60,
+            matcher=TokenJaccardMatcher(threshold=0.8),
+            clock=lambda: self.now
+        )
+
+    def test_normalised_inputs_share_an_entry(self):
+        self.cache.set('reply', 'What is Django?', self.PARAMS, 'A web framework.')
+
+        self.assertEqual(self.cache.get('reply', '  what is   django ', self.PARAMS), 'A web framework.')
+        self.assertIsNone(self.cache.get('reply', 'What is Django?', {'model': 'gpt-4o'}))
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    def test_entries_expire_and_are_evicted(self):
+        self.cache.set('reply', 'one', self.PARAMS, '1')
+        self.now = 61
+        self.assertIsNone(self.cache.get('reply', 'one', self.PARAMS))
+
+        for text in ('two', 'three', 'four'):
+            self.cache.set('reply', text, self.PARAMS, text)
+        self.assertIsNone(self.cache.get('reply', 'two', self.PARAMS))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_near_duplicates_hit_the_cache(self):
+        self.cache.set('reply', 'how do i reset my account password', self.PARAMS, 'Use the reset link.')
+
+        self.assertEqual(
+            self.cache.get('reply', 'How do I reset my account password, please?', self.PARAMS),
+            'Use the reset link.'
+        )
+        self.assertIsNone(self.cache.get('reply', 'how do i delete my account', self.PARAMS))
+        self.assertEqual(self.cache.stats()['near_hits'], 1)
+
+
+TURN = {
+    'reply': 'Neural networks learn from data.',
+    'topics': [{'topic': 'Neural Networks', 'related_topics': ['Data'], 'relationship_type': 'uses'}]
+}
+
+
+class CombinedTurnTests(SimpleTestCase):
+    def service(self, contents):
+        self.client = FakeOpenAIClient(contents)
+        return OpenAIService(client=self.client, async_client=object(), cache=ResponseCache(100, 60))
+
+    def test_reply_and_topics_come_from_one_call(self):
+        service = self.service([json.dumps(TURN)])
+
+        self.assertEqual(service.generate_turn('Tell me about neural nets'), (TURN['reply'], TURN['topics']))
+        self.assertEqual(service.generate_turn('Tell me about neural nets'), (TURN['reply'], TURN['topics']))
+        self.assertEqual(len(self.client.requests), 1)
+        self.assertEqual(self.client.requests[0]['response_format']['type'], 'json_schema')
+
+    def test_malformed_output_falls_back_to_plain_reply(self):
+        service = self.service([
+            json.dumps({'reply': 'Hi', 'topics': [{'topic': 'Greeting'}]}),
+            'Hello there!'
+        ])
+
+        self.assertEqual(service.generate_turn('Hi'), ('Hello there!', None))
+        self.assertEqual(len(self.client.requests), 2)
+        self.assertNotIn('response_format', self.client.requests[1])
+
+    @override_settings(OPENAI_COMBINED_TURN=True)
+    def test_requested_topic_extractor_is_used_instead_of_combined_topics(self):
+        service = self.service(['Hello there!'])
+        request = RequestFactory().post(
+            '/api/chat-response/',
+            {'conversation_id': 1, 'message': 'Tell me about neural networks', 'topic_extractor': 'local'},
+            content_type='application/json'
+        )
+
+        with mock.patch('api.views.get_openai_service', return_value=service), \
+                mock.patch('api.views.ContextBuilder') as builder, \
+                mock.patch.object(ConversationService, 'update_conversation'), \
+                mock.patch('api.views.enqueue_graph_job', return_value=SimpleNamespace(id='job-1')) as enqueue:
+            builder.return_value.build.return_value = []
+            response = chat_response(request)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('response_format', self.client.requests[0])
+        enqueue.assert_called_once_with(1, 'Tell me about neural networks', 'Hello there!', None, 'local')
+
+        _, _, _, topics, extractor = enqueue.call_args.args
+        with mock.patch('api.services.graph_jobs.get_openai_service') as get_openai_service, \
+                mock.patch('api.services.graph_jobs.local_topic_extractor', LocalTopicExtractor()):
+            self.assertEqual(extract_topics('Tell me about neural networks', extractor)[0]['topic'], 'neural networks')
+        get_openai_service.assert_not_called()
+
+    def test_form_encoded_use_cache_false_skips_the_cache(self):
+        service = mock.Mock()
+        service.generate_turn.return_value = ('Hello there!', None)
+
+        with mock.patch('api.views.get_openai_service', return_value=service), \
+                mock.patch('api.views.ContextBuilder') as builder, \
+                mock.patch.object(ConversationService, 'update_conversation'), \
+                mock.patch('api.views.enqueue_graph_job', return_value=SimpleNamespace(id='job-1')):
+            builder.return_value.build.return_value = []
+            for sent, expected in (('false', False), ('0', False), ('true', True), (None, True)):
+                data = {'conversation_id': 1, 'message': 'hi'}
+                if sent is not None:
+                    data['use_cache'] = sent
+                self.assertEqual(chat_response(RequestFactory().post('/api/chat-response/', data)).status_code, 200)
+                self.assertIs(service.generate_turn.call_args.kwargs['use_cache'], expected)
+
+    @override_settings(OPENAI_COMBINED_TURN=False)
+    def test_disabled_uses_reply_call_only(self):
+        service = self.service(['Hello there!'])
+
+        self.assertEqual(service.generate_turn('Hi'), ('Hello there!', None))
+        self.assertEqual(len(self.client.requests), 1)
+
+
+class AudioPreprocessingTests(SimpleTestCase):
+    def upload(self, content, name='clip.wav'):
+        return SimpleUploadedFile(name, content, content_type='audio/webm')
+
+    def test_trims_downmixes_and_resamples_wav(self):
+        content = make_wav([(1.0, 0), (0.5, 0.3), (1.0, 0)])
+
+        with segment_upload(self.upload(content)) as loaders:
+            self.assertEqual(len(loaders), 1)
+            prepared = loaders[0]()
+
+        self.assertEqual((prepared.encoding, prepared.sample_rate, prepared.container), ('LINEAR16', 16000, 'wav'))
+        self.assertAlmostEqual(prepared.duration, 0.9, delta=0.1)
+        self.assertEqual(len(prepared.content), int(round(prepared.duration * 16000)) * 2)
+        self.assertLess(len(prepared.content), len(content) / 10)
+
+    def test_silent_clip_is_rejected(self):
+        with self.assertRaises(EmptyAudioError):
+            with segment_upload(self.upload(make_wav([(2.0, 0)]))):
+                pass
+
+    def test_container_is_sniffed_from_magic_bytes(self):
+        self.assertEqual(sniff_container(b'\x1a\x45\xdf\xa3\x9f\x42\x86\x81'), 'webm')
+        self.assertEqual(sniff_container(b'OggS\x00\x02'), 'ogg')
+        self.assertEqual(sniff_container(b'ID3\x04\x00'), 'mp3')
+        self.assertIsNone(sniff_container(b'<html>'))
+
+    def test_segments_split_at_silences_within_length_limit(self):
+        levels = np.full(1000, -80.0)
+        levels[100:200] = levels[230:300] = levels[600:950] = -10.0
+
+        segments = plan_segments(levels, frame_ms=10, padding_ms=50, min_silence_ms=200, max_segment_ms=2500)
+
+        self.assertEqual(segments[0], (95, 305))
+        self.assertEqual(segments[1][0], 595)
+        self.assertEqual(segments[-1][1], 955)
+        self.assertEqual(len(segments), 3)
+        self.assertTrue(all(end - start <= 250 for start, end in segments))
+        self.assertTrue(all(a[1] <= b[0] for a, b in zip(segments, segments[1:])))
+
+    def test_stt_config_matches_prepared_audio(self):
+        client = FakeSpeechClient()
+        service = STTService(client=client, async_client=object())
+
+        service.transcribe(self.upload(make_wav([(0.5, 0), (0.5, 0.3)])))
+
+        config, _ = client.requests[0]
+        self.assertEqual(config.encoding, config.AudioEncoding.LINEAR16)
+        self.assertEqual(config.sample_rate_hertz, 16000)
+
+    @override_settings(STT_SEGMENT_MIN_SILENCE_MS=500, STT_SEGMENT_MAX_SECONDS=2)
+    def test_long_clip_segments_are_transcribed_concurrently_in_order(self):
+        active, peak = [0], [0]
+        lock = threading.Lock()
+
+        def recognize(config, audio, **kwargs):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.05)
+            with lock:
+                active[0] -= 1
+            seconds = len(audio.content) / 2 / config.sample_rate_hertz
+            return SimpleNamespace(results=[SimpleNamespace(
+                alternatives=[SimpleNamespace(transcript=f"{seconds:.1f}s", confidence=0.9)]
+            )])
+
+        client = mock.Mock(recognize=recognize)
+        service = STTService(client=client, async_client=object())
+        content = make_wav([(0.5, 0), (0.4, 0.3), (1.0, 0), (0.8, 0.3), (1.0, 0), (1.2, 0.3), (0.5, 0)])
+
+        transcript = service.transcribe(self.upload(content))
+
+        self.assertEqual(transcript, '0.8s 1.2s 1.6s')
+        self.assertGreater(peak[0], 1)
+
+    def test_unsupported_wav_is_a_client_error(self):
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(3)
+            wav.setframerate(16000)
+            wav.writeframes(b'\x00\x10\x00' * 16000)
+        request = RequestFactory().post('/api/voice-input/', {'audio': self.upload(buffer.getvalue())})
+
+        with mock.patch('api.views.get_stt_service', return_value=STTService(client=FakeSpeechClient(), async_client=object())), \
+                mock.patch('api.views.get_openai_service'), \
+                mock.patch('api.views.get_tts_service'):
+            response = voice_input(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('24 bits', response.data['error'])
+
+    @override_settings(AUDIO_UPLOAD_MAX_BYTES=1000)
+    def test_oversized_upload_is_refused(self):
+        request = RequestFactory().post('/api/voice-input/', {
+            'audio': self.upload(make_wav([(1.0, 0.3)]))
+        })
+
+        response = voice_input(request)
+
+        self.assertEqual(response.status_code, 413)
+
+
+class BatchChatRunnerTests(SimpleTestCase):
+    @staticmethod
+    async def collect(results):
+        return [result async for result in results]
+
+    @contextmanager
+    def patches(self, existing):
+        conversations = mock.Mock()
+        conversations.objects.filter.return_value.values_list.return_value = existing
+        with mock.patch('api.services.batch_chat.Conversation', conversations), \
+                mock.patch('api.services.batch_chat.ContextBuilder', lambda service: SimpleNamespace(
+                    build=lambda conversation_id: [], recent=lambda messages: messages
+                )), \
+                mock.patch('api.services.batch_chat.enqueue_graph_job'):
+            yield conversations
+
+    def test_fans_out_per_conversation_and_isolates_failures(self):
+        def generate_turn(message, use_cache=True, context=None, with_topics=True):
+            if message == 'boom':
+                raise Exception('upstream failed')
+            return f"{message}:{len(context)}", []
+
+        conv_service = mock.Mock()
+        runner = BatchChatRunner(mock.Mock(generate_turn=generate_turn), concurrency=2, conv_service=conv_service)
+        with self.patches([1, 2]) as conversations:
+            results = asyncio.run(self.collect(runner.run([
+                {'conversation_id': 1, 'message': 'a'},
+                {'conversation_id': 2, 'message': 'boom'},
+                {'conversation_id': '1', 'message': 'b'},
+                {'conversation_id': 3, 'message': 'c'},
+                {'conversation_id': 'abc', 'message': 'd'},
+                {'conversation_id': [1], 'message': 'e'},
+            ])))
+
+        by_index = {r['index']: r for r in results if 'index' in r}
+        self.assertEqual(by_index[0]['response'], 'a:0')
+        self.assertEqual(by_index[2]['response'], 'b:2')
+        self.assertEqual(by_index[1]['error'], 'upstream failed')
+        self.assertEqual(by_index[3]['error'], 'Conversation not found')
+        self.assertEqual(by_index[4]['error'], 'Invalid conversation_id')
+        self.assertEqual(by_index[5]['error'], 'Invalid conversation_id')
+        self.assertEqual(results[-1], {'done': True, 'succeeded': 2, 'failed': 4, 'error': None})
+        conversations.objects.filter.assert_called_once_with(id__in={1, 2, 3})
+        conv_service.append_turns.assert_called_once_with({
+            1: [('user', 'a'), ('assistant', 'a:0'), ('user', 'b'), ('assistant', 'b:2')]
+        })
+
+    def test_group_error_outside_an_item_fails_its_remaining_items(self):
+        conv_service = mock.Mock()
+        openai_service = mock.Mock(generate_turn=lambda message, **kwargs: (message.upper(), None))
+        runner = BatchChatRunner(openai_service, concurrency=1, conv_service=conv_service)
+
+        def recent(messages):
+            if messages:
+                raise RuntimeError('context too large')
+            return messages
+
+        with self.patches([1]), \
+                mock.patch('api.services.batch_chat.ContextBuilder', lambda service: SimpleNamespace(
+                    build=lambda conversation_id: [], recent=recent
+                )):
+            results = asyncio.run(asyncio.wait_for(
+                self.collect(runner.run([{'conversation_id': 1, 'message': m} for m in 'abc'])), 5
+            ))
+
+        self.assertEqual([(r['index'], r['response'], r['error']) for r in results[:-1]], [
+            (0, 'A', None), (1, None, 'context too large'), (2, None, 'context too large')
+        ])
+        self.assertEqual(results[-1], {'done': True, 'succeeded': 1, 'failed': 2, 'error': None})
+        conv_service.append_turns.assert_called_once_with({1: [('user', 'a'), ('assistant', 'A')]})
+
+    def test_disconnect_stops_the_batch_and_keeps_finished_replies(self):
+        b_started, proceed, persisted = threading.Event(), threading.Event(), threading.Event()
+        calls = []
+
+        def generate_turn(message, use_cache=True, context=None, with_topics=True):
+            calls.append(message)
+            if message == 'b':
+                b_started.set()
+                proceed.wait(5)
+            return message.upper(), None
+
+        conv_service = mock.Mock()
+        runner = BatchChatRunner(mock.Mock(generate_turn=generate_turn), concurrency=1, conv_service=conv_service)
+
+        async def read_one_then_disconnect(results):
+            first = await results.__anext__()
+            await asyncio.to_thread(b_started.wait, 5)
+            await results.aclose()
+            return first
+
+        with self.patches([1]), \
+                mock.patch('api.services.batch_chat.enqueue_graph_job', side_effect=lambda *args: persisted.set()):
+            results = runner.run([{'conversation_id': 1, 'message': m} for m in 'abcd'])
+            first = asyncio.run(read_one_then_disconnect(results))
+            # 'b' was in flight when the client left; it finishes, and nothing after it starts
+            proceed.set()
+            self.assertTrue(persisted.wait(5))
+
+        self.assertEqual(first['response'], 'A')
+        self.assertEqual(calls, ['a', 'b'])
+        conv_service.append_turns.assert_called_once_with({
+            1: [('user', 'a'), ('assistant', 'A'), ('user', 'b'), ('assistant', 'B')]
+        })
+
+
+class ConversationStorageTests(TestCase):
+    """Database-backed; run with DB_ENGINE=sqlite3 when PostgreSQL is not available"""
+
+    def sequences(self, conversation):
+        return list(conversation.messages.order_by('sequence').values_list('sequence', 'role', 'content'))
+
+    def test_append_turns_numbers_each_conversation_on_from_its_last_message(self):
+        first = ConversationService.save_conversation(1, [(Message.USER, 'hi'), (Message.ASSISTANT, 'hello')])
+        second = Conversation.objects.create(user_id=1)
+
+        updated = ConversationService.append_turns({
+            first.id: [(Message.USER, 'again'), (Message.ASSISTANT, 'welcome back')],
+            second.id: [(Message.USER, 'new')],
+            999: [(Message.USER, 'gone')],
+        })
+
+        self.assertEqual(sorted(updated), sorted([first.id, second.id]))
+        self.assertEqual(self.sequences(first), [
+            (1, 'user', 'hi'), (2, 'assistant', 'hello'), (3, 'user', 'again'), (4, 'assistant', 'welcome back')
+        ])
+        self.assertEqual(self.sequences(second), [(1, 'user', 'new')])
+        self.assertFalse(Message.objects.filter(conversation_id=999).exists())
+
+    def test_update_conversation_continues_the_sequence(self):
+        conversation = ConversationService.save_conversation(1, [(Message.USER, 'hi'), (Message.ASSISTANT, 'hello')])
+        ConversationService.update_conversation(conversation.id, [(Message.USER, 'again')])
+        ConversationService.update_conversation(conversation.id, [(Message.ASSISTANT, 'welcome back')])
+
+        self.assertEqual([sequence for sequence, _, _ in self.sequences(conversation)], [1, 2, 3, 4])
+        with self.assertRaisesMessage(Exception, 'Conversation 999 not found'):
+            ConversationService.update_conversation(999, [(Message.USER, 'gone')])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Message.objects.create(conversation=conversation, role=Message.USER, content='dup', sequence=4)
+
+    def test_transcript_backfill_parser(self):
+        migration = importlib.import_module('api.migrations.0003_message')
+
+        self.assertEqual(migration.parse_transcript(
+            "Before any prefix\nUser: What is AI?\nAI: Artificial intelligence.\n\nIt learns from data.\n"
+            "User:no space\nAI:"
+        ), [
+            ['user', 'Before any prefix'],
+            ['user', 'What is AI?'],
+            ['assistant', 'Artificial intelligence.\nIt learns from data.'],
+            ['user', 'no space'],
+            ['assistant', ''],
+        ])
+        self.assertEqual(migration.parse_transcript(''), [])
+
+    def test_history_pages_walk_every_conversation_once_including_timestamp_ties(self):
+        ids = [ConversationService.save_conversation(1, [(Message.USER, f'turn {i}')]).id for i in range(5)]
+        ConversationService.save_conversation(2, [(Message.USER, 'someone else')])
+        now = timezone.now()
+        Conversation.objects.filter(id=ids[0]).update(created_at=now - timedelta(seconds=10))
+        Conversation.objects.filter(id__in=ids[1:4]).update(created_at=now)
+        Conversation.objects.filter(id=ids[4]).update(created_at=now + timedelta(seconds=10))
+
+        seen, cursor = [], None
+        while True:
+            page, cursor = ConversationService.get_conversation_history(1, cursor=cursor, limit=2)
+            seen.extend(conversation.id for conversation in page)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [ids[4], ids[3], ids[2], ids[1], ids[0]])
+
+    def test_history_limit_below_one_returns_one_conversation(self):
+        ConversationService.save_conversation(1, [(Message.USER, 'a')])
+        ConversationService.save_conversation(1, [(Message.USER, 'b')])
+
+        for limit in ('0', '-3'):
+            request = RequestFactory().get('/api/conversations/1/history/', {'limit': limit})
+            response = get_conversation_history(request, user_id=1)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['conversations']), 1)
+            self.assertIsNotNone(response.data['next_cursor'])
+
+        request = RequestFactory().get('/api/conversations/1/history/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(get_conversation_history(request, user_id=1).status_code, 400)
+
+
+class KnowledgeGraphStorageTests(TestCase):
+    def setUp(self):
+        self.conversation = Conversation.objects.create(user_id=1)
+
+    @staticmethod
+    def graph(nodes, edges):
+        return {
+            'nodes': nodes,
+            'relationships': [{'source': source, 'target': target, 'type': 'uses'} for source, target in edges]
+        }
+
+    def test_only_new_nodes_and_relationships_are_stored_with_increasing_versions(self):
+        first = ConversationService.save_knowledge_graph(self.conversation.id, self.graph(['AI', 'ML'], [('AI', 'ML')]))
+        second = ConversationService.save_knowledge_graph(
+            self.conversation.id, self.graph(['ML', 'Data', 'Data'], [('AI', 'ML'), ('Data', 'ML'), ('Data', 'ML')])
+        )
+        repeat = ConversationService.save_knowledge_graph(self.conversation.id, self.graph(['AI'], [('AI', 'ML')]))
+
+        self.assertEqual((first.version, second.version), (1, 2))
+        self.assertEqual(second.graph_data, self.graph(['Data'], [('Data', 'ML')]))
+        self.assertIsNone(repeat)
+        self.assertEqual(ConversationService.get_graph(self.conversation.id), {
+            'version': 2, **self.graph(['AI', 'ML', 'Data'], [('AI', 'ML'), ('Data', 'ML')])
+        })
+
+    def test_changes_since_a_version_replay_later_deltas(self):
+        for nodes in (['AI'], ['ML'], ['Data']):
+            ConversationService.save_knowledge_graph(self.conversation.id, self.graph(nodes, []))
+
+        self.assertEqual(
+            ConversationService.get_graph(self.conversation.id, since=1),
+            {'version': 3, 'since': 1, **self.graph(['ML', 'Data'], [])}
+        )
+        self.assertEqual(ConversationService.get_graph(self.conversation.id, since=3)['nodes'], [])
+        self.assertEqual(ConversationService.get_graph(999), {'version': 0, 'nodes': [], 'relationships': []})
+
+    def test_migration_rewrites_snapshots_as_deltas(self):
+        migration = importlib.import_module('api.migrations.0005_graph_deltas')
+        snapshots = [
+            self.graph(['AI', 'ML'], [('AI', 'ML')]),
+            self.graph(['AI', 'ML', 'Data'], [('AI', 'ML'), ('Data', 'ML')]),
+            self.graph(['AI'], []),
+        ]
+        ids = [
+            KnowledgeGraph.objects.create(conversation=self.conversation, graph_data=data).id
+            for data in snapshots
+        ]
+
+        migration.convert_snapshots_to_deltas(django_apps, None)
+
+        deltas = [KnowledgeGraph.objects.get(id=i) for i in ids]
+        self.assertEqual([delta.version for delta in deltas], [1, 2, 3])
+        self.assertEqual([delta.graph_data for delta in deltas], [
+            snapshots[0], self.graph(['Data'], [('Data', 'ML')]), self.graph([], [])
+        ])
+        graph = ConversationGraph.objects.get(conversation=self.conversation)
+        self.assertEqual((graph.version, graph.nodes), (3, ['AI', 'ML', 'Data']))
+        self.assertEqual(len(graph.relationships), 2)
+
+
+class ContextBuilderTests(TestCase):
+    """Every message is 13 tokens; the budget holds three and a batch two"""
+
+    def setUp(self):
+        self.openai_service = mock.Mock()
+        self.openai_service.summarize_conversation.return_value = 'the story so far'
+        self.builder = ContextBuilder(self.openai_service, token_budget=40, summary_batch_tokens=26)
+        self.conversation = Conversation.objects.create(user_id=1)
+        patcher = mock.patch('api.services.context_builder.degradation_level', return_value=NORMAL)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add_messages(self, count):
+        start = self.conversation.messages.count() + 1
+        ConversationService.append_turns({
+            self.conversation.id: [(Message.USER, f'message {n:02d}'.ljust(36, '.')) for n in range(start, start + count)]
+        })
+
+    @staticmethod
+    def numbers(context):
+        return [int(message['content'][8:10]) for message in context if message['role'] != 'system']
+
+    def test_newest_messages_fit_the_budget_and_small_overflow_is_sent_verbatim(self):
+        self.add_messages(4)
+
+        context = self.builder.build(self.conversation.id)
+
+        self.assertEqual(self.numbers(context), [1, 2, 3, 4])
+        self.openai_service.summarize_conversation.assert_not_called()
+
+    def test_recent_keeps_the_newest_chat_messages_within_the_budget(self):
+        messages = [{'role': 'user', 'content': f'message {n:02d}'.ljust(36, '.')} for n in range(1, 6)]
+
+        self.assertEqual(self.numbers(self.builder.recent(messages)), [3, 4, 5])
+        self.assertEqual(self.builder.recent([]), [])
+
+    def test_overflow_is_summarised_once_it_reaches_a_batch(self):
+        self.add_messages(5)
+
+        context = self.builder.build(self.conversation.id)
+
+        self.assertEqual(context[0], {
+            'role': 'system', 'content': 'Summary of the earlier conversation: the story so far'
+        })
+        self.assertEqual(self.numbers(context), [3, 4, 5])
+        transcript = self.openai_service.summarize_conversation.call_args.args[0]
+        self.assertIn('message 02', transcript)
+        self.assertNotIn('message 03', transcript)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary_upto_sequence, 2)
+
+        self.add_messages(1)
+        self.openai_service.summarize_conversation.return_value = 'the longer story'
+        context = self.builder.build(self.conversation.id)
+
+        self.assertEqual(self.numbers(context), [3, 4, 5, 6])
+        self.assertEqual(self.openai_service.summarize_conversation.call_count, 1)
+
+    def test_summary_already_extended_by_a_concurrent_turn_is_kept(self):
+        self.add_messages(5)
+
+        def concurrent_summary(transcript):
+            Conversation.objects.filter(id=self.conversation.id).update(summary='newer', summary_upto_sequence=4)
+            return 'older'
+        self.openai_service.summarize_conversation.side_effect = concurrent_summary
+
+        self.builder.build(self.conversation.id)
+
+        self.conversation.refresh_from_db()
+        self.assertEqual((self.conversation.summary, self.conversation.summary_upto_sequence), ('newer', 4))
+
+    def test_overflow_is_capped_when_the_summary_cannot_be_extended(self):
+        self.add_messages(12)
+        self.openai_service.summarize_conversation.return_value = SUMMARY_FAILED
+
+        context = self.builder.build(self.conversation.id)
+
+        self.assertEqual(self.numbers(context), [8, 9, 10, 11, 12])
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.summary_upto_sequence, 0)
+
+        with mock.patch('api.services.context_builder.degradation_level', return_value=REDUCED):
+            self.assertEqual(self.numbers(self.builder.build(self.conversation.id)), [8, 9, 10, 11, 12])
+        self.assertEqual(self.openai_service.summarize_conversation.call_count, 1)
+
+
+class ResilienceTests(SimpleTestCase):
+    def make_upstream(self, retries=2, **kwargs):
+        return Upstream('test', timeout=1, retry=RetryPolicy(retries=retries, base_delay=0), **kwargs)
+
+    def test_retries_transient_errors_only(self):
+        upstream = self.make_upstream()
+        call = FlakyCall([ConnectionError('reset'), 0])
+        self.assertEqual(upstream.call(call), 'ok')
+        self.assertEqual(call.calls, 2)
+
+        refused = FlakyCall([ValueError('bad request')])
+        with self.assertRaises(ValueError):
+            upstream.call(refused)
+        self.assertEqual(refused.calls, 1)
+
+        flaky = FlakyCall([ConnectionError('reset'), 0])
+        with self.assertRaises(ConnectionError):
+            upstream.call(flaky, idempotent=False)
+        self.assertEqual(flaky.calls, 1)
+
+    def test_circuit_opens_fails_fast_and_recovers(self):
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=10, clock=lambda: now[0])
+        upstream = self.make_upstream(retries=0, breaker=breaker)
+        failing = FlakyCall([TimeoutError()])
+
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                upstream.call(failing)
+        with self.assertRaises(CircuitOpenError):
+            upstream.call(failing)
+        self.assertEqual(failing.calls, 2)
+
+        now[0] = 10
+        self.assertEqual(upstream.call(FlakyCall([0])), 'ok')
+        self.assertEqual(breaker.stats(), {'state': 'closed', 'failures': 0, 'rejected': 1})
+
+    def test_cancelled_half_open_trial_lets_the_next_call_through(self):
+        now = [0.0]
+        breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        upstream = self.make_upstream(retries=0, breaker=breaker)
+        breaker.record_failure()
+        now[0] = 10
+
+        async def cancel_trial():
+            trial = asyncio.ensure_future(upstream.acall(FlakyCall([5]).acall))
+            await asyncio.sleep(0.01)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+            return await upstream.acall(FlakyCall([0]).acall)
+
+        self.assertEqual(asyncio.run(cancel_trial()), 'ok')
+        self.assertEqual(breaker.stats()['state'], 'closed')
+
+    def test_hedged_request_returns_the_faster_attempt(self):
+        upstream = self.make_upstream(hedge_after=0.05)
+        call = FlakyCall([1.0, 0], result='fast')
+        started = time.monotonic()
+        self.assertEqual(upstream.call(call, hedge=True), 'fast')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual((call.calls, upstream.hedges), (2, 1))
+
+        call = FlakyCall([1.0, 0], result='fast')
+        self.assertEqual(asyncio.run(upstream.acall(call.acall, hedge=True)), 'fast')
+        self.assertEqual(upstream.hedges, 2)
+
+    def test_hedge_takes_its_own_slot_and_budget(self):
+        bulkhead = Bulkhead('test', limit=2)
+        upstream = self.make_upstream(hedge_after=0.05, bulkhead=bulkhead)
+        admitted, in_flight = [], []
+        call = FlakyCall([0.3, 0], result='fast')
+
+        def attempt(timeout):
+            in_flight.append(bulkhead.stats()['in_flight'])
+            return call(timeout)
+
+        self.assertEqual(upstream.call(attempt, hedge=True, admit=admitted.append), 'fast')
+        self.assertEqual((admitted, in_flight), ([False, True], [1, 2]))
+
+        async def admit(hedge):
+            admitted.append(hedge)
+        call = FlakyCall([0.3, 0], result='fast')
+        self.assertEqual(asyncio.run(upstream.acall(call.acall, hedge=True, admit=admit)), 'fast')
+        self.assertEqual(admitted[2:], [False, True])
+
+        def refuse_hedges(hedge):
+            if hedge:
+                raise OverloadedError('token budget is reserved for replies')
+        call = FlakyCall([0.1, 0], result='slow')
+        self.assertEqual(upstream.call(call, hedge=True, admit=refuse_hedges), 'slow')
+
+        bulkhead.acquire()
+        call = FlakyCall([0.1, 0], result='slow')
+        self.assertEqual(upstream.call(call, hedge=True), 'slow')
+        self.assertEqual((call.calls, upstream.hedges), (1, 2))
+        bulkhead.release()
+        time.sleep(0.3)
+        self.assertEqual(bulkhead.stats()['in_flight'], 0)
+
+    def test_open_circuit_is_refused_with_retry_after(self):
+        now = [0.0]
+        breaker = CircuitBreaker('openai', failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        now[0] = 4
+        service = mock.Mock()
+        service.generate_turn.side_effect = lambda *args, **kwargs: breaker.allow()
+        request = RequestFactory().post(
+            '/api/chat-response/', {'conversation_id': 1, 'message': 'hi'}, content_type='application/json'
+        )
+
+        with mock.patch('api.views.get_openai_service', return_value=service), \
+                mock.patch('api.views.ContextBuilder') as builder:
+            builder.return_value.build.return_value = []
+            response = chat_response(request)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '6')
+
+
+class AdmissionControlTests(SimpleTestCase):
+    def test_bulkhead_queues_briefly_then_refuses(self):
+        bulkhead = Bulkhead('test', limit=1, max_waiting=1, wait_timeout=0.05)
+        bulkhead.acquire()
+        with self.assertRaises(OverloadedError):
+            bulkhead.acquire()
+
+        async def wait_for_release():
+            asyncio.get_running_loop().call_later(0.01, bulkhead.release)
+            await bulkhead.aacquire()
+        asyncio.run(wait_for_release())
+
+        bulkhead.max_waiting = 0
+        with self.assertRaises(OverloadedError):
+            bulkhead.acquire()
+        self.assertEqual(bulkhead.stats(), {'limit': 1, 'in_flight': 1, 'waiting': 0, 'rejected': 2})
+
+    def test_cancelled_waiter_gives_up_its_place_in_the_queue(self):
+        bulkhead = Bulkhead('test', limit=1, max_waiting=1, wait_timeout=5)
+        bulkhead.acquire()
+
+        async def cancel_waiter():
+            waiter = asyncio.ensure_future(bulkhead.aacquire())
+            await asyncio.sleep(0.01)
+            self.assertEqual(bulkhead.stats()['waiting'], 1)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+        asyncio.run(cancel_waiter())
+
+        self.assertEqual(bulkhead.stats()['waiting'], 0)
+        self.assertEqual(bulkhead.load(), 1.0)
+        bulkhead.release()
+        bulkhead.acquire()
+
+    def test_token_bucket_keeps_reserve_for_critical_calls(self):
+        now = [0.0]
+        bucket = TokenBucket(rate=10, capacity=100, clock=lambda: now[0])
+        self.assertFalse(bucket.try_acquire(90, reserve=20))
+        self.assertTrue(bucket.try_acquire(70, reserve=20))
+        with self.assertRaises(OverloadedError) as refused:
+            bucket.acquire(50, timeout=0)
+        self.assertAlmostEqual(refused.exception.retry_after, 2.0)
+
+        now[0] = 2
+        bucket.acquire(50, timeout=0)
+        self.assertEqual(bucket.available(), 0)
+
+    def test_saturation_refuses_turns_and_defers_graph_jobs(self):
+        admission = Bulkhead('requests', limit=1, max_waiting=0)
+        with mock.patch('api.services.admission._admission', admission):
+            self.assertEqual(degradation_level(), NORMAL)
+            admission.acquire()
+            # Every slot busy is only REDUCED; graph jobs stop once requests queue
+            self.assertEqual(degradation_level(), REDUCED)
+
+            middleware = AdmissionControlMiddleware(lambda request: JsonResponse({}))
+            response = middleware(RequestFactory().post('/api/chat-response/'))
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+            self.assertEqual(middleware(RequestFactory().get('/api/health/')).status_code, 200)
+
+            admission.waiting = 1
+            self.assertEqual(degradation_level(), CRITICAL)
+            with self.assertRaises(DeferJob):
+                process_graph_job(1, {'text': 'hi'})
+
+
+    def test_streamed_responses_hold_their_slot_until_sent(self):
+        admission = Bulkhead('requests', limit=2)
+
+        def lines():
+            yield b'a'
+            yield b'b'
+
+        async def alines():
+            yield b'a'
+            yield b'b'
+
+        async def aview(request):
+            return StreamingHttpResponse(alines())
+
+        async def stream_async():
+            middleware = AdmissionControlMiddleware(aview)
+            response = await middleware(RequestFactory().post('/api/chat-response/stream/'))
+            self.assertEqual(admission.stats()['in_flight'], 1)
+            return b''.join([part async for part in response])
+
+        with mock.patch('api.services.admission._admission', admission):
+            middleware = AdmissionControlMiddleware(lambda request: StreamingHttpResponse(lines()))
+            streamed = middleware(RequestFactory().post('/api/chat-response/stream/'))
+            abandoned = middleware(RequestFactory().post('/api/chat-response/stream/'))
+            self.assertEqual(admission.stats()['in_flight'], 2)
+
+            self.assertEqual(b''.join(streamed), b'ab')
+            abandoned.close()
+            abandoned.close()
+            self.assertEqual(admission.stats()['in_flight'], 0)
+
+            self.assertEqual(asyncio.run(stream_async()), b'ab')
+            self.assertEqual(admission.stats()['in_flight'], 0)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_renders_cumulative_buckets(self):
+        histogram = Histogram('test_seconds', 'Test.', (0.1, 1), labels=('stage',))
+        for value in (0.05, 0.5, 5):
+            histogram.observe(value, stage='stt')
+        self.assertEqual(histogram.render().splitlines()[2:], [
+            'test_seconds_bucket{stage="stt",le="0.1"} 1',
+            'test_seconds_bucket{stage="stt",le="1"} 2',
+            'test_seconds_bucket{stage="stt",le="+Inf"} 3',
+            'test_seconds_sum{stage="stt"} 5.55',
+            'test_seconds_count{stage="stt"} 3',
+        ])
+
+    def test_spans_reach_histograms_and_server_timing(self):
+        def view(request):
+            with span('stt', size=10):
+                pass
+            with self.assertRaises(ValueError), span('tts'):
+                raise ValueError('failed')
+            return JsonResponse({})
+
+        before = STAGE_SECONDS.snapshot().get(('tts', 'error'), {'sum': 0, 'counts': [0]})
+        response = ServerTimingMiddleware(view)(RequestFactory().get('/'))
+
+        stages = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['stt', 'tts', 'total'])
+        after = STAGE_SECONDS.snapshot()[('tts', 'error')]
+        self.assertEqual(sum(after['counts']), sum(before['counts']) + 1)
+        self.assertIn('vdchat_stage_payload_size_count{stage="stt"}', render_metrics())
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_latency_sampler_matches_median_and_tail(self):
+        sample = lognormal_latency(0.5, 2.0, seed=1)
+        values = [sample() for _ in range(20000)]
+        self.assertAlmostEqual(percentile(values, 50), 0.5, delta=0.03)
+        self.assertAlmostEqual(percentile(values, 99), 2.0, delta=0.2)
+        self.assertEqual(lognormal_latency(0)(), 0.0)
+
+    def test_parses_server_timing(self):
+        self.assertEqual(
+            parse_server_timing('stt;dur=120.5, llm_reply;desc="x";dur=800, total;dur=1000.0'),
+            {'stt': 0.1205, 'llm_reply': 0.8, 'total': 1.0}
+        )
+        self.assertEqual(percentile([3, 1, 2, 4], 50), 2.5)
+
+
+class SearchTests(SimpleTestCase):
+    def test_fts5_query_quotes_terms_and_phrases(self):
+        self.assertEqual(fts5_query('hiking "swiss alps"'), '"hiking" "swiss alps"')
+        self.assertEqual(fts5_query('content:NEAR(a b) OR *'), '"content:NEAR(a" "b)" "OR"')
+        self.assertEqual(fts5_query('"" ^ *'), '')
+
+    def test_highlight_escapes_text_but_keeps_marks(self):
+        self.assertEqual(
+            highlight('I love <b>\x02hiking\x03</b>'),
+            'I love &lt;b&gt;<mark>hiking</mark>&lt;/b&gt;'
+        )
+
+    def test_history_cursor_round_trip(self):
+        created_at = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(created_at, 42)), (created_at, 42))
+        for cursor in ('bad', encode_rank_cursor(0.5, 1)):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_rank_cursor_round_trip(self):
+        self.assertEqual(decode_rank_cursor(encode_rank_cursor(0.12345678901234, 42)), (0.12345678901234, 42))
+        with self.assertRaises(ValueError):
+            decode_rank_cursor('bad')
+
+    def test_pages_through_results_by_score_then_id(self):
+        rows = [(5, 0.9, 'a'), (4, 0.5, 'b'), (3, 0.5, 'c'), (1, 0.1, 'd')]
+
+        class Backend:
+            def search(self, kind, query, user_id=None, after=None, limit=20):
+                matching = [r for r in rows if after is None or (r[1], r[0]) < after]
+                return matching[:limit]
+
+        service = SearchService(backend=Backend())
+        with mock.patch.object(SearchService, '_messages', side_effect=lambda page: [pk for pk, _, _ in page]):
+            first, cursor = service.search('q', limit=2)
+            second, cursor2 = service.search('q', cursor=cursor, limit=2)
+
+        self.assertEqual((first, second), ([5, 4], [3, 1]))
+        self.assertIsNone(cursor2)
+
+    def test_rejects_bad_requests(self):
+        service = SearchService(backend=SimpleNamespace(search=None))
+        for kwargs in ({'query': ' '}, {'query': 'x' * 201}, {'query': 'x', 'kind': 'users'}):
+            with self.assertRaises(ValueError):
+                service.search(**kwargs)
+
+
+@override_settings(TTS_CACHE_ENABLED=False)
+class StreamingTTSTests(SimpleTestCase):
+    TEXT = 'One. Two. Three. Four.'
+
+    def service(self, delays):
+        self.active, self.peak, self.started, self.cancelled = 0, 0, [], []
+
+        async def synthesize_speech(input, voice, audio_config, **kwargs):
+            self.started.append(input.text)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            try:
+                await asyncio.sleep(delays[input.text])
+            except asyncio.CancelledError:
+                self.cancelled.append(input.text)
+                raise
+            finally:
+                self.active -= 1
+            return SimpleNamespace(audio_content=input.text.encode())
+
+        return TTSService(client=object(), async_client=SimpleNamespace(synthesize_speech=synthesize_speech))
+
+    def test_chunks_arrive_in_order_with_bounded_lookahead(self):
+        service = self.service({'One.': 0.03, 'Two.': 0.01, 'Three.': 0, 'Four.': 0})
+
+        async def read():
+            return [chunk async for chunk in service.asynthesize_stream(self.TEXT, parallelism=2)]
+
+        self.assertEqual(asyncio.run(read()), [b'One.', b'Two.', b'Three.', b'Four.'])
+        self.assertEqual(self.peak, 2)
+
+    def test_closing_the_stream_cancels_pending_synthesis(self):
+        service = self.service({'One.': 0, 'Two.': 5, 'Three.': 5, 'Four.': 5})
+
+        async def read_one_then_disconnect():
+            stream = service.asynthesize_stream(self.TEXT, parallelism=2)
+            first = await stream.__anext__()
+            await stream.aclose()
+            await asyncio.sleep(0)
+            return first
+
+        self.assertEqual(asyncio.run(read_one_then_disconnect()), b'One.')
+        # 'Three.' was queued when 'One.' was sent and is cancelled before it starts
+        self.assertEqual(self.cancelled, ['Two.'])
+        self.assertEqual(self.active, 0)
+        self.assertNotIn('Four.', self.started)
+
+    def test_disk_cache_is_read_and_written_off_the_event_loop(self):
+        cache = TTSCache(memory_max_bytes=100, disk_dir=tempfile.mkdtemp(), disk_max_bytes=1000)
+        service = self.service({'One.': 0})
+        service.cache = cache
+        threads = []
+
+        def record(operation):
+            def wrapper(*args):
+                threads.append(threading.current_thread())
+                return operation(*args)
+            return wrapper
+
+        async def synthesize_twice():
+            with mock.patch.object(cache, 'get', record(cache.get)), \
+                    mock.patch.object(cache, 'set', record(cache.set)):
+                return [await service.asynthesize_speech('One.') for _ in range(2)]
+
+        self.assertEqual(asyncio.run(synthesize_twice()), [b'One.', b'One.'])
+        self.assertEqual(self.started, ['One.'])
+        self.assertEqual(len(threads), 3)
+        self.assertNotIn(threading.main_thread(), threads)
+
+
+def _chunk(token):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=token))])
+
+
+class StreamingChatTests(SimpleTestCase):
+    def test_first_event_is_sent_before_the_completion_finishes(self):
+        release = asyncio.Event()
+        closed = []
+
+        async def chunks():
+            yield _chunk('Hel')
+            await release.wait()
+            yield _chunk('lo')
+
+        class Stream:
+            def __aiter__(self):
+                return chunks()
+
+            async def close(self):
+                closed.append(True)
+
+        async def create(**request):
+            return Stream()
+
+        async_client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+        service = OpenAIService(client=object(), async_client=async_client, cache=ResponseCache(100, 60))
+        request = RequestFactory().post(
+            '/api/chat-response/stream/', {'conversation_id': 1, 'message': 'hi'}, content_type='application/json'
+        )
+
+        async def read(response):
+            body = response.streaming_content
+            first = await body.__anext__()
+            self.assertFalse(update.called)
+            release.set()
+            return first, [part async for part in body]
+
+        with mock.patch('api.views.get_openai_service', return_value=service), \
+                mock.patch('api.views.Conversation.objects') as conversations, \
+                mock.patch('api.views.ContextBuilder') as builder, \
+                mock.patch.object(ConversationService, 'update_conversation') as update, \
+                mock.patch('api.views.enqueue_graph_job', return_value=SimpleNamespace(id='job-1')):
+            conversations.filter.return_value.exists.return_value = True
+            builder.return_value.build.return_value = []
+            response = chat_response_stream(request)
+            self.assertTrue(response.is_async)
+            first, rest = asyncio.run(read(response))
+
+        self.assertEqual(first, b'event: token\ndata: {"token": "Hel"}\n\n')
+        self.assertTrue(rest[-1].startswith(b'event: done\ndata: {"response": "Hello"'))
+        update.assert_called_once_with(1, [('user', 'hi'), ('assistant', 'Hello')])
+        self.assertEqual(closed, [True])
+
+
+class SearchIndexTests(TestCase):
+    """Runs migration 0007's index on the configured database (DB_ENGINE=sqlite3 locally)"""
+
+    def setUp(self):
+        self.hiking = ConversationService.save_conversation(1, [
+            (Message.USER, 'I love <b>hiking</b> in the mountains'),
+            (Message.ASSISTANT, 'Mountains are great for hikers'),
+        ])
+        self.cooking = ConversationService.save_conversation(2, [(Message.USER, 'Tell me about cooking pasta')])
+        for i in range(5):
+            ConversationService.update_conversation(self.cooking.id, [(Message.USER, f'pasta recipe {i} with mountain herbs')])
+
+    def test_index_follows_inserts_and_updates(self):
+        results, _ = SearchService().search('hiking')
+        self.assertEqual([r['message_id'] for r in results], [self.hiking.messages.get(sequence=1).id])
+        self.assertEqual(results[0]['snippet'], 'I love &lt;b&gt;<mark>hiking</mark>&lt;/b&gt; in the mountains')
+
+        Message.objects.filter(conversation=self.hiking, sequence=1).update(content='I love climbing')
+        self.assertEqual(SearchService().search('hiking')[0], [])
+        self.assertEqual(len(SearchService().search('climbing')[0]), 1)
+
+    def test_pages_cover_every_match_once_including_ties(self):
+        seen, cursor = [], None
+        while True:
+            page, cursor = SearchService().search('mountain', cursor=cursor, limit=2)
+            seen.extend(r['message_id'] for r in page)
+            scores = [r['score'] for r in page]
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            if cursor is None:
+                break
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(len(SearchService().search('mountain', user_id=1)[0]), 2)
+
+    def test_topics_are_indexed_from_the_conversation_graph(self):
+        ConversationService.save_knowledge_graph(self.hiking.id, {'nodes': ['Hiking', 'Alps'], 'relationships': []})
+        ConversationService.save_knowledge_graph(self.hiking.id, {'nodes': ['Dolomites'], 'relationships': []})
+
+        results, _ = SearchService().search('dolomites', kind='topics')
+
+        self.assertEqual([r['conversation_id'] for r in results], [self.hiking.id])
+        self.assertIn('<mark>Dolomites</mark>', results[0]['snippet'])
+
+
+class FakeConversationService:
+    def __init__(self):
+        self.saved = []
+
+    async def asave_conversation(self, user_id, messages):
+        self.saved.append(messages)
+        return SimpleNamespace(id=42)
+
+    async def aupdate_conversation(self, conversation_id, messages):
+        self.saved.append(messages)
+        return SimpleNamespace(id=conversation_id)
+
+
+class VoicePipelineTests(SimpleTestCase):
+    """Stages sleep for fixed latencies; `fail` maps a stage to the error it raises"""
+
+    STT, SAVE, LLM, TTS, UPDATE = 0.1, 0.1, 0.2, 0.2, 0.2
+
+    def setUp(self):
+        self.events = {}
+        self.fail = {}
+        self.transcript = 'hello'
+
+    def stage(self, name):
+        if name in self.fail:
+            raise self.fail[name]
+
+    def services(self):
+        async def atranscribe(audio_file):
+            await asyncio.sleep(self.STT)
+            self.stage('stt')
+            return self.transcript
+
+        async def asave_conversation(user_id, messages):
+            await asyncio.sleep(self.SAVE)
+            self.events['saved'] = time.monotonic()
+            return SimpleNamespace(id=7)
+
+        async def agenerate_turn(user_input, with_topics=True):
+            await asyncio.sleep(self.LLM)
+            self.stage('llm')
+            self.events['replied'] = time.monotonic()
+            return f"You said {user_input}", None
+
+        async def asynthesize_speech(text):
+            await asyncio.sleep(self.TTS)
+            self.stage('tts')
+            return b'mp3'
+
+        async def aupdate_conversation(conversation_id, messages):
+            await asyncio.sleep(self.UPDATE)
+
+        def transcribe(audio_file):
+            self.stage('stt')
+            return self.transcript
+
+        def generate_turn(user_input, with_topics=True):
+            self.stage('llm')
+            return f"You said {user_input}", None
+
+        def synthesize_speech(text):
+            self.stage('tts')
+            return b'mp3'
+
+        return SimpleNamespace(
+            stt=SimpleNamespace(atranscribe=atranscribe, transcribe=transcribe),
+            openai=SimpleNamespace(agenerate_turn=agenerate_turn, generate_turn=generate_turn),
+            tts=SimpleNamespace(asynthesize_speech=asynthesize_speech, synthesize_speech=synthesize_speech),
+            conv=SimpleNamespace(
+                asave_conversation=asave_conversation,
+                aupdate_conversation=aupdate_conversation,
+                save_conversation=lambda user_id, messages: SimpleNamespace(id=7),
+                update_conversation=lambda conversation_id, messages: SimpleNamespace(id=7)
+            )
+        )
+
+    @staticmethod
+    def upload():
+        return SimpleUploadedFile('clip.wav', make_wav([(0.2, 0.3)]), content_type='audio/wav')
+
+    def test_wall_time_follows_the_critical_path(self):
+        services = self.services()
+        pipeline = VoicePipeline(services.stt, services.openai, services.tts, services.conv)
+
+        with mock.patch('api.services.voice_pipeline.enqueue_graph_job', return_value=SimpleNamespace(id='job-1')):
+            started = time.monotonic()
+            result = asyncio.run(pipeline.run(self.upload(), user_id=1))
+            elapsed = time.monotonic() - started
+
+        critical_path = self.STT + max(self.SAVE, self.LLM) + max(self.TTS, self.UPDATE)
+        self.assertGreaterEqual(elapsed, critical_path)
+        self.assertLess(elapsed, critical_path + 0.15)
+        self.assertLess(self.events['saved'], self.events['replied'])
+        self.assertEqual(result, {
+            'conversation_id': 7,
+            'transcript': 'hello',
+            'response': 'You said hello',
+            'audio_response': b'mp3',
+            'graph_job_id': 'job-1'
+        })
+
+    def test_stage_errors_map_to_the_same_status_as_the_sync_view(self):
+        self.STT = self.SAVE = self.LLM = self.TTS = self.UPDATE = 0
+        services = self.services()
+        patches = {
+            'api.views.get_stt_service': lambda: services.stt,
+            'api.views.get_openai_service': lambda: services.openai,
+            'api.views.get_tts_service': lambda: services.tts,
+            'api.views.ConversationService': lambda: services.conv,
+            'api.services.voice_pipeline.ConversationService': lambda: services.conv,
+        }
+        cases = [
+            ({}, '', 400),
+            ({'stt': ValueError('Unsupported audio')}, 'hello', 400),
+            ({'stt': Exception('STT unavailable')}, 'hello', 500),
+            ({'llm': OverloadedError('busy', retry_after=3)}, 'hello', 503),
+            ({'llm': Exception('Failed to generate response')}, 'hello', 500),
+            ({'tts': Exception('TTS unavailable')}, 'hello', 500),
+            ({}, 'hello', 201),
+        ]
+
+        patches['api.views.enqueue_graph_job'] = lambda *args: SimpleNamespace(id='job-1')
+        patches['api.services.voice_pipeline.enqueue_graph_job'] = lambda *args: SimpleNamespace(id='job-1')
+        with ExitStack() as stack:
+            for target, replacement in patches.items():
+                stack.enter_context(mock.patch(target, replacement))
+            for fail, transcript, expected in cases:
+                self.fail, self.transcript = fail, transcript
+                sync_response = voice_input(RequestFactory().post('/api/voice-input/', {'audio': self.upload()}))
+                async_response = asyncio.run(voice_input_async(
+                    RequestFactory().post('/api/voice-input/async/', {'audio': self.upload()})
+                ))
+                self.assertEqual((sync_response.status_code, async_response.status_code), (expected, expected))
+                if expected == 503:
+                    self.assertEqual(async_response['Retry-After'], sync_response['Retry-After'])
+
+
+class VoiceSessionTests(SimpleTestCase):
+    def setUp(self):
+        openai_service = mock.Mock()
+        openai_service.agenerate_turn = mock.AsyncMock(side_effect=lambda text, context: (f"You said {text}", None))
+        tts_service = mock.Mock()
+
+        async def synthesize_stream(text):
+            for chunk in (b'mp3-1', b'mp3-2'):
+                yield chunk
+        tts_service.asynthesize_stream = synthesize_stream
+        self.conv_service = FakeConversationService()
+
+        services = {
+            'get_stt_service': lambda: STTService(client=FakeSpeechClient(), async_client=object()),
+            'get_openai_service': lambda: openai_service,
+            'get_tts_service': lambda: tts_service,
+            'ConversationService': lambda: self.conv_service,
+            'ContextBuilder': lambda openai_service: SimpleNamespace(build=lambda conversation_id: []),
+            'enqueue_graph_job': lambda *args: SimpleNamespace(id='job-1'),
+        }
+        for name, replacement in services.items():
+            patcher = mock.patch(f'api.websocket.{name}', replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_session(self, incoming, path='/ws/voice/', query_string=b'', hang_up_after=None):
+        """Play `incoming` to a session and return what it sent.
+
+        The disconnect is held back until `hang_up_after(sent)` is true.
+        """
+        sent = []
+
+        async def session():
+            inbox = asyncio.Queue()
+            for message in [{'type': 'websocket.connect'}] + incoming:
+                inbox.put_nowait(message)
+            done = asyncio.Event()
+
+            async def receive():
+                message = await inbox.get()
+                if message['type'] == 'websocket.disconnect' and hang_up_after is not None:
+                    await asyncio.wait_for(done.wait(), 5)
+                return message
+
+            async def send(message):
+                sent.append(message)
+                if hang_up_after is not None and hang_up_after(sent):
+                    done.set()
+
+            scope = {'type': 'websocket', 'path': path, 'query_string': query_string}
+            await voice_session_application(scope, receive, send)
+
+        asyncio.run(session())
+        return sent
+
+    def test_turns_stream_transcripts_replies_and_audio(self):
+        sent = self.run_session([
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'start', 'encoding': 'LINEAR16', 'sample_rate': 16000})},
+            {'type': 'websocket.receive', 'bytes': b'hello '},
+            {'type': 'websocket.receive', 'bytes': b'world'},
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'stop'})},
+            {'type': 'websocket.receive', 'bytes': b'again'},
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'stop'})},
+            {'type': 'websocket.disconnect'},
+        ], hang_up_after=lambda sent: sum(m.get('text') == json.dumps({'type': 'audio_end'}) for m in sent) == 2)
+
+        self.assertEqual(sent[0], {'type': 'websocket.accept'})
+        texts = [json.loads(m['text']) for m in sent if 'text' in m]
+        self.assertEqual(
+            [t['transcript'] for t in texts if t['type'] == 'partial'],
+            ['hello', 'hello world', 'again']
+        )
+        self.assertEqual(
+            [t['transcript'] for t in texts if t['type'] == 'final'],
+            ['hello world', 'again']
+        )
+        responses = [t for t in texts if t['type'] == 'response']
+        self.assertEqual([r['response'] for r in responses], ['You said hello world', 'You said again'])
+        self.assertEqual({r['conversation_id'] for r in responses}, {42})
+        self.assertEqual([m['bytes'] for m in sent if 'bytes' in m], [b'mp3-1', b'mp3-2'] * 2)
+        self.assertEqual(self.conv_service.saved, [
+            [('user', 'hello world'), ('assistant', 'You said hello world')],
+            [('user', 'again'), ('assistant', 'You said again')],
+        ])
+
+    def test_unknown_path_is_rejected(self):
+        sent = self.run_session([], path='/ws/other/')
+
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4404}])
+
+    def test_malformed_messages_are_answered_without_dropping_the_session(self):
+        sent = self.run_session([
+            {'type': 'websocket.receive', 'text': '[]'},
+            {'type': 'websocket.receive', 'text': '"x"'},
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'start', 'sample_rate': 'fast'})},
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'start', 'sample_rate': None})},
+            {'type': 'websocket.receive', 'text': 'not json'},
+            {'type': 'websocket.receive', 'bytes': b'hello'},
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'stop'})},
+            {'type': 'websocket.disconnect'},
+        ], hang_up_after=lambda sent: any(m.get('text') == json.dumps({'type': 'audio_end'}) for m in sent))
+
+        texts = [json.loads(m['text']) for m in sent if 'text' in m]
+        self.assertEqual([t['error'] for t in texts if t['type'] == 'error'], [
+            'Messages must be JSON objects',
+            'Messages must be JSON objects',
+            'sample_rate must be an integer',
+            'sample_rate must be an integer',
+            'Invalid JSON message',
+        ])
+        self.assertIn({'type': 'final', 'transcript': 'hello'}, texts)
+
+    def test_invalid_conversation_id_is_rejected_before_accepting(self):
+        sent = self.run_session([], query_string=b'conversation_id=abc')
+
+        self.assertEqual(sent, [{'type': 'websocket.close', 'code': 4400}])
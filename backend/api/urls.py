@@ -3,7 +3,22 @@ from . import views
 
 urlpatterns = [
     path('voice-input/', views.voice_input, name='voice-input'),
+    path('voice-input-async/', views.voice_input_async, name='voice-input-async'),
     path('chat-response/', views.chat_response, name='chat-response'),
+    path('chat-response/stream/', views.chat_response_stream, name='chat-response-stream'),
+    path('chat-response/batch/', views.chat_response_batch, name='chat-response-batch'),
     path('voice-output/', views.voice_output, name='voice-output'),
-    path('knowledge-graph/', views.get_knowledge_graph, name='knowledge-graph'),
+    path('voice-output/stream/', views.voice_output_stream, name='voice-output-stream'),
+    path('conversations/<int:user_id>/history/', views.get_conversation_history, name='conversation-history'),
+    path('search/', views.search, name='search'),
+    path('knowledge-graph/<int:conversation_id>/', views.get_knowledge_graph, name='knowledge-graph'),
+    path('knowledge-graph/<int:conversation_id>/merged/', views.get_merged_knowledge_graph, name='knowledge-graph-merged'),
+    path('knowledge-graph/<int:conversation_id>/status/', views.get_graph_job_status, name='knowledge-graph-status'),
+    path('topics/neighbours/', views.topic_neighbours, name='topic-neighbours'),
+    path('topics/expand/', views.topic_expand, name='topic-expand'),
+    path('topics/path/', views.topic_path, name='topic-path'),
+    path('topics/components/', views.topic_components, name='topic-components'),
+    path('health/', views.health, name='health'),
+    path('cache-stats/', views.cache_stats, name='cache-stats'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,309 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+# Recognition encodings for containers sent as they are
+CONTAINER_ENCODINGS = {
+    'webm': 'WEBM_OPUS',
+    'ogg': 'OGG_OPUS',
+    'mp3': 'MP3',
+    'flac': 'FLAC',
+}
+# Sample rates the recogniser assumes for compressed uploads it cannot inspect
+CONTAINER_SAMPLE_RATES = {
+    'webm': 48000,
+    'ogg': 48000,
+}
+
+
+class EmptyAudioError(ValueError):
+    """The clip contains no speech"""
+
+
+class AudioDecodeError(ValueError):
+    """The clip could not be decoded to PCM here.
+
+    A ValueError, so an upload that cannot be decoded is the client's error
+    (400); where a fallback exists (ffmpeg missing or failing) it is caught
+    before it gets that far.
+    """
+
+
+@dataclass
+class PreparedAudio:
+    content: bytes
+    encoding: str
+    sample_rate: int
+    container: str
+    original_bytes: int
+    duration: float = None
+
+
+def sniff_container(header):
+    """Identify the audio container from its leading bytes, or None"""
+    if header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:4] == b'\x1a\x45\xdf\xa3':
+        return 'webm'
+    if header[:4] == b'OggS':
+        return 'ogg'
+    if header[:4] == b'fLaC':
+        return 'flac'
+    if header[:3] == b'ID3' or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return 'mp3'
+    return None
+
+
+def _to_float(frames, width):
+    if width == 1:
+        return (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128) / 128
+    if width in (2, 4):
+        dtype = np.int16 if width == 2 else np.int32
+        return np.frombuffer(frames, dtype=dtype).astype(np.float32) / np.iinfo(dtype).max
+    raise AudioDecodeError(f"Unsupported WAV sample width: {width * 8} bits")
+
+
+def _convert_with_ffmpeg(source, destination, rate):
+    """Decode any container ffmpeg understands into a mono 16-bit WAV file.
+
+    `source` is a path (read by ffmpeg directly) or bytes (piped in).
+    """
+    binary = shutil.which(settings.FFMPEG_BINARY)
+    if binary is None:
+        raise AudioDecodeError("ffmpeg is not available")
+
+    piped = isinstance(source, bytes)
+    result = subprocess.run(
+        [binary, '-hide_banner', '-loglevel', 'error', '-y', '-i', 'pipe:0' if piped else source,
+         '-ac', '1', '-ar', str(rate), '-c:a', 'pcm_s16le', '-f', 'wav', destination],
+        input=source if piped else None,
+        capture_output=True,
+        timeout=settings.FFMPEG_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise AudioDecodeError(result.stderr.decode(errors='replace').strip())
+
+
+def _encode_with_ffmpeg(pcm, rate):
+    """Compress mono 16-bit PCM to Ogg Opus"""
+    result = subprocess.run(
+        [shutil.which(settings.FFMPEG_BINARY), '-hide_banner', '-loglevel', 'error',
+         '-f', 's16le', '-ar', str(rate), '-ac', '1', '-i', 'pipe:0',
+         '-c:a', 'libopus', '-b:a', '24k', '-f', 'ogg', 'pipe:1'],
+        input=pcm,
+        capture_output=True,
+        timeout=settings.FFMPEG_TIMEOUT
+    )
+    if result.returncode != 0:
+        raise AudioDecodeError(result.stderr.decode(errors='replace').strip())
+    return result.stdout
+
+
+def downmix(samples):
+    return samples.mean(axis=1) if samples.ndim == 2 else samples
+
+
+def resample(samples, from_rate, to_rate):
+    """Resample mono audio by linear interpolation, low-pass filtered when downsampling"""
+    if from_rate == to_rate or not len(samples):
+        return samples
+    if to_rate < from_rate:
+        width = int(round(from_rate / to_rate))
+        if width > 1:
+            samples = np.convolve(samples, np.ones(width, dtype=np.float32) / width, mode='same')
+
+    duration = len(samples) / from_rate
+    positions = np.arange(int(duration * to_rate)) * (from_rate / to_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+def frame_levels(reader, frame_ms=30, block_frames=400):
+    """Per-frame RMS level (dBFS) of a WAV, read `block_frames` frames at a time"""
+    rate, channels, width = reader.getframerate(), reader.getnchannels(), reader.getsampwidth()
+    frame = max(1, int(rate * frame_ms / 1000))
+    reader.rewind()
+
+    levels = []
+    while True:
+        data = reader.readframes(frame * block_frames)
+        if not data:
+            break
+        samples = downmix(_to_float(data, width).reshape(-1, channels))
+        count = len(samples) // frame
+        if count == 0:
+            break
+        rms = np.sqrt(np.mean(samples[:count * frame].reshape(count, frame) ** 2, axis=1))
+        levels.append(20 * np.log10(np.maximum(rms, 1e-10)))
+    return (np.concatenate(levels) if levels else np.empty(0)), frame
+
+
+def plan_segments(levels, frame_ms=30, threshold_db=-45.0, padding_ms=200,
+                  min_silence_ms=500, max_segment_ms=15000):
+    """Split voiced audio into (start, end) frame ranges no longer than `max_segment_ms`.
+
+    A frame is voiced when its level is above `threshold_db` and 10 dB over
+    the clip's noise floor (its quietest tenth of frames), or 20 dB under
+    its peak when that is lower. Voiced runs
+    separated by at least `min_silence_ms` are packed greedily into
+    segments, which are padded and cut at silences; a single run longer
+    than the limit is cut at its quietest frame. Leading and trailing
+    silence is dropped, and a clip with no voiced frames has no segments.
+    """
+    if not len(levels):
+        return []
+    # Clips that are nearly all speech have no quiet tenth to measure
+    relative = min(np.percentile(levels, 10) + 10, levels.max() - 20)
+    threshold = max(threshold_db, relative)
+    voiced = np.flatnonzero(levels > threshold)
+    if not len(voiced):
+        return []
+
+    padding = int(padding_ms / frame_ms)
+    min_gap = max(1, int(min_silence_ms / frame_ms))
+    limit = max(1, int(max_segment_ms / frame_ms))
+
+    breaks = np.flatnonzero(np.diff(voiced) > min_gap)
+    run_starts = voiced[np.r_[0, breaks + 1]]
+    run_ends = voiced[np.r_[breaks, len(voiced) - 1]] + 1
+
+    packed = []
+    start, end = run_starts[0], run_ends[0]
+    for run_start, run_end in zip(run_starts[1:], run_ends[1:]):
+        if run_end - start + 2 * padding <= limit:
+            end = run_end
+        else:
+            packed.append((start, end))
+            start, end = run_start, run_end
+    packed.append((start, end))
+
+    segments = []
+    for start, end in packed:
+        start, end = max(0, start - padding), min(len(levels), end + padding)
+        while end - start > limit:
+            # Cut in the quieter half of the window, never mid-frame
+            window = levels[start + limit // 2:start + limit]
+            cut = start + limit // 2 + int(np.argmin(window))
+            segments.append((start, cut))
+            start = cut
+        segments.append((int(start), int(end)))
+    return segments
+
+
+def read_segment(reader, start, end, target_rate):
+    """Samples [start, end) of a WAV as mono LINEAR16 bytes at `target_rate`"""
+    reader.setpos(start)
+    data = reader.readframes(end - start)
+    samples = downmix(_to_float(data, reader.getsampwidth()).reshape(-1, reader.getnchannels()))
+    samples = resample(samples, reader.getframerate(), target_rate)
+    return (np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes()
+
+
+def _upload_path(audio_file):
+    try:
+        return audio_file.temporary_file_path()
+    except AttributeError:
+        return None
+
+
+@contextmanager
+def segment_upload(audio_file):
+    """Yield loaders for the voiced segments of an upload, in order.
+
+    Each loader returns a PreparedAudio for its segment and opens its own
+    reader, so loaders can run on different threads. Only one segment is
+    decoded at a time per loader; the upload itself is never held in memory
+    when Django has spooled it to disk. WAV is read directly and other
+    containers are first converted to a temporary WAV with ffmpeg. Without
+    ffmpeg a compressed upload is sent whole, with the encoding of its
+    container. Raises EmptyAudioError when no segment is voiced, and
+    ValueError for unrecognised data.
+    """
+    header = audio_file.read(16)
+    audio_file.seek(0)
+    container = sniff_container(header)
+    if container is None:
+        raise ValueError("Unrecognised audio format")
+
+    target_rate = settings.STT_TARGET_SAMPLE_RATE
+    path = _upload_path(audio_file)
+    converted = None
+    try:
+        if container == 'wav':
+            if path is None:
+                content = audio_file.read()
+                open_reader = lambda: wave.open(io.BytesIO(content))
+            else:
+                open_reader = lambda: wave.open(path, 'rb')
+        else:
+            converted = tempfile.NamedTemporaryFile(suffix='.wav', delete=False)
+            converted.close()
+            try:
+                _convert_with_ffmpeg(path or audio_file.read(), converted.name, target_rate)
+            except (AudioDecodeError, subprocess.TimeoutExpired) as e:
+                print(f"⚠️ Sending {container} audio without preprocessing: {str(e)}")
+                audio_file.seek(0)
+                content = audio_file.read()
+                yield [lambda: PreparedAudio(
+                    content=content,
+                    encoding=CONTAINER_ENCODINGS[container],
+                    sample_rate=CONTAINER_SAMPLE_RATES.get(container),
+                    container=container,
+                    original_bytes=len(content)
+                )]
+                return
+            open_reader = lambda: wave.open(converted.name, 'rb')
+
+        try:
+            with open_reader() as reader:
+                levels, frame = frame_levels(reader)
+                source_rate = reader.getframerate()
+        except (wave.Error, EOFError) as e:
+            raise ValueError(f"Could not decode {container} audio: {str(e)}")
+
+        segments = plan_segments(
+            levels,
+            threshold_db=settings.VAD_THRESHOLD_DB,
+            padding_ms=settings.VAD_PADDING_MS,
+            min_silence_ms=settings.STT_SEGMENT_MIN_SILENCE_MS,
+            max_segment_ms=settings.STT_SEGMENT_MAX_SECONDS * 1000
+        )
+        if not segments:
+            raise EmptyAudioError("No speech detected in audio")
+
+        def loader(start, end):
+            def load():
+                with open_reader() as reader:
+                    pcm = read_segment(reader, start * frame, end * frame, target_rate)
+                prepared = PreparedAudio(
+                    content=pcm,
+                    encoding='LINEAR16',
+                    sample_rate=target_rate,
+                    container=container,
+                    original_bytes=audio_file.size,
+                    duration=(end - start) * frame / source_rate
+                )
+                # Raw PCM can outweigh the compressed upload it came from
+                if container != 'wav' and len(pcm) > audio_file.size * (end - start) / len(levels):
+                    try:
+                        prepared.content = _encode_with_ffmpeg(pcm, target_rate)
+                        prepared.encoding = 'OGG_OPUS'
+                    except (AudioDecodeError, subprocess.TimeoutExpired) as e:
+                        print(f"⚠️ Could not re-encode audio segment: {str(e)}")
+                return prepared
+            return load
+
+        speech = sum(end - start for start, end in segments) * frame / source_rate
+        print(f"✓ Audio split into {len(segments)} segment(s), {speech:.2f}s of speech")
+        yield [loader(start, end) for start, end in segments]
+
+    finally:
+        if converted is not None:
+            os.unlink(converted.name)
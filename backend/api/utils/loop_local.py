@@ -0,0 +1,50 @@
+import asyncio
+import threading
+import weakref
+
+
+class LoopLocal:
+    """Lazily builds and caches one object per running event loop.
+
+    Async upstream clients (grpc.aio channels, httpx.AsyncClient, the async
+    Neo4j driver) are bound to the loop that created them. Under an ASGI
+    server there is a single loop, so each client is created once per process.
+    """
+
+    def __init__(self, factory, instance=None):
+        self._factory = factory
+        self._instance = instance
+        self._instances = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._instance is not None:
+            return self._instance
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            instance = self._instances.get(loop)
+            if instance is None:
+                instance = self._factory()
+                self._instances[loop] = instance
+            return instance
+
+    def close(self, closer, timeout=5.0):
+        """Close every instance built here with the coroutine function `closer`.
+
+        Each is closed on its own loop, so this must not be called from a
+        running loop (see ClientRegistry.aclose_all). Instances whose loop is
+        already closed are dropped; their connections went with the loop. An
+        instance passed in is left to its owner.
+        """
+        with self._lock:
+            instances = list(self._instances.items())
+            self._instances.clear()
+
+        for loop, instance in instances:
+            if loop.is_closed():
+                continue
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(closer(instance), loop).result(timeout)
+            else:
+                loop.run_until_complete(closer(instance))
@@ -0,0 +1,141 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, from a cache hit to a slow upstream call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Bytes, from a short message to a long recording
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Spans finished while handling the current request, or None outside a request
+_request_spans = contextvars.ContextVar('request_spans', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label combination"""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {key: {'counts': list(s['counts']), 'sum': s['sum']} for key, s in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.snapshot().items()):
+            labels = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series['counts']):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(labels + [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_labels(labels)} {cumulative}")
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(pairs):
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+STAGE_SECONDS = Histogram(
+    'vdchat_stage_duration_seconds',
+    'Time spent in each stage of a turn.',
+    DURATION_BUCKETS,
+    labels=('stage', 'outcome')
+)
+STAGE_PAYLOAD = Histogram(
+    'vdchat_stage_payload_size',
+    'Payload handled by each stage: bytes of text or audio, or nodes plus relationships for graph_write.',
+    SIZE_BUCKETS,
+    labels=('stage',)
+)
+REQUEST_SECONDS = Histogram(
+    'vdchat_request_duration_seconds',
+    'Time to produce a response, per view.',
+    DURATION_BUCKETS,
+    labels=('view', 'status')
+)
+HISTOGRAMS = (STAGE_SECONDS, STAGE_PAYLOAD, REQUEST_SECONDS)
+
+
+class Span:
+    def __init__(self, stage, size=None):
+        self.stage = stage
+        self.size = size
+        self.duration = None
+
+
+@contextmanager
+def span(stage, size=None):
+    """Time a stage of a turn.
+
+    The duration (and payload size, when given here or set on the yielded
+    Span before the block ends) goes into the stage histograms, and into the
+    current request's Server-Timing summary when there is one.
+    """
+    record = Span(stage, size)
+    outcome = 'ok'
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        outcome = 'error'
+        raise
+    finally:
+        record.duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(record.duration, stage=stage, outcome=outcome)
+        if record.size is not None:
+            STAGE_PAYLOAD.observe(record.size, stage=stage)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append(record)
+
+
+def start_request():
+    """Begin collecting spans for the current request; returns a reset token"""
+    return _request_spans.set([])
+
+
+def finish_request(token):
+    """Stop collecting and return the request's spans"""
+    spans = _request_spans.get() or []
+    _request_spans.reset(token)
+    return spans
+
+
+def server_timing(spans, total=None):
+    """Server-Timing header value, with repeated stages summed"""
+    durations = {}
+    for record in spans:
+        durations[record.stage] = durations.get(record.stage, 0.0) + record.duration
+    if total is not None:
+        durations['total'] = total
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+
+def render_metrics():
+    """All histograms in the Prometheus text exposition format"""
+    return '\n'.join(histogram.render() for histogram in HISTOGRAMS) + '\n'
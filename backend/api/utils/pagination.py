@@ -0,0 +1,35 @@
+import base64
+import json
+
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(created_at, pk):
+    """Opaque keyset cursor for the (created_at, id) position of the last row served"""
+    raw = json.dumps([created_at.isoformat(), pk])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk)
+    except (ValueError, TypeError, json.JSONDecodeError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+def encode_rank_cursor(score, pk):
+    """Opaque keyset cursor for the (relevance, id) position of the last result served"""
+    raw = json.dumps([score, pk])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_rank_cursor(cursor):
+    try:
+        score, pk = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(score), int(pk)
+    except (ValueError, TypeError, json.JSONDecodeError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor}")
@@ -0,0 +1,13 @@
+# Per-message overhead of the chat format, in tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English)"""
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def estimate_request_tokens(request):
+    """Prompt plus the most the completion may add, for a chat completion request"""
+    prompt = sum(estimate_tokens(message.get('content') or '') for message in request.get('messages', []))
+    return prompt + request.get('max_tokens', 0)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+
+class UploadSizeLimitHandler(FileUploadHandler):
+    """First upload handler: drops any file larger than AUDIO_UPLOAD_MAX_BYTES.
+
+    Chunks are passed through to the next handler (memory or a temporary
+    file on disk, per FILE_UPLOAD_MAX_MEMORY_SIZE) until the limit is
+    crossed; the file is then skipped and `request.upload_too_large` set so
+    the view can answer 413 instead of "no file".
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.AUDIO_UPLOAD_MAX_BYTES:
+            self.request.upload_too_large = True
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
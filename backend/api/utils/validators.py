@@ -1,11 +1,15 @@
+from .audio import sniff_container
+
+
 def validate_audio_file(file):
-    allowed_types = [
-        'audio/wav', 
-        'audio/x-wav', 
-        'audio/mp3',
-        'audio/webm',
-        'audio/webm;codecs=opus'  # Add this for opus codec
-    ]
+    """Check the upload is audio by its leading bytes; the declared content type is only logged"""
     print(f"Received file type: {file.content_type}")  # Debug print
-    if file.content_type not in allowed_types:
-        raise ValueError(f'Invalid audio file type: {file.content_type}. Allowed types: {allowed_types}')
\ No newline at end of file
+    header = file.read(16)
+    file.seek(0)
+    container = sniff_container(header)
+    if container is None:
+        raise ValueError(
+            f'Unrecognised audio data (declared as {file.content_type}). '
+            'Supported formats: WAV, WebM/Opus, Ogg/Opus, MP3, FLAC'
+        )
+    return container
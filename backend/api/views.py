@@ -1,14 +1,50 @@
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from .models import Conversation, KnowledgeGraph
-from .services.stt_service import STTService
-from .services.tts_service import TTSService
-from .services.graph_service import KnowledgeGraphService
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from .models import Conversation, KnowledgeGraph, Message
 from .services.conversation_service import ConversationService
-from .services.openai_service import OpenAIService
+from .services.client_registry import (
+    registry,
+    get_stt_service,
+    get_tts_service,
+    get_openai_service,
+)
+from .services.graph_jobs import graph_job_queue, enqueue_graph_job, TOPIC_EXTRACTORS
+from .services.graph_index import get_graph_index
+from .services.context_builder import ContextBuilder
+from .services.voice_pipeline import VoicePipeline
+from .services.batch_chat import BatchChatRunner
+from .services.search_service import SearchService
+from .services.admission import admission_stats
+from .services.resilience import OPEN, OverloadedError, upstream_stats
+from .middleware import overloaded_response
+from .utils.metrics import render_metrics, span
 from .utils.validators import validate_audio_file
+import base64
+import json
+
+def _invalid_extractor(extractor):
+    """Error response for an unknown topic_extractor override, else None"""
+    if extractor is None or extractor in TOPIC_EXTRACTORS:
+        return None
+    return {'error': f"topic_extractor must be one of: {', '.join(TOPIC_EXTRACTORS)}"}
+
+def _parse_flag(value, default=True):
+    """A boolean from JSON, or from the "true"/"false" strings forms and query strings carry"""
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return bool(value)
+
+def _data_flag(request, name, default=True):
+    return _parse_flag(request.data.get(name), default)
 
 @api_view(['POST'])
 def voice_input(request):
@@ -21,6 +57,11 @@ def voice_input(request):
         # Validate audio input
         print("1. Checking audio file...")
         audio_file = request.FILES.get('audio')
+        if getattr(request, 'upload_too_large', False):
+            return Response(
+                {'error': f"Audio file exceeds {settings.AUDIO_UPLOAD_MAX_BYTES} bytes"}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
         if not audio_file:
             print("❌ No audio file found in request")
             return Response(
@@ -28,16 +69,20 @@ def voice_input(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
         print(f"✓ Audio file received: {audio_file.name}, Size: {audio_file.size} bytes")
-        validate_audio_file(audio_file)
+        with span('validation', size=audio_file.size):
+            validate_audio_file(audio_file)
         print("✓ Audio file validated")
 
+        topic_extractor = request.data.get('topic_extractor')
+        if error := _invalid_extractor(topic_extractor):
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
         # Initialize services
         print("\n2. Initializing services...")
-        stt_service = STTService()
+        stt_service = get_stt_service()
         conv_service = ConversationService()
-        openai_service = OpenAIService()
-        tts_service = TTSService()
-        graph_service = KnowledgeGraphService()
+        openai_service = get_openai_service()
+        tts_service = get_tts_service()
         print("✓ All services initialized")
 
         # 1. Convert speech to text
@@ -58,49 +103,38 @@ def voice_input(request):
         print(f"User ID: {user_id}")
         conversation = conv_service.save_conversation(
             user_id,
-            f"User: {user_input}"
+            [(Message.USER, user_input)]
         )
         print(f"✓ Conversation saved with ID: {conversation.id}")
 
         # 3. Generate AI response
         print("\n5. Generating AI response...")
-        ai_response = openai_service.generate_response(user_input)
+        # A requested topic extractor replaces the topics of the combined completion
+        ai_response, topics = openai_service.generate_turn(user_input, with_topics=topic_extractor is None)
         print(f"✓ AI response generated: '{ai_response}'")
         
         # 4. Update conversation with AI response
         print("\n6. Updating conversation...")
         conversation = conv_service.update_conversation(
             conversation.id,
-            f"AI: {ai_response}"
+            [(Message.ASSISTANT, ai_response)]
         )
         print("✓ Conversation updated with AI response")
 
-        # 5. Process knowledge graph
-        print("\n7. Processing knowledge graph...")
-        full_text = f"{user_input} {ai_response}"
-        print(f"Extracting topics from: '{full_text}'")
-        topics = openai_service.extract_topics(full_text)
-        print(f"✓ Topics extracted: {topics}")
-        
-        graph_data = graph_service.process_topics(topics, conversation.id)
-        print("✓ Graph data processed")
-        
-        # 6. Save knowledge graph
-        print("\n8. Saving knowledge graph...")
-        knowledge_graph = KnowledgeGraph.objects.create(
-            conversation_id=conversation.id,
-            graph_data=graph_data
-        )
-        print(f"✓ Knowledge graph saved with ID: {knowledge_graph.id}")
+        # 5. Queue knowledge graph processing off the request path
+        print("\n7. Queueing knowledge graph job...")
+        graph_job = enqueue_graph_job(conversation.id, user_input, ai_response, topics, topic_extractor)
+        print(f"✓ Knowledge graph job queued with ID: {graph_job.id}")
 
-        # 7. Convert AI response to speech
-        print("\n9. Converting response to speech...")
+        # 6. Convert AI response to speech
+        print("\n8. Converting response to speech...")
         audio_response = tts_service.synthesize_speech(ai_response)
         print("✓ Speech synthesis completed")
 
         # Convert binary audio data to base64 for JSON serialization
-        import base64
-        audio_response_b64 = base64.b64encode(audio_response).decode('utf-8')
+        with span('encoding') as timing:
+            audio_response_b64 = base64.b64encode(audio_response).decode('utf-8')
+            timing.size = len(audio_response_b64)
 
         print("\n=== Processing Complete ===")
         return Response({
@@ -108,9 +142,12 @@ def voice_input(request):
             'transcript': user_input,
             'response': ai_response,
             'audio_response': audio_response_b64,  # Send as base64
-            'graph_id': knowledge_graph.id
+            'graph_job_id': graph_job.id
         }, status=status.HTTP_201_CREATED)
 
+    except OverloadedError as e:
+        print(f"⚠️ Refusing request under load: {str(e)}")
+        return overloaded_response(e)
     except ValueError as e:
         print(f"\n❌ Validation Error: {str(e)}")
         return Response(
@@ -127,6 +164,58 @@ def voice_input(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@csrf_exempt
+@require_POST
+async def voice_input_async(request):
+    """Async voice input for the ASGI app: overlaps the independent stages"""
+    DEV_USER_ID = 1
+
+    try:
+        audio_file = request.FILES.get('audio')
+        if getattr(request, 'upload_too_large', False):
+            return JsonResponse(
+                {'error': f"Audio file exceeds {settings.AUDIO_UPLOAD_MAX_BYTES} bytes"},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        if not audio_file:
+            return JsonResponse(
+                {'error': 'No audio file provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        with span('validation', size=audio_file.size):
+            validate_audio_file(audio_file)
+
+        topic_extractor = request.POST.get('topic_extractor')
+        if error := _invalid_extractor(topic_extractor):
+            return JsonResponse(error, status=status.HTTP_400_BAD_REQUEST)
+
+        pipeline = VoicePipeline(
+            stt_service=get_stt_service(),
+            openai_service=get_openai_service(),
+            tts_service=get_tts_service()
+        )
+        result = await pipeline.run(audio_file, DEV_USER_ID, topic_extractor)
+        with span('encoding') as timing:
+            result['audio_response'] = base64.b64encode(result['audio_response']).decode('utf-8')
+            timing.size = len(result['audio_response'])
+
+        return JsonResponse(result, status=status.HTTP_201_CREATED)
+
+    except OverloadedError as e:
+        print(f"⚠️ Refusing request under load: {str(e)}")
+        return overloaded_response(e)
+    except ValueError as e:
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        print(f"\n❌ Unexpected Error: {str(e)}")
+        return JsonResponse(
+            {'error': str(e)},
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @api_view(['POST'])
 def chat_response(request):
     """Handle text input and generate response"""
@@ -139,35 +228,40 @@ def chat_response(request):
                 {'error': 'No message provided'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        topic_extractor = request.data.get('topic_extractor')
+        if error := _invalid_extractor(topic_extractor):
+            return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
         # Initialize services
-        openai_service = OpenAIService()
+        openai_service = get_openai_service()
         conv_service = ConversationService()
-        graph_service = KnowledgeGraphService()
 
-        # Generate AI response
-        ai_response = openai_service.generate_response(user_message)
+        # Generate AI response with the earlier turns as context
+        context = ContextBuilder(openai_service).build(conversation_id)
+        ai_response, topics = openai_service.generate_turn(
+            user_message,
+            use_cache=_data_flag(request, 'use_cache'),
+            context=context,
+            with_topics=topic_extractor is None
+        )
 
         # Update conversation
         conversation = conv_service.update_conversation(
             conversation_id,
-            f"\nUser: {user_message}\nAI: {ai_response}"
+            [(Message.USER, user_message), (Message.ASSISTANT, ai_response)]
         )
 
-        # Update knowledge graph
-        topics = openai_service.extract_topics(user_message + " " + ai_response)
-        graph_data = graph_service.process_topics(topics, conversation_id)
-        
-        KnowledgeGraph.objects.create(
-            conversation_id=conversation_id,
-            graph_data=graph_data
-        )
+        # Update knowledge graph in the background
+        graph_job = enqueue_graph_job(conversation_id, user_message, ai_response, topics, topic_extractor)
 
         return Response({
             'response': ai_response,
-            'graph_data': graph_data
+            'graph_job_id': graph_job.id
         })
 
+    except OverloadedError as e:
+        print(f"⚠️ Refusing request under load: {str(e)}")
+        return overloaded_response(e)
     except Conversation.DoesNotExist:
         return Response(
             {'error': 'Conversation not found'}, 
@@ -179,6 +273,121 @@ def chat_response(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+@api_view(['POST'])
+def chat_response_batch(request):
+    """Reply to a list of {conversation_id, message} items, streamed back as NDJSON.
+
+    One line per item, in the order they finish, each carrying the item's
+    index; then a final line with "done": true and the totals.
+    """
+    items = request.data.get('items')
+    topic_extractor = request.data.get('topic_extractor')
+
+    if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+        return Response(
+            {'error': 'items must be a non-empty list of {conversation_id, message} objects'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(items) > settings.BATCH_CHAT_MAX_ITEMS:
+        return Response(
+            {'error': f"At most {settings.BATCH_CHAT_MAX_ITEMS} items per batch"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if error := _invalid_extractor(topic_extractor):
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
+
+    runner = BatchChatRunner(get_openai_service(), concurrency=settings.BATCH_CHAT_CONCURRENCY)
+    try:
+        results = runner.run(
+            items,
+            use_cache=_data_flag(request, 'use_cache'),
+            topic_extractor=topic_extractor
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    # An async generator, so each line is sent as soon as its item finishes
+    async def lines():
+        try:
+            async for result in results:
+                yield json.dumps(result, cls=DjangoJSONEncoder) + "\n"
+        finally:
+            # Stops the batch when the client disconnects
+            await results.aclose()
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@api_view(['POST'])
+def chat_response_stream(request):
+    """Stream the AI reply as Server-Sent Events while it is generated"""
+    conversation_id = request.data.get('conversation_id')
+    user_message = request.data.get('message')
+    use_cache = _data_flag(request, 'use_cache')
+    topic_extractor = request.data.get('topic_extractor')
+
+    if not user_message:
+        return Response(
+            {'error': 'No message provided'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if error := _invalid_extractor(topic_extractor):
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
+    if not Conversation.objects.filter(id=conversation_id).exists():
+        return Response(
+            {'error': 'Conversation not found'}, 
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    openai_service = get_openai_service()
+    conv_service = ConversationService()
+    try:
+        context = ContextBuilder(openai_service).build(conversation_id)
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+    # An async generator: under ASGI a sync one would be read to the end
+    # before anything is sent
+    async def events():
+        parts = []
+        try:
+            async for token in openai_service.astream_response(user_message, use_cache=use_cache, context=context):
+                parts.append(token)
+                yield _sse('token', {'token': token})
+
+            # Persist the assembled reply once the stream has finished
+            ai_response = ''.join(parts).strip()
+            await sync_to_async(conv_service.update_conversation)(
+                conversation_id,
+                [(Message.USER, user_message), (Message.ASSISTANT, ai_response)]
+            )
+            graph_job = await sync_to_async(enqueue_graph_job)(
+                conversation_id, user_message, ai_response, extractor=topic_extractor
+            )
+
+            yield _sse('done', {
+                'response': ai_response,
+                'graph_job_id': graph_job.id
+            })
+        except Exception as e:
+            print(f"❌ Streaming error: {str(e)}")
+            yield _sse('error', {'error': str(e)})
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['POST'])
 def voice_output(request):
     """Convert text to speech"""
@@ -190,37 +399,124 @@ def voice_output(request):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        tts_service = TTSService()
+        tts_service = get_tts_service()
         audio_data = tts_service.synthesize_speech(text)
 
         return Response({
-            'audio_data': audio_data
+            'audio_data': base64.b64encode(audio_data).decode('utf-8')
         })
+    except OverloadedError as e:
+        print(f"⚠️ Refusing request under load: {str(e)}")
+        return overloaded_response(e)
     except Exception as e:
         return Response(
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+def voice_output_stream(request):
+    """Stream synthesised speech sentence by sentence as chunked MP3"""
+    text = request.data.get('text')
+    if not text:
+        return Response(
+            {'error': 'No text provided'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    tts_service = get_tts_service()
+    response = StreamingHttpResponse(
+        tts_service.asynthesize_stream(text),
+        content_type='audio/mpeg'
+    )
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def _query_flag(request, name, default=True):
+    return _parse_flag(request.query_params.get(name), default)
+
 @api_view(['GET'])
 def get_conversation_history(request, user_id):
-    """Get conversation history for a user"""
+    """Get conversation history for a user, one keyset-paginated page at a time"""
     try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+        include_graphs = _query_flag(request, 'include_graphs')
+        include_transcripts = _query_flag(request, 'include_transcripts')
+
         conv_service = ConversationService()
-        history = conv_service.get_conversation_history(user_id)
-        
-        return Response({
-            'conversations': [{
+        history, next_cursor = conv_service.get_conversation_history(
+            user_id,
+            cursor=request.query_params.get('cursor'),
+            limit=limit,
+            include_graphs=include_graphs,
+            include_transcripts=include_transcripts
+        )
+
+        conversations = []
+        for conv in history:
+            item = {
                 'id': conv.id,
-                'transcript': conv.transcript,
                 'created_at': conv.created_at,
-                'knowledge_graphs': [{
-                    'id': graph.id,
-                    'graph_data': graph.graph_data
-                } for graph in conv.knowledgegraph_set.all()]
-            } for conv in history]
+                'knowledge_graphs': [
+                    {'id': graph.id, 'graph_data': graph.graph_data}
+                    if include_graphs else {'id': graph.id}
+                    for graph in conv.knowledgegraph_set.all()
+                ]
+            }
+            if include_transcripts:
+                item['transcript'] = conv.transcript
+            conversations.append(item)
+
+        return Response({
+            'conversations': conversations,
+            'next_cursor': next_cursor
         })
 
+    except ValueError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+@api_view(['GET'])
+def search(request):
+    """Full-text search over messages (type=messages) or conversation topics (type=topics).
+
+    Results are ranked best first and paginated with an opaque cursor.
+    Snippets are HTML-escaped with the matched terms wrapped in <mark>.
+    """
+    try:
+        limit = min(int(request.query_params.get('limit', 20)), 100)
+        user_id = request.query_params.get('user_id')
+
+        results, next_cursor = SearchService().search(
+            request.query_params.get('q'),
+            kind=request.query_params.get('type', 'messages'),
+            user_id=int(user_id) if user_id else None,
+            cursor=request.query_params.get('cursor'),
+            limit=max(limit, 1)
+        )
+
+        return Response({
+            'results': results,
+            'next_cursor': next_cursor
+        })
+
+    except ValueError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except NotImplementedError as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
     except Exception as e:
         return Response(
             {'error': str(e)}, 
@@ -231,11 +527,12 @@ def get_conversation_history(request, user_id):
 def get_knowledge_graph(request, conversation_id):
     """Get knowledge graph for a specific conversation"""
     try:
-        graphs = KnowledgeGraph.objects.filter(conversation_id=conversation_id)
+        graphs = KnowledgeGraph.objects.filter(conversation_id=conversation_id).order_by('created_at')
         
         return Response({
             'graphs': [{
                 'id': graph.id,
+                'version': graph.version,
                 'graph_data': graph.graph_data,
                 'created_at': graph.created_at
             } for graph in graphs]
@@ -247,6 +544,135 @@ def get_knowledge_graph(request, conversation_id):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['GET'])
+def get_merged_knowledge_graph(request, conversation_id):
+    """Get the merged graph for a conversation, or only the changes since ?since=<version>"""
+    try:
+        since = request.query_params.get('since')
+        since = int(since) if since is not None else None
+
+        return Response(ConversationService.get_graph(conversation_id, since=since))
+
+    except ValueError:
+        return Response(
+            {'error': 'since must be an integer version'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
+def _topic_not_found(topic):
+    return Response(
+        {'error': f"Topic not found: {topic}"}, 
+        status=status.HTTP_404_NOT_FOUND
+    )
+
+@api_view(['GET'])
+def topic_neighbours(request):
+    """Topics directly connected to ?topic=, optionally by ?direction=out|in|both"""
+    topic = request.query_params.get('topic')
+    direction = request.query_params.get('direction', 'both')
+    if not topic or direction not in ('out', 'in', 'both'):
+        return Response(
+            {'error': 'topic is required and direction must be out, in or both'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        return Response({
+            'topic': topic,
+            'neighbours': get_graph_index().neighbours(topic, direction)
+        })
+    except KeyError:
+        return _topic_not_found(topic)
+
+@api_view(['GET'])
+def topic_expand(request):
+    """Every topic within ?hops= edges of ?topic="""
+    topic = request.query_params.get('topic')
+    try:
+        hops = int(request.query_params.get('hops', 1))
+    except ValueError:
+        hops = -1
+    if not topic or not 1 <= hops <= settings.GRAPH_INDEX_MAX_HOPS:
+        return Response(
+            {'error': f"topic is required and hops must be between 1 and {settings.GRAPH_INDEX_MAX_HOPS}"}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        return Response(get_graph_index().expand(topic, hops))
+    except KeyError:
+        return _topic_not_found(topic)
+
+@api_view(['GET'])
+def topic_path(request):
+    """Shortest path between ?source= and ?target="""
+    source = request.query_params.get('source')
+    target = request.query_params.get('target')
+    if not source or not target:
+        return Response(
+            {'error': 'source and target are required'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    try:
+        path = get_graph_index().shortest_path(source, target)
+    except KeyError as e:
+        return _topic_not_found(e.args[0])
+
+    return Response({
+        'source': source,
+        'target': target,
+        'path': path,
+        'length': len(path) - 1 if path else None
+    })
+
+@api_view(['GET'])
+def topic_components(request):
+    """Connected components of the topic graph, largest first"""
+    try:
+        min_size = int(request.query_params.get('min_size', 1))
+    except ValueError:
+        return Response(
+            {'error': 'min_size must be an integer'}, 
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    index = get_graph_index()
+    components = index.components(min_size=min_size)
+
+    return Response({
+        'count': len(components),
+        'components': components,
+        'stats': index.stats()
+    })
+
+@api_view(['GET'])
+def get_graph_job_status(request, conversation_id):
+    """Poll the background knowledge graph jobs for a conversation"""
+    try:
+        jobs = graph_job_queue.status(conversation_id)
+        if not jobs:
+            return Response(
+                {'error': 'No graph jobs found for this conversation'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return Response({
+            'conversation_id': conversation_id,
+            'status': jobs[-1].status,
+            'jobs': [job.to_dict() for job in jobs]
+        })
+
+    except Exception as e:
+        return Response(
+            {'error': str(e)}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+
 @api_view(['DELETE'])
 def delete_conversation(request, conversation_id):
     """Delete a conversation and its associated graphs"""
@@ -264,4 +690,44 @@ def delete_conversation(request, conversation_id):
         return Response(
             {'error': str(e)}, 
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+@api_view(['GET'])
+def health(request):
+    """Report the state of the shared upstream clients and their circuit breakers"""
+    if request.query_params.get('warm_up'):
+        results = registry.warm_up()
+    else:
+        results = registry.health()
+    upstreams = upstream_stats()
+
+    healthy = (
+        all(result == 'ok' for result in results.values())
+        and all(upstream['state'] != OPEN for upstream in upstreams.values())
+    )
+    return Response(
+        {
+            'status': 'ok' if healthy else 'degraded',
+            'clients': results,
+            'upstreams': upstreams,
+            'load': admission_stats()
+        },
+        status=status.HTTP_200_OK if healthy else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+@require_GET
+def metrics(request):
+    """Stage and request latency histograms in Prometheus text format"""
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@api_view(['GET'])
+def cache_stats(request):
+    """Hit/miss counters for the response caches"""
+    tts_cache = get_tts_service().cache
+    openai_cache = get_openai_service().cache
+    return Response({
+        'tts': tts_cache.stats() if tts_cache else None,
+        'openai': openai_cache.stats() if openai_cache else None
+    })
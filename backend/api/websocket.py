@@ -0,0 +1,233 @@
+"""WebSocket voice sessions served directly on the ASGI app.
+
+Protocol (one socket carries any number of turns):
+
+    client → {"type": "start", "encoding": "WEBM_OPUS", "sample_rate": 48000}
+    client → binary audio frames, as they are recorded
+    client → {"type": "stop"}
+    server → {"type": "partial", "transcript": ...} while the user speaks
+    server → {"type": "final", "transcript": ...}
+    server → {"type": "response", "conversation_id": ..., "response": ..., "graph_job_id": ...}
+    server → binary MP3 frames, then {"type": "audio_end"}
+
+A first binary frame without a "start" message starts an utterance with
+the default settings. Connect with ?conversation_id=<id> to continue an
+existing conversation; a non-numeric ID is refused with close code 4400.
+"""
+import asyncio
+import json
+import queue
+import threading
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Message
+from .services.client_registry import get_stt_service, get_openai_service, get_tts_service
+from .services.context_builder import ContextBuilder
+from .services.conversation_service import ConversationService
+from .services.graph_jobs import enqueue_graph_job
+
+VOICE_SESSION_PATH = '/ws/voice/'
+DEV_USER_ID = 1
+
+
+class Utterance:
+    """Feeds audio frames to a streaming recogniser running on its own thread"""
+
+    def __init__(self, stt_service, encoding, sample_rate):
+        self.stt_service = stt_service
+        self.encoding = encoding
+        self.sample_rate = sample_rate
+        self.events = asyncio.Queue()
+        self._audio = queue.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._recognize, daemon=True)
+        self._thread.start()
+
+    def feed(self, chunk):
+        self._audio.put(chunk)
+
+    def finish(self):
+        self._audio.put(None)
+
+    def _chunks(self):
+        while True:
+            chunk = self._audio.get()
+            if chunk is None:
+                return
+            yield chunk
+
+    def _emit(self, kind, value=None):
+        self._loop.call_soon_threadsafe(self.events.put_nowait, (kind, value))
+
+    def _recognize(self):
+        try:
+            results = self.stt_service.streaming_recognize(
+                self._chunks(),
+                encoding=self.encoding,
+                sample_rate_hertz=self.sample_rate
+            )
+            for transcript, is_final in results:
+                self._emit('final' if is_final else 'partial', transcript)
+        except Exception as e:
+            print(f"STT Streaming Error: {str(e)}")
+            self._emit('error', str(e))
+        finally:
+            self._emit('end')
+
+
+class VoiceSession:
+    """Per-connection state: the conversation, the current utterance and warm clients"""
+
+    def __init__(self, send, conversation_id=None, user_id=DEV_USER_ID,
+                 stt_service=None, openai_service=None, tts_service=None, conv_service=None):
+        self.send = send
+        self.conversation_id = conversation_id
+        self.user_id = user_id
+        self.stt_service = stt_service or get_stt_service()
+        self.openai_service = openai_service or get_openai_service()
+        self.tts_service = tts_service or get_tts_service()
+        self.conv_service = conv_service or ConversationService()
+        self.utterance = None
+        self.turns = 0
+        self._tasks = set()
+        # Recognition of the next utterance may overlap a reply, but turns
+        # are answered one at a time so the conversation stays in order
+        self._turn_lock = asyncio.Lock()
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data, cls=DjangoJSONEncoder)})
+
+    async def send_bytes(self, data):
+        await self.send({'type': 'websocket.send', 'bytes': data})
+
+    async def handle_text(self, message):
+        if not isinstance(message, dict):
+            await self.send_json({'type': 'error', 'error': 'Messages must be JSON objects'})
+            return
+        kind = message.get('type')
+        if kind == 'start':
+            try:
+                sample_rate = int(message.get('sample_rate', 48000))
+            except (TypeError, ValueError):
+                await self.send_json({'type': 'error', 'error': 'sample_rate must be an integer'})
+                return
+            self.start_utterance(
+                encoding=message.get('encoding', 'WEBM_OPUS'),
+                sample_rate=sample_rate
+            )
+        elif kind == 'stop':
+            if self.utterance:
+                self.utterance.finish()
+                self.utterance = None
+        else:
+            await self.send_json({'type': 'error', 'error': f"Unknown message type: {kind}"})
+
+    async def handle_audio(self, chunk):
+        if self.utterance is None:
+            self.start_utterance()
+        self.utterance.feed(chunk)
+
+    def start_utterance(self, encoding='WEBM_OPUS', sample_rate=48000):
+        if self.utterance:
+            self.utterance.finish()
+        self.utterance = Utterance(self.stt_service, encoding, sample_rate)
+        task = asyncio.ensure_future(self._follow(self.utterance))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _follow(self, utterance):
+        finals = []
+        while True:
+            kind, value = await utterance.events.get()
+            if kind == 'end':
+                break
+            if kind == 'error':
+                await self.send_json({'type': 'error', 'error': value})
+                continue
+            if kind == 'final':
+                finals.append(value)
+            await self.send_json({'type': kind, 'transcript': value})
+
+        transcript = ' '.join(finals).strip()
+        if transcript:
+            async with self._turn_lock:
+                await self.run_turn(transcript)
+
+    async def run_turn(self, user_input):
+        try:
+            context = await sync_to_async(ContextBuilder(self.openai_service).build)(self.conversation_id)
+            ai_response, topics = await self.openai_service.agenerate_turn(user_input, context=context)
+            turn = [(Message.USER, user_input), (Message.ASSISTANT, ai_response)]
+
+            if self.conversation_id is None:
+                conversation = await self.conv_service.asave_conversation(self.user_id, turn)
+                self.conversation_id = conversation.id
+            else:
+                await self.conv_service.aupdate_conversation(self.conversation_id, turn)
+            graph_job = await sync_to_async(enqueue_graph_job)(
+                self.conversation_id, user_input, ai_response, topics
+            )
+            self.turns += 1
+
+            await self.send_json({
+                'type': 'response',
+                'conversation_id': self.conversation_id,
+                'response': ai_response,
+                'graph_job_id': graph_job.id
+            })
+
+            async for chunk in self.tts_service.asynthesize_stream(ai_response):
+                await self.send_bytes(chunk)
+            await self.send_json({'type': 'audio_end'})
+
+        except Exception as e:
+            print(f"❌ Voice session error: {str(e)}")
+            await self.send_json({'type': 'error', 'error': str(e)})
+
+    async def close(self):
+        if self.utterance:
+            self.utterance.finish()
+            self.utterance = None
+        # Let in-flight turns finish so their replies are persisted
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def voice_session_application(scope, receive, send):
+    """Raw ASGI handler for websocket connections"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    if scope['path'] != VOICE_SESSION_PATH:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    conversation_id = None
+    if 'conversation_id' in query:
+        try:
+            conversation_id = int(query['conversation_id'][0])
+        except ValueError:
+            await send({'type': 'websocket.close', 'code': 4400})
+            return
+
+    await send({'type': 'websocket.accept'})
+    session = VoiceSession(send, conversation_id=conversation_id)
+
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes') is not None:
+                await session.handle_audio(message['bytes'])
+            elif message.get('text') is not None:
+                try:
+                    await session.handle_text(json.loads(message['text']))
+                except json.JSONDecodeError:
+                    await session.send_json({'type': 'error', 'error': 'Invalid JSON message'})
+    finally:
+        await session.close()
@@ -57,6 +57,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
+    'api.middleware.AdmissionControlMiddleware',
 ]
 
 ROOT_URLCONF = 'backend.urls'
@@ -83,16 +85,30 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.environ.get('DB_NAME', 'vdchatbotdb'),
-        'USER': os.environ.get('DB_USER', 'vdchatbotuser'),
-        'PASSWORD': os.environ.get('DB_PASSWORD', 'password'),
-        'HOST': os.environ.get('DB_HOST', 'localhost'),
-        'PORT': os.environ.get('DB_PORT', '5432'),
+# DB_ENGINE is 'postgresql' or 'sqlite3' (local runs and benchmarks; DB_NAME is
+# then the database file)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'postgresql')
+
+if DB_ENGINE == 'sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', str(BASE_DIR / 'db.sqlite3')),
+            # Writers queue for the lock instead of failing under concurrent turns
+            'OPTIONS': {'timeout': 20, 'transaction_mode': 'IMMEDIATE'},
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'vdchatbotdb'),
+            'USER': os.environ.get('DB_USER', 'vdchatbotuser'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', 'password'),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+        }
     }
-}
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -143,4 +159,174 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
 ]
 
-CORS_ALLOW_CREDENTIALS = True
\ No newline at end of file
+CORS_ALLOW_CREDENTIALS = True
+CORS_EXPOSE_HEADERS = ['Server-Timing']
+
+# Shared upstream clients (see api/services/client_registry.py)
+
+NEO4J_URI = os.environ.get('NEO4J_URI', 'neo4j://localhost:7687')
+NEO4J_USER = os.environ.get('NEO4J_USER', 'neo4j')
+NEO4J_PASSWORD = os.environ.get('NEO4J_PASSWORD', 'password')
+NEO4J_MAX_CONNECTION_POOL_SIZE = int(os.environ.get('NEO4J_MAX_CONNECTION_POOL_SIZE', '50'))
+
+OPENAI_MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '20'))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', '10'))
+
+# Open upstream connections when the app starts instead of on the first request
+WARM_UP_CLIENTS = os.environ.get('WARM_UP_CLIENTS', 'False') == 'True'
+CLIENT_WARM_UP_TIMEOUT = float(os.environ.get('CLIENT_WARM_UP_TIMEOUT', '5'))
+
+# Largest number of nodes or relationships sent in a single Neo4j transaction
+NEO4J_WRITE_BATCH_SIZE = int(os.environ.get('NEO4J_WRITE_BATCH_SIZE', '500'))
+
+# Background knowledge-graph jobs (see api/services/graph_jobs.py).
+# GRAPH_JOB_STORE is 'memory' or 'database'; the latter lets any process poll job status
+# (jobs still run in-process and are not recovered after a restart).
+GRAPH_JOB_STORE = os.environ.get('GRAPH_JOB_STORE', 'memory')
+GRAPH_JOB_WORKERS = int(os.environ.get('GRAPH_JOB_WORKERS', '2'))
+GRAPH_JOB_MAX_RETRIES = int(os.environ.get('GRAPH_JOB_MAX_RETRIES', '3'))
+GRAPH_JOB_RETRY_BACKOFF = float(os.environ.get('GRAPH_JOB_RETRY_BACKOFF', '1.0'))
+GRAPH_JOB_SHUTDOWN_TIMEOUT = float(os.environ.get('GRAPH_JOB_SHUTDOWN_TIMEOUT', '10'))
+
+# Sentence-chunked streaming TTS: sentences synthesised ahead per stream
+TTS_STREAM_PARALLELISM = int(os.environ.get('TTS_STREAM_PARALLELISM', '3'))
+
+# Synthesised-audio cache: in-memory LRU per process, plus an optional disk
+# tier shared by all worker processes (set TTS_CACHE_DIR to enable it)
+TTS_CACHE_ENABLED = os.environ.get('TTS_CACHE_ENABLED', 'True') == 'True'
+TTS_CACHE_MEMORY_BYTES = int(os.environ.get('TTS_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR')
+TTS_CACHE_DISK_BYTES = int(os.environ.get('TTS_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+
+# OpenAI reply/topic cache. OPENAI_CACHE_MATCHER optionally names a
+# near-duplicate matcher class, e.g. 'api.services.llm_cache.TokenJaccardMatcher'
+OPENAI_CACHE_ENABLED = os.environ.get('OPENAI_CACHE_ENABLED', 'True') == 'True'
+OPENAI_CACHE_MAX_ENTRIES = int(os.environ.get('OPENAI_CACHE_MAX_ENTRIES', '10000'))
+OPENAI_CACHE_TTL = float(os.environ.get('OPENAI_CACHE_TTL', '3600'))
+OPENAI_CACHE_MATCHER = os.environ.get('OPENAI_CACHE_MATCHER')
+OPENAI_CACHE_SIMILARITY = float(os.environ.get('OPENAI_CACHE_SIMILARITY', '0.9'))
+
+# In-process topic graph index. GRAPH_INDEX_SOURCE is 'database' or 'neo4j'
+# (falls back to the database when Neo4j is unreachable)
+GRAPH_INDEX_SOURCE = os.environ.get('GRAPH_INDEX_SOURCE', 'database')
+GRAPH_INDEX_REFRESH_SECONDS = float(os.environ.get('GRAPH_INDEX_REFRESH_SECONDS', '300'))
+GRAPH_INDEX_MAX_HOPS = int(os.environ.get('GRAPH_INDEX_MAX_HOPS', '4'))
+
+# Topic canonicalisation before graph writes (see api/services/topic_canonicalizer.py).
+# TOPIC_ALIASES_FILE optionally names a JSON object of {"alias": "Canonical Name"}
+TOPIC_CANONICALIZATION = os.environ.get('TOPIC_CANONICALIZATION', 'True') == 'True'
+TOPIC_ALIASES_FILE = os.environ.get('TOPIC_ALIASES_FILE')
+TOPIC_FUZZY_THRESHOLD = float(os.environ.get('TOPIC_FUZZY_THRESHOLD', '0.85'))
+
+# Return the reply and its topics from one structured completion instead of a
+# reply call plus a topic-extraction call. Needs a model with strict JSON
+# schema support; the streaming chat endpoint always uses separate calls.
+OPENAI_COMBINED_TURN = os.environ.get('OPENAI_COMBINED_TURN', 'True') == 'True'
+OPENAI_COMBINED_MODEL = os.environ.get('OPENAI_COMBINED_MODEL', 'gpt-4o-mini')
+
+# Topic extraction for graph jobs when the reply did not already carry topics:
+# 'llm' (OpenAI), 'local' (network-free keyphrases) or 'auto' (OpenAI, then
+# local when that yields nothing). Requests may override it with topic_extractor.
+TOPIC_EXTRACTOR = os.environ.get('TOPIC_EXTRACTOR', 'auto')
+
+# Conversation context sent with each reply: recent messages verbatim up to
+# CONTEXT_TOKEN_BUDGET, older ones folded into a rolling summary once they
+# reach CONTEXT_SUMMARY_BATCH_TOKENS
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', '1500'))
+CONTEXT_SUMMARY_BATCH_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_BATCH_TOKENS', '500'))
+
+# Audio preprocessing before STT (see api/utils/audio.py): uploads are decoded,
+# trimmed of silence and resampled to STT_TARGET_SAMPLE_RATE mono. Formats other
+# than WAV need ffmpeg; without it they are sent unchanged.
+AUDIO_PREPROCESSING = os.environ.get('AUDIO_PREPROCESSING', 'True') == 'True'
+STT_TARGET_SAMPLE_RATE = int(os.environ.get('STT_TARGET_SAMPLE_RATE', '16000'))
+VAD_THRESHOLD_DB = float(os.environ.get('VAD_THRESHOLD_DB', '-45'))
+VAD_PADDING_MS = int(os.environ.get('VAD_PADDING_MS', '200'))
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+FFMPEG_TIMEOUT = float(os.environ.get('FFMPEG_TIMEOUT', '10'))
+
+# Uploads: files above FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to a temporary
+# file in chunks instead of memory, and files above AUDIO_UPLOAD_MAX_BYTES are
+# refused. Recordings are split at silences into segments of at most
+# STT_SEGMENT_MAX_SECONDS (the recogniser's synchronous limit is 60s; shorter
+# segments parallelise better), recognised STT_SEGMENT_WORKERS at a time.
+FILE_UPLOAD_HANDLERS = [
+    'api.utils.uploads.UploadSizeLimitHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.environ.get('FILE_UPLOAD_MAX_MEMORY_SIZE', str(1024 * 1024)))
+AUDIO_UPLOAD_MAX_BYTES = int(os.environ.get('AUDIO_UPLOAD_MAX_BYTES', str(50 * 1024 * 1024)))
+STT_SEGMENT_MAX_SECONDS = int(os.environ.get('STT_SEGMENT_MAX_SECONDS', '15'))
+STT_SEGMENT_MIN_SILENCE_MS = int(os.environ.get('STT_SEGMENT_MIN_SILENCE_MS', '500'))
+STT_SEGMENT_WORKERS = int(os.environ.get('STT_SEGMENT_WORKERS', '4'))
+
+# Batch chat endpoint: conversations answered in parallel, and the largest batch accepted
+BATCH_CHAT_CONCURRENCY = int(os.environ.get('BATCH_CHAT_CONCURRENCY', '8'))
+BATCH_CHAT_MAX_ITEMS = int(os.environ.get('BATCH_CHAT_MAX_ITEMS', '5000'))
+
+# Upstream resilience (see api/services/resilience.py): a deadline per attempt,
+# up to UPSTREAM_RETRIES retries of transient failures with jittered backoff,
+# and a circuit breaker per upstream that fails fast after
+# CIRCUIT_FAILURE_THRESHOLD consecutive failures for CIRCUIT_RESET_TIMEOUT
+# seconds. OPENAI_HEDGE_AFTER, when set, sends a second reply request if the
+# first has not answered within that many seconds.
+OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '30'))
+STT_TIMEOUT = float(os.environ.get('STT_TIMEOUT', '30'))
+TTS_TIMEOUT = float(os.environ.get('TTS_TIMEOUT', '15'))
+NEO4J_TIMEOUT = float(os.environ.get('NEO4J_TIMEOUT', '10'))
+UPSTREAM_TIMEOUTS = {
+    'openai': OPENAI_TIMEOUT,
+    'stt': STT_TIMEOUT,
+    'tts': TTS_TIMEOUT,
+    'neo4j': NEO4J_TIMEOUT,
+}
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', '2'))
+UPSTREAM_RETRY_BASE_DELAY = float(os.environ.get('UPSTREAM_RETRY_BASE_DELAY', '0.2'))
+UPSTREAM_RETRY_MAX_DELAY = float(os.environ.get('UPSTREAM_RETRY_MAX_DELAY', '2'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get('CIRCUIT_RESET_TIMEOUT', '30'))
+OPENAI_HEDGE_AFTER = (
+    float(os.environ['OPENAI_HEDGE_AFTER']) if os.environ.get('OPENAI_HEDGE_AFTER') else None
+)
+
+# Per-stage latency metrics (see api/utils/metrics.py), served in Prometheus
+# format at /api/metrics/. Histograms are per process. SERVER_TIMING_HEADER adds
+# each request's stage timings to its response as a Server-Timing header.
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'True') == 'True'
+
+# Admission control and load shedding (see api/services/admission.py).
+# Turn requests beyond ADMISSION_MAX_CONCURRENT queue (at most
+# ADMISSION_MAX_WAITING, for ADMISSION_WAIT_TIMEOUT seconds) and are otherwise
+# refused with 503. Each upstream likewise allows UPSTREAM_CONCURRENCY calls at
+# once. OpenAI calls spend from a budget of OPENAI_TOKENS_PER_MINUTE (0 for no
+# limit), of which OPENAI_TOKEN_RESERVE is kept for replies. Optional stages are
+# shed from DEGRADE_REDUCED_AT of the admission limit. Graph jobs are deferred
+# by GRAPH_JOB_DEFER_SECONDS at a time while load is above DEGRADE_CRITICAL_AT
+# (1.0: every slot busy and requests queueing).
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', '32'))
+ADMISSION_MAX_WAITING = int(os.environ.get('ADMISSION_MAX_WAITING', '64'))
+ADMISSION_WAIT_TIMEOUT = float(os.environ.get('ADMISSION_WAIT_TIMEOUT', '5'))
+ADMISSION_CONTROLLED_VIEWS = [
+    'voice-input',
+    'voice-input-async',
+    'chat-response',
+    'chat-response-stream',
+    'chat-response-batch',
+    'voice-output',
+    'voice-output-stream',
+]
+UPSTREAM_CONCURRENCY = {
+    'openai': int(os.environ.get('OPENAI_CONCURRENCY', str(OPENAI_MAX_CONNECTIONS))),
+    'stt': int(os.environ.get('STT_CONCURRENCY', '16')),
+    'tts': int(os.environ.get('TTS_CONCURRENCY', '16')),
+    'neo4j': int(os.environ.get('NEO4J_CONCURRENCY', '8')),
+}
+UPSTREAM_MAX_WAITING = int(os.environ.get('UPSTREAM_MAX_WAITING', '64'))
+UPSTREAM_WAIT_TIMEOUT = float(os.environ.get('UPSTREAM_WAIT_TIMEOUT', '5'))
+# 200k is the gpt-4o-mini limit on OpenAI's first usage tier
+OPENAI_TOKENS_PER_MINUTE = int(os.environ.get('OPENAI_TOKENS_PER_MINUTE', '200000'))
+OPENAI_TOKEN_RESERVE = float(os.environ.get('OPENAI_TOKEN_RESERVE', '0.2'))
+DEGRADE_REDUCED_AT = float(os.environ.get('DEGRADE_REDUCED_AT', '0.75'))
+DEGRADE_CRITICAL_AT = float(os.environ.get('DEGRADE_CRITICAL_AT', '1.0'))
+GRAPH_JOB_DEFER_SECONDS = float(os.environ.get('GRAPH_JOB_DEFER_SECONDS', '5'))